@@ -1,4 +1,5 @@
 using Microsoft.AspNetCore.Mvc;
+using Microsoft.Net.Http.Headers;
 using System.Text.Json;
 
 namespace DMS.Controllers
@@ -381,12 +382,16 @@ namespace DMS.Controllers
 
                 var contentType = GetContentType(fileName ?? Path.GetFileName(filePath));
 
+                // ETag from size and last write time, so callers holding a copy can
+                // revalidate with If-None-Match and get a 304 instead of the file
+                var entityTag = new EntityTagHeaderValue($"\"{fileInfo.Length:x}-{fileInfo.LastWriteTimeUtc.Ticks:x}\"");
+
                 // Return file stream
                 var fileStream = new FileStream(filePath, FileMode.Open, FileAccess.Read, FileShare.Read);
 
                 _logger.LogInformation($"Successfully streaming file: {fileName} for client: {clientId}");
 
-                return File(fileStream, contentType, fileName, enableRangeProcessing: true);
+                return File(fileStream, contentType, fileName, fileInfo.LastWriteTimeUtc, entityTag, enableRangeProcessing: true);
             }
             catch (Exception ex)
             {
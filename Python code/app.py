@@ -1,26 +1,135 @@
 # ----------------------
 # Imports and App Setup
 # ----------------------
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import pandas as pd
-from werkzeug.utils import secure_filename
-from rapidfuzz import process, fuzz
-import re
-from const.field_keywords import FIELD_KEYWORDS
-import joblib
-import os
+import functools
+from io import BytesIO
+from columnar_format import COLUMNAR_FORMATS, columnar_available, encode, negotiate_format
+from dms_client import SpooledUpload, get_dms_client
+from header_templates import shared_template_store
+from instrumentation import begin_request, count, finish_request, metrics, stage
+from jobs import DONE, FAILED, create_job_manager, describe_job
+from json_serialization import FastJSONProvider, dumps
+from model_registry import get_registry
+from model_store import active_model_path
+from prediction_cache import shared_prediction_cache
+from workbook_cache import create_workbook_cache, result_etag
+from workbook_formats import UnsupportedWorkbookFormat
+from sheet_processing import (
+    KEYWORD_INDEX,
+    KeywordIndex,
+    best_column_match,
+    categorize_excel_sheets_fuzzy,
+    map_columns,
+    preprocess_col_name,
+    stream_excel_sheets,
+    stream_workbook_records
+)
 
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:8501", "*"])
+# orjson-based encoding; same output as Flask's default, but NaN is written as null
+app.json = FastJSONProvider(app)
+CORS(app, origins=["http://localhost:8501", "*"],
+     expose_headers=["X-Unique-Descriptions", "X-Model-Version", "Server-Timing"])
 
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "saved_model")
-MODEL_PATH = os.path.join(MODEL_DIR, "ultra_high_accuracy_classifier.joblib")
-try:
-    model = joblib.load(MODEL_PATH)
-except Exception as e:
-    model = None
-    print(f"Error loading model: {e}")
+# The registry loads and warms the newest model artifact and swaps in new ones
+# as they appear in saved_model; `model` always points at the serving model
+model = None
+model_registry = get_registry()
+
+
+def use_model(model_version):
+    global model
+    model = model_version.model
+
+
+model_registry.add_listener(use_model)
+model_registry.check()
+model_registry.start()
+prediction_cache = shared_prediction_cache(active_model_path(), version_fn=model_registry.version_of)
+workbook_cache = create_workbook_cache()
+# Large workbooks can be processed as background jobs by a pool of worker processes
+# Results are encoded by the job's worker process, as app.json would encode them
+job_manager = create_job_manager(functools.partial(dumps, sort_keys=app.json.sort_keys, http_dates=True))
+
+metrics.register_collector('prediction_cache', prediction_cache.stats)
+metrics.register_collector('workbook_cache', workbook_cache.stats)
+metrics.register_collector('model_registry', model_registry.stats)
+metrics.register_collector('jobs', job_manager.stats)
+metrics.register_collector('header_templates', lambda: shared_template_store().stats())
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """
+    True if the client opted into a streamed response, with ?stream=true or an
+    Accept: application/x-ndjson header.
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return NDJSON_MIMETYPE in request.headers.get('Accept', '')
+
+
+def requested_columnar_format():
+    """
+    'arrow' or 'parquet' if the client asked for a columnar response, with
+    ?format= or an Accept header preferring it, else None for JSON.
+    """
+    return negotiate_format(request.accept_mimetypes, request.args.get('format'))
+
+
+def columnar_unavailable():
+    return jsonify({'error': 'Arrow and Parquet responses need pyarrow on the server'}), 406
+
+
+def columnar_response(result, response_format):
+    """A columnar result encoded as an Arrow IPC stream or Parquet file."""
+    with stage('columnar_encode'):
+        body = encode(result, response_format)
+    return Response(body, mimetype=COLUMNAR_FORMATS[response_format])
+
+
+def ndjson_response(records):
+    """Stream records as newline-delimited JSON, one line per record as it is produced."""
+    def generate():
+        for record in records:
+            yield app.json.dumps_bytes(record) + b'\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+@app.after_request
+def add_model_version(response):
+    """Report which model version served the request."""
+    version = model_registry.version_of(model)
+    if version is not None:
+        response.headers['X-Model-Version'] = version
+    return response
+
+
+@app.before_request
+def start_request_timing():
+    g.timing = begin_request(request.url_rule.rule if request.url_rule is not None else 'unmatched')
+
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Report the stage durations in a Server-Timing header. A streamed response only
+    reports the stages finished before its first byte.
+    """
+    timing = g.get('timing')
+    if timing is not None:
+        g.status = response.status_code
+        response.headers['Server-Timing'] = timing.server_timing()
+    return response
+
+
+@app.teardown_request
+def finish_request_timing(error=None):
+    # Runs after a streamed response has been fully sent
+    finish_request(g.get('timing'), status=g.get('status', 500))
 
 # ----------------------
 # API Endpoints
@@ -32,31 +141,90 @@ def get_sheet_data():
     Endpoint to get mapped sheet data for a file from an external API.
     Expects 'clientId', 'filename', and 'currentPeriod' (date range) as query parameters.
     Calls the external document stream API to fetch the file content.
+    With ?stream=true or Accept: application/x-ndjson the sheets are streamed as
+    newline-delimited JSON, ending with a summary record. With ?format=arrow or
+    ?format=parquet (or the matching Accept type) the mapped columns come as an
+    Arrow IPC stream or Parquet file; JSON is the default.
+    Results are cached by file content and period. The file is revalidated with the
+    DMS by ETag instead of downloaded again, and the response carries its own ETag
+    so an unchanged result is answered with 304 Not Modified.
     """
-    import requests
-    from io import BytesIO
     client_id = request.args.get('clientId')
     filename = request.args.get('filename')
     current_period = request.args.get('currentPeriod')  # e.g. '6/4/2025-5/7/2025'
     if not client_id or not filename or not current_period:
         return jsonify({'error': 'Missing clientId, filename, or currentPeriod'}), 400
-    api_url = f"http://localhost:5119/api/Document/stream?clientId={client_id}&filePath={filename}"
+    dms = get_dms_client()
+    document_key = (client_id, filename)
     try:
-        resp = requests.get(api_url)
-        if resp.status_code != 200:
-            return jsonify({'error': f'Failed to fetch file from external API: {resp.text}'}), 502
-        file_stream = BytesIO(resp.content)
-        result = categorize_excel_sheets_fuzzy(file_stream, current_period)
-        return jsonify(result)
+        if wants_ndjson():
+            with stage('dms_download'):
+                resp = dms.stream(client_id, filename)
+            count('dms_bytes', len(resp.content))
+            if resp.status_code != 200:
+                return jsonify({'error': f'Failed to fetch file from external API: {resp.text}'}), 502
+            return ndjson_response(stream_workbook_records(BytesIO(resp.content), current_period,
+                                                           client_id=client_id, filename=filename))
+        response_format = requested_columnar_format()
+        if response_format and not columnar_available():
+            return columnar_unavailable()
+        known = workbook_cache.known_document(document_key)
+        with stage('dms_download'):
+            resp = dms.stream(client_id, filename, etag=known[0] if known else None)
+        count('dms_bytes', len(resp.content))
+        result = None
+        if resp.status_code == 304 and known:
+            workbook_hash = known[1]
+            etag = result_etag(workbook_hash, current_period, response_format)
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+            result = workbook_cache.cached_result(workbook_hash, current_period, columnar=bool(response_format))
+            if result is None:
+                # The result was evicted, so the file itself is needed after all
+                with stage('dms_download'):
+                    resp = dms.stream(client_id, filename)
+                count('dms_bytes', len(resp.content))
+        if result is None:
+            if resp.status_code != 200:
+                return jsonify({'error': f'Failed to fetch file from external API: {resp.text}'}), 502
+            result, workbook_hash = workbook_cache.categorize(BytesIO(resp.content), current_period, client_id,
+                                                              columnar=bool(response_format), filename=filename)
+            if resp.headers.get('ETag'):
+                workbook_cache.remember_document(document_key, resp.headers['ETag'], workbook_hash)
+            etag = result_etag(workbook_hash, current_period, response_format)
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+        if response_format:
+            response = columnar_response(result, response_format)
+        else:
+            with stage('jsonify'):
+                response = jsonify(result)
+        response.vary.add('Accept')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+    except UnsupportedWorkbookFormat as e:
+        return jsonify({'error': str(e)}), 415
     except Exception as e:
         return jsonify({'error': f'Exception occurred: {str(e)}'}), 500
 
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/getData', methods=['POST'])
 def get_data():
     """
     Endpoint to receive an uploaded Excel file, process all sheets,
     and return mapped data for Amount, Date, Description columns.
     Also uploads the file to an external API with clientId.
+    With ?stream=true or Accept: application/x-ndjson the sheets are streamed as
+    newline-delimited JSON, ending with a summary record. ?format=arrow or
+    ?format=parquet (or the matching Accept type) returns an Arrow IPC stream or
+    Parquet file instead of JSON.
     """
     print('request.files:', request.files)
     print('request.form:', request.form)
@@ -69,27 +237,157 @@ def get_data():
     client_id = request.form.get('clientId')
     if not client_id:
         return jsonify({'error': 'Missing clientId in form data'}), 400
-    # Upload the file to the external API
-    import requests
-    files = {'file': (file.filename, file.stream, file.mimetype)}
-    data = {'clientId': client_id}
-    upload_url = 'http://localhost:5119/api/Document/upload'
+    response_format = None if wants_ndjson() else requested_columnar_format()
+    if response_format and not columnar_available():
+        return columnar_unavailable()
+    # Copy the upload once; the DMS upload and the parse each read their own handle,
+    # so the upload runs in the background instead of in front of the parse
+    with stage('spool_upload'):
+        spooled = SpooledUpload(file.stream)
+    count('upload_bytes', spooled.size)
+    upload_future = get_dms_client().submit_upload(client_id, file.filename, spooled, file.mimetype)
+    print('file', file)
+    if wants_ndjson():
+        workbook = spooled.open()
+        records = stream_workbook_records(workbook, client_id=client_id, filename=file.filename)
+        return ndjson_response(stream_with_upload(records, upload_future, spooled, workbook))
     try:
-        upload_resp = requests.post(upload_url, files=files, data=data)
-        if upload_resp.status_code != 200:
-            return jsonify({'error': f'Failed to upload file to external API: {upload_resp.text}'}), 502
+        with spooled.open() as workbook:
+            result, _ = workbook_cache.categorize(workbook, client_id=client_id, columnar=bool(response_format),
+                                                  filename=file.filename)
+        parse_error = None
     except Exception as e:
-        return jsonify({'error': f'Exception during upload: {str(e)}'}), 500
-    # Process the file as before
-    print('file', file)
-    result = categorize_excel_sheets_fuzzy(file)
-    return jsonify(result)
+        parse_error = e
+    try:
+        upload_error = upload_failure(upload_future)
+    finally:
+        spooled.close()
+    if upload_error is not None:
+        return jsonify({'error': upload_error[0]}), upload_error[1]
+    if isinstance(parse_error, UnsupportedWorkbookFormat):
+        return jsonify({'error': str(parse_error)}), 415
+    if parse_error is not None:
+        raise parse_error
+    if response_format:
+        return columnar_response(result, response_format)
+    with stage('jsonify'):
+        return jsonify(result)
+
+
+def upload_failure(upload_future):
+    """Wait for a background DMS upload; returns (message, status) if it failed, else None."""
+    try:
+        upload_resp = upload_future.result()
+    except Exception as e:
+        return f'Exception during upload: {str(e)}', 500
+    if upload_resp.status_code != 200:
+        return f'Failed to upload file to external API: {upload_resp.text}', 502
+    return None
+
+
+def stream_with_upload(records, upload_future, spooled, workbook=None):
+    """
+    Pass the streamed records through, reporting a failed background upload in the
+    final summary record since the response status has already been sent.
+    workbook, the handle the records are read from, is closed when the stream ends.
+    """
+    try:
+        for record in records:
+            if record['type'] == 'summary':
+                upload_error = upload_failure(upload_future)
+                if upload_error is not None:
+                    record['errors'].append({'error': upload_error[0]})
+                    record['processed_count'] += 1
+            yield record
+    finally:
+        records.close()
+        if workbook is not None:
+            workbook.close()
+        # The upload goes ahead even if the client disconnected early; the spooled
+        # copy is removed once it has been sent
+        upload_future.add_done_callback(lambda _: spooled.close())
+
+@app.route('/jobs/getData', methods=['POST'])
+def submit_data_job():
+    """
+    Job version of /getData for large workbooks.
+    Takes the same form fields, stores the upload and returns 202 with a jobId at
+    once. The DMS upload and the processing run in a worker process; poll
+    /jobs/<jobId> for progress and fetch /jobs/<jobId>/result when it is done.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    client_id = request.form.get('clientId')
+    if not client_id:
+        return jsonify({'error': 'Missing clientId in form data'}), 400
+    job_id = job_manager.submit_upload(file.stream, client_id, file.filename, file.mimetype,
+                                       dms_base_url=get_dms_client().base_url)
+    return job_accepted(job_id)
+
+@app.route('/jobs/getSheetData', methods=['POST'])
+def submit_sheet_data_job():
+    """
+    Job version of /getSheetData for large workbooks.
+    Expects 'clientId', 'filename' and 'currentPeriod' as query parameters (or form
+    fields) and returns 202 with a jobId; the DMS download and the processing run
+    in a worker process.
+    """
+    client_id = request.values.get('clientId')
+    filename = request.values.get('filename')
+    current_period = request.values.get('currentPeriod')
+    if not client_id or not filename or not current_period:
+        return jsonify({'error': 'Missing clientId, filename, or currentPeriod'}), 400
+    job_id = job_manager.submit_document(client_id, filename, current_period, dms_base_url=get_dms_client().base_url)
+    return job_accepted(job_id)
+
+
+def job_accepted(job_id):
+    response = jsonify({'jobId': job_id, 'status': 'queued', 'statusUrl': f'/jobs/{job_id}',
+                        'resultUrl': f'/jobs/{job_id}/result'})
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Endpoint to follow a workbook job.
+    Returns its status (queued, running, done or failed), the sheets processed so
+    far out of the total, the sheet in progress and any error.
+    """
+    job = job_manager.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify(describe_job(job))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Endpoint to fetch the result of a finished workbook job, in the same format as
+    the synchronous endpoint. Returns 202 while the job is still running.
+    """
+    job = job_manager.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job['status'] == FAILED:
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != DONE:
+        return jsonify(describe_job(job)), 202
+    result = job_manager.store.read_result(job_id)
+    if result is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return Response(result, mimetype='application/json')
 
 @app.route('/getMappedCategory', methods=['POST'])
 def get_mapped_category():
     """
     Endpoint to receive an array of objects with fields: transactionDescription, id.
     Returns the same array with predicted taxCategories using the model.
+    Each distinct transactionDescription is predicted once; the number of
+    distinct descriptions is reported in the X-Unique-Descriptions header.
     Example input:
     [
         {
@@ -106,136 +404,81 @@ def get_mapped_category():
         return jsonify({'error': 'Input must be a list of objects'}), 400
     if model is None:
         return jsonify({'error': 'Model is not available. Please check server logs.'}), 503
-    result = []
+    # Validate every item before running any predictions
     for item in data:
-        if not all(k in item for k in ['transactionDescription', 'id']):
+        if not isinstance(item, dict) or not all(k in item for k in ['transactionDescription', 'id']):
             return jsonify({'error': 'Each object must contain transactionDescription and id'}), 400
-        description_text = item['transactionDescription']
-        try:
-            description_to_predict = [str(description_text)]
-            prediction = model.predict(description_to_predict)
-            predicted_category = prediction[0]
-            item['taxCategories'] = predicted_category
-        except Exception as e:
+    # Ledgers repeat the same descriptions constantly, so each distinct
+    # description is predicted once and the result fanned out to its items
+    unique_descriptions = list(dict.fromkeys(str(item['transactionDescription']) for item in data))
+    predictions = {}
+    failures = {}
+    try:
+        if unique_descriptions:
+            count('descriptions', len(unique_descriptions))
+            predicted = prediction_cache.predict(model, unique_descriptions)
+            predictions = dict(zip(unique_descriptions, predicted))
+    except Exception:
+        # Retry one description at a time so only the failing ones are flagged
+        for description in unique_descriptions:
+            try:
+                predictions[description] = prediction_cache.predict(model, [description])[0]
+            except Exception as e:
+                failures[description] = f'Prediction failed: {str(e)}'
+    result = []
+    for item in data:
+        description_text = str(item['transactionDescription'])
+        if description_text in predictions:
+            item['taxCategories'] = predictions[description_text]
+        else:
             item['taxCategories'] = None
-            item['error'] = f'Prediction failed: {str(e)}'
+            item['error'] = failures[description_text]
         result.append(item)
-    return jsonify(result)
+    with stage('jsonify'):
+        response = jsonify(result)
+    response.headers['X-Unique-Descriptions'] = str(len(unique_descriptions))
+    return response
 
-# ----------------------
-# Utility Methods
-# ----------------------
-# These are helper functions for fuzzy column mapping and Excel processing.
-
-def best_column_match(col_name, field_keywords):
-    """
-    Fuzzy match a column name to the best field using rapidfuzz.
-    Returns the field name if a good match is found, else None.
-    """
-    best_field = None
-    highest_score = 0
-    # Preprocess the column name first
-    processed_col_name = preprocess_col_name(col_name)
-    for field, keywords in field_keywords.items():
-        for keyword in keywords:
-            score = fuzz.token_set_ratio(processed_col_name, keyword)
-            if score > highest_score:
-                highest_score = score
-                best_field = field
-    # Set a threshold to avoid false matches
-    return best_field if highest_score >= 70 else None
-
-
-def map_columns(df):
-    """
-    Map DataFrame columns to Amount, Date, Description using fuzzy matching.
-    Returns mapped data and the mapping used.
-    """
-    mapping = {field: None for field in FIELD_KEYWORDS}
-    mapping['Other'] = []
-    for col in df.columns:
-        field = best_column_match(col, FIELD_KEYWORDS)
-        # TODO : Use open api call for non matched fields
-        if field and not mapping[field]:
-            mapping[field] = col
-        else:
-            mapping['Other'].append(col)
-    mapped_data = []
-    for _, row in df.iterrows():
-        mapped_data.append({
-            'Amount': row.get(mapping['Amount']),
-            'Date': row.get(mapping['Date']),
-            'Description': row.get(mapping['Description']),
-            'DisallowableExpenses': row.get(mapping['DisallowableExpenses'])
-        })
-    return mapped_data, mapping
-
-
-def categorize_excel_sheets_fuzzy(file, quarter_date_range=None):
-    """
-    Process all sheets in the given Excel file, mapping columns for each sheet.
-    Returns a list of dicts with sheet_name, column_mapping, mapped_data, columns, and selected for each sheet.
-    Skips sheets that are empty, all null, or have only header and no data.
-    The 'selected' flag is True if any row in mapped_data has a Date in the specified quarter range.
-    """
-    print("Categorizing Excel sheets using fuzzy matching...")
-    if not file:
-        return {'error': 'No file provided'}, 400
-    from dateutil import parser as date_parser
-    # Use provided quarter_date_range or fallback to default
-    QUARTER_DATE_RANGE = quarter_date_range or '6/4/2025-5/7/2025'
-
-    def parse_quarter_range(quarter_range_str):
-        start_str, end_str = quarter_range_str.split('-')
-        start_date = date_parser.parse(start_str.strip(), dayfirst=True)
-        end_date = date_parser.parse(end_str.strip(), dayfirst=True)
-        return start_date, end_date
-
-    start_date, end_date = parse_quarter_range(QUARTER_DATE_RANGE)
-    xl = pd.ExcelFile(file)
-    sheet_data_list = []
-    for sheet_name in xl.sheet_names:
-        df = xl.parse(sheet_name)
-        # Drop rows that are all null or empty strings
-        df_clean = df.dropna(how='all')
-        df_clean = df_clean.loc[~(df_clean.astype(str).apply(lambda x: x.str.strip()).eq('').all(axis=1))]
-        # Skip if no data rows left after cleaning
-        if df_clean.empty:
-            continue
-        if sheet_name.lower().startswith('1 row null'):
-            continue
-        mapped_data, mapping = map_columns(df_clean)
-        # Determine if any row in mapped_data has a Date in the quarter range
-        selected = False
-        date_col = mapping.get('Date')
-        if date_col:
-            for row in mapped_data:
-                row_date = row.get('Date')
-                try:
-                    dt = date_parser.parse(str(row_date), dayfirst=True, fuzzy=True)
-                    if start_date <= dt <= end_date:
-                        selected = True
-                        break
-                except Exception:
-                    continue
-        sheet_data_list.append({
-            'sheet_name': sheet_name,
-            'column_mapping': mapping,
-            'mapped_data': mapped_data,
-            'columns': list(df_clean.columns),
-            'selected': selected
-        })
-    return {'sheet_data': sheet_data_list}
-
-
-def preprocess_col_name(col_name):
-    # Convert to lowercase
-    col_name = str(col_name).lower()
-    # Replace non-alphanumeric characters (except spaces) with spaces
-    col_name = re.sub(r'[^a-z0-9\s]', ' ', col_name)
-    # Remove extra spaces
-    col_name = re.sub(r'\s+', ' ', col_name).strip()
-    return col_name
+@app.route('/workbookCacheStats', methods=['GET'])
+def get_workbook_cache_stats():
+    """
+    Endpoint to inspect the workbook result cache.
+    Returns the workbook, sheet and DMS document cache counters.
+    """
+    return jsonify(workbook_cache.stats())
+
+@app.route('/headerTemplateStats', methods=['GET'])
+def get_header_template_stats():
+    """
+    Endpoint to inspect the per-client header mapping templates.
+    Returns template hits (layouts mapped without fuzzy matching), misses and sizes.
+    """
+    return jsonify(shared_template_store().stats())
+
+@app.route('/modelInfo', methods=['GET'])
+def get_model_info():
+    """
+    Endpoint to inspect the model registry.
+    Returns the serving model version, when it was loaded and how many swaps happened.
+    """
+    return jsonify(model_registry.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Endpoint for Prometheus to scrape.
+    Returns stage and request duration histograms, row/sheet/byte counters and
+    the cache and model registry stats in the text exposition format.
+    """
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cacheStats', methods=['GET'])
+def get_cache_stats():
+    """
+    Endpoint to inspect the shared prediction cache.
+    Returns size, hits, misses, evictions and the model version in use.
+    """
+    return jsonify(prediction_cache.stats())
 
 if __name__ == '__main__':
     app.run(debug=True)
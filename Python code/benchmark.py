@@ -0,0 +1,323 @@
+# ----------------------
+# Benchmarks
+# ----------------------
+# Times the hot paths on synthetic ledgers (see synthetic_ledger.py) with the stub
+# classifier, so no client data or saved model is needed:
+#   best_column_match, map_columns, categorize_excel_sheets_fuzzy (per file
+#   format: .xlsx with the fastest installed engine, .csv and .ods),
+#   /predict_bulk (FastAPI) and /getMappedCategory (Flask), and the JSON encoding
+#   of sheet and bulk prediction payloads, old path (*_stdlib) against orjson
+# at 1k, 100k and 1M rows. Throughput and peak traced memory are compared with a
+# JSON baseline; the run fails when a case is slower or bigger than the baseline
+# by more than the tolerance. Without a baseline the run fails too, so a missing
+# file cannot pass for a clean run; record one on the reference machine first.
+#
+#   python benchmark.py --scales 1k,100k            # compare with the baseline
+#   python benchmark.py --update-baseline           # record a new baseline
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from synthetic_ledger import (
+    StubClassifier,
+    cached_ledger_workbook,
+    ledger_frame,
+    ledger_records,
+    messy_headers,
+    parse_scale
+)
+
+BASELINE_PATH = os.environ.get('BENCH_BASELINE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'))
+# Generated workbooks are kept here between runs; a 1M-row workbook takes minutes to write
+BENCH_DATA_DIR = os.environ.get('BENCH_DATA_DIR', os.path.join(tempfile.gettempdir(), 'taxmapping-bench'))
+# Allowed relative drop in throughput (or growth in peak memory) before a case fails
+BENCH_TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', '0.25'))
+# Memory differences below this are noise, whatever the ratio
+MEMORY_NOISE_MB = 2.0
+
+DEFAULT_SCALES = ['1k', '100k', '1m']
+BENCH_PERIOD = '1/4/2025-30/6/2025'
+
+
+def bench_best_column_match(rows, data_dir):
+    from const.field_keywords import FIELD_KEYWORDS
+    from sheet_processing import KEYWORD_INDEX, best_column_match
+    headers = messy_headers(rows)
+
+    def run():
+        # Start cold, as a fresh worker would
+        KEYWORD_INDEX._memo.clear()
+        for header in headers:
+            best_column_match(header, FIELD_KEYWORDS)
+    return run
+
+
+def bench_map_columns(rows, data_dir):
+    from sheet_processing import map_columns
+    frame, _ = ledger_frame(rows, wide_columns=8)
+    return lambda: map_columns(frame)
+
+
+def bench_categorize_excel_sheets_fuzzy(rows, data_dir):
+    from sheet_processing import categorize_excel_sheets_fuzzy
+    path = cached_ledger_workbook(data_dir, rows)
+    return lambda: categorize_excel_sheets_fuzzy(path, BENCH_PERIOD)
+
+
+def bench_categorize_csv(rows, data_dir):
+    from sheet_processing import categorize_excel_sheets_fuzzy
+    path = cached_ledger_workbook(data_dir, rows, file_format='csv')
+    return lambda: categorize_excel_sheets_fuzzy(path, BENCH_PERIOD)
+
+
+def bench_categorize_ods(rows, data_dir):
+    from sheet_processing import categorize_excel_sheets_fuzzy
+    from workbook_formats import ODS, UnsupportedWorkbookFormat, excel_engine
+    try:
+        excel_engine(ODS)
+        path = cached_ledger_workbook(data_dir, rows, file_format='ods')
+    except (UnsupportedWorkbookFormat, ImportError) as e:
+        raise SkipCase(str(e))
+    return lambda: categorize_excel_sheets_fuzzy(path, BENCH_PERIOD)
+
+
+def bench_predict_bulk(rows, data_dir):
+    from fastapi.testclient import TestClient
+    import main
+    body = json.dumps({'data': ledger_records(rows)}).encode('utf-8')
+    main.model = StubClassifier()
+    client = TestClient(main.app)
+
+    def run():
+        # Every run predicts from scratch rather than from the previous run's cache
+        main.prediction_cache.clear()
+        response = client.post('/predict_bulk', content=body, headers={'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict_bulk returned {response.status_code}: {response.text[:200]}")
+    return run
+
+
+def bench_get_mapped_category(rows, data_dir):
+    import app as flask_app
+    records = [{'transactionDescription': record['Description'], 'id': record['id']} for record in ledger_records(rows)]
+    body = json.dumps(records).encode('utf-8')
+    flask_app.model = StubClassifier()
+    client = flask_app.app.test_client()
+
+    def run():
+        flask_app.prediction_cache.clear()
+        response = client.post('/getMappedCategory', data=body, content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(f"/getMappedCategory returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return run
+
+
+def sheet_payload(rows):
+    """A /getData response body: one sheet of mapped rows with Timestamps and NaN."""
+    from sheet_processing import map_columns
+    frame, _ = ledger_frame(rows, wide_columns=8)
+    mapped_data, mapping = map_columns(frame)
+    return {'sheet_data': [{'sheet_name': 'Ledger', 'column_mapping': mapping, 'mapped_data': mapped_data,
+                            'columns': list(frame.columns), 'selected': True,
+                            'min_date': frame.iloc[0, 0], 'max_date': frame.iloc[-1, 0]}]}
+
+
+def bulk_payload(rows):
+    """A /predict_bulk response body."""
+    data = [dict(record, category_mapped='Travel') for record in ledger_records(rows)]
+    return {'data': data, 'processed_count': rows, 'success_count': rows, 'error_count': 0, 'errors': []}
+
+
+def bench_serialize_sheet_data_stdlib(rows, data_dir):
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    flask_app = Flask(__name__)
+    flask_app.json = DefaultJSONProvider(flask_app)
+    payload = sheet_payload(rows)
+    return lambda: flask_app.json.response(payload)
+
+
+def bench_serialize_sheet_data(rows, data_dir):
+    from flask import Flask
+    from json_serialization import FastJSONProvider
+    flask_app = Flask(__name__)
+    flask_app.json = FastJSONProvider(flask_app)
+    payload = sheet_payload(rows)
+    return lambda: flask_app.json.response(payload)
+
+
+def bench_serialize_bulk_response_stdlib(rows, data_dir):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    import main
+    payload = bulk_payload(rows)
+    # What FastAPI did for the response_model: validate, then encode
+    return lambda: JSONResponse(jsonable_encoder(main.BulkPredictionResponse(**payload)))
+
+
+def bench_serialize_bulk_response(rows, data_dir):
+    import main
+    payload = bulk_payload(rows)
+    return lambda: main.FastJSONResponse(payload)
+
+
+# Each case builds its input for a row count and returns the function to time
+CASES = {
+    'best_column_match': bench_best_column_match,
+    'map_columns': bench_map_columns,
+    'categorize_excel_sheets_fuzzy': bench_categorize_excel_sheets_fuzzy,
+    'categorize_csv': bench_categorize_csv,
+    'categorize_ods': bench_categorize_ods,
+    'predict_bulk': bench_predict_bulk,
+    'get_mapped_category': bench_get_mapped_category,
+    'serialize_sheet_data_stdlib': bench_serialize_sheet_data_stdlib,
+    'serialize_sheet_data': bench_serialize_sheet_data,
+    'serialize_bulk_response_stdlib': bench_serialize_bulk_response_stdlib,
+    'serialize_bulk_response': bench_serialize_bulk_response,
+}
+
+
+class SkipCase(Exception):
+    """Raised by a case that cannot run here, e.g. because an optional reader is missing."""
+
+
+def measure(run, rows, repeat=3):
+    """
+    Run once under tracemalloc for the peak memory (which also warms up), then
+    `repeat` more times for the timing. Reports the fastest run.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings = []
+    for _ in range(max(repeat, 1)):
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    seconds = min(timings)
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'peak_memory_mb': round(peak / (1024 * 1024), 2)
+    }
+
+
+def run_benchmarks(cases=None, scales=None, repeat=3, data_dir=BENCH_DATA_DIR):
+    """Results keyed by case and scale name."""
+    results = {}
+    for name in cases or list(CASES):
+        for scale in scales or DEFAULT_SCALES:
+            rows = parse_scale(scale)
+            try:
+                run = CASES[name](rows, data_dir)
+            except SkipCase as e:
+                print(f"{name:>30} {scale:>6}: skipped ({e})")
+                continue
+            # The largest inputs are timed once; their runs are long enough to be stable
+            result = measure(run, rows, repeat if rows < 1_000_000 else 1)
+            results.setdefault(name, {})[scale] = result
+            print(f"{name:>30} {scale:>6}: {result['seconds']:>9.3f}s  "
+                  f"{result['rows_per_second'] or 0:>12,.0f} rows/s  {result['peak_memory_mb']:>9.1f} MB peak")
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def find_regressions(results, baseline, tolerance=BENCH_TOLERANCE):
+    """Messages for every case that is slower or uses more memory than the baseline allows."""
+    regressions = []
+    for name, scales in results.items():
+        for scale, result in scales.items():
+            expected = baseline.get('results', {}).get(name, {}).get(scale)
+            if not expected:
+                continue
+            if expected.get('rows_per_second') and result['rows_per_second'] is not None:
+                floor = expected['rows_per_second'] * (1 - tolerance)
+                if result['rows_per_second'] < floor:
+                    regressions.append(f"{name} {scale}: {result['rows_per_second']:,.0f} rows/s is below "
+                                       f"{floor:,.0f} (baseline {expected['rows_per_second']:,.0f})")
+            if expected.get('peak_memory_mb') is not None:
+                ceiling = max(expected['peak_memory_mb'] * (1 + tolerance), expected['peak_memory_mb'] + MEMORY_NOISE_MB)
+                if result['peak_memory_mb'] > ceiling:
+                    regressions.append(f"{name} {scale}: {result['peak_memory_mb']:.1f} MB peak is above "
+                                       f"{ceiling:.1f} MB (baseline {expected['peak_memory_mb']:.1f} MB)")
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def save_baseline(path, results, previous=None):
+    """Write the results as the new baseline, keeping entries for cases and scales not run."""
+    merged = dict((previous or {}).get('results', {}))
+    for name, scales in results.items():
+        merged[name] = dict(merged.get(name, {}), **scales)
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump({'environment': environment(), 'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': merged}, handle, indent=2, sort_keys=True)
+        handle.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths against a JSON baseline.")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"Comma-separated, from: {', '.join(CASES)}")
+    parser.add_argument('--scales', default=','.join(DEFAULT_SCALES), help="Comma-separated row counts, e.g. 1k,100k,1m,250000")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help="Record this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=BENCH_TOLERANCE)
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR)
+    parser.add_argument('--output', help="Also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    results = run_benchmarks(cases, scales, args.repeat, args.data_dir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump({'environment': environment(), 'results': results}, handle, indent=2, sort_keys=True)
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        save_baseline(args.baseline, results, baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; record one with --update-baseline")
+        return 2
+    recorded_cpus = baseline.get('environment', {}).get('cpu_count')
+    if recorded_cpus is not None and recorded_cpus != os.cpu_count():
+        print(f"Warning: baseline was recorded on {recorded_cpus} CPUs, this machine has {os.cpu_count()}")
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
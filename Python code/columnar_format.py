@@ -0,0 +1,125 @@
+# ----------------------
+# Columnar Responses
+# ----------------------
+# Arrow IPC stream and Parquet encodings of a categorize_excel_sheets_fuzzy result,
+# for /getData and /getSheetData clients that ask for them. The mapped columns of
+# every sheet go into one table as typed arrays, with a sheet_name column, built
+# from the sheets' 'mapped_frame' DataFrames (categorize with columnar=True).
+# The rest of each sheet entry (column_mapping, columns, selected, min/max date,
+# row count) is stored as JSON under the 'sheets' key of the schema metadata.
+#
+# pyarrow is optional: without it only JSON responses are offered.
+import json
+from json_serialization import dumps
+from sheet_processing import MAPPED_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+# ?format= values and the media types they stand for
+COLUMNAR_FORMATS = {
+    'arrow': ARROW_STREAM_MIMETYPE,
+    'parquet': PARQUET_MIMETYPE,
+}
+
+
+def columnar_available():
+    return pa is not None
+
+
+def negotiate_format(accept_mimetypes, format_arg=None):
+    """
+    'arrow', 'parquet' or None (JSON) for a request. ?format= wins; otherwise a
+    columnar type is chosen only if the Accept header prefers it to JSON, so
+    clients that send no Accept header or */* keep getting JSON.
+    """
+    if format_arg:
+        format_arg = format_arg.lower()
+        return format_arg if format_arg in COLUMNAR_FORMATS else None
+    best = accept_mimetypes.best_match(['application/json', ARROW_STREAM_MIMETYPE, PARQUET_MIMETYPE],
+                                       default='application/json')
+    for name, mimetype in COLUMNAR_FORMATS.items():
+        if best == mimetype:
+            return name
+    return None
+
+
+def column_array(series):
+    """
+    A typed Arrow array for a mapped column. Object columns mixing types (e.g.
+    dates stored partly as text) that Arrow cannot type become strings.
+    """
+    try:
+        return pa.Array.from_pandas(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.Array.from_pandas(series.where(series.isna(), series.astype(str)))
+
+
+def sheet_table(sheet):
+    """Arrow table of one sheet's mapped columns, led by its sheet_name."""
+    frame = sheet['mapped_frame']
+    arrays = [pa.array([sheet['sheet_name']] * len(frame), type=pa.string()).dictionary_encode()]
+    arrays.extend(column_array(frame[field]) for field in MAPPED_FIELDS)
+    return pa.Table.from_arrays(arrays, names=['sheet_name'] + MAPPED_FIELDS)
+
+
+def sheet_metadata(sheet):
+    return {
+        'sheet_name': sheet['sheet_name'],
+        'column_mapping': sheet['column_mapping'],
+        'columns': sheet['columns'],
+        'selected': sheet['selected'],
+        'min_date': sheet['min_date'],
+        'max_date': sheet['max_date'],
+        'row_count': len(sheet['mapped_frame'])
+    }
+
+
+def _common_types(tables):
+    """
+    One type per field across sheets. Fields whose sheets disagree become strings,
+    unless they are all numeric (promoted by concat_tables); all-null sheets take
+    the type of the others.
+    """
+    types = {}
+    for field in MAPPED_FIELDS:
+        seen = {table.schema.field(field).type for table in tables} - {pa.null()}
+        if len(seen) > 1 and not all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in seen):
+            types[field] = pa.string()
+    return types
+
+
+def workbook_table(result):
+    """
+    One Arrow table for all sheets of a columnar result, with the sheet entries
+    in the schema metadata.
+    """
+    tables = [sheet_table(sheet) for sheet in result['sheet_data']]
+    if not tables:
+        table = pa.table({name: pa.array([], type=pa.null()) for name in ['sheet_name'] + MAPPED_FIELDS})
+    else:
+        for field, field_type in _common_types(tables).items():
+            tables = [table.set_column(table.schema.get_field_index(field), field,
+                                       table[field].cast(field_type)) for table in tables]
+        table = pa.concat_tables(tables, promote_options='permissive')
+    sheets = [sheet_metadata(sheet) for sheet in result['sheet_data']]
+    return table.replace_schema_metadata({b'sheets': dumps(sheets), b'mapped_fields': json.dumps(MAPPED_FIELDS)})
+
+
+def encode(result, response_format):
+    """The body for a columnar response: an Arrow IPC stream or a Parquet file."""
+    table = workbook_table(result)
+    sink = pa.BufferOutputStream()
+    if response_format == 'parquet':
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -20,14 +20,6 @@ FIELD_KEYWORDS = {
         'trans_dt'
     ],
     'Description': [
-        'description',
-        'desc',
-        'details',
-        'narration',
-        'particulars',
-        'info',
-        'remarks',
-        'summary',
         'description',
         'desc',
         'details',
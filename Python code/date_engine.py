@@ -0,0 +1,141 @@
+# ----------------------
+# Date Engine
+# ----------------------
+# Works out whether a sheet's Date column falls in the requested quarter.
+# Native datetimes are used as they are. Strings are parsed in bulk with the
+# dominant UK format, and only the leftovers go through fuzzy dateutil parsing.
+from datetime import datetime
+from functools import lru_cache
+import pandas as pd
+from dateutil import parser as date_parser
+
+# Day-first (UK) and ISO layouts tried by the vectorized parser, in order of preference.
+# Two-digit years are left to dateutil, whose century window differs from strptime's.
+CANDIDATE_DATE_FORMATS = [
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d %b %Y',
+    '%d %B %Y',
+    '%d-%b-%Y',
+    '%d-%B-%Y',
+    '%d/%b/%Y',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y %H:%M:%S',
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y/%m/%d',
+]
+
+# Number of distinct strings used to infer which formats a column uses
+FORMAT_SAMPLE_SIZE = 200
+
+
+def parse_quarter_range(quarter_range_str):
+    """
+    Parse a 'start-end' quarter range such as '6/4/2025-5/7/2025' (day first).
+    """
+    start_str, end_str = quarter_range_str.split('-')
+    start_date = date_parser.parse(start_str.strip(), dayfirst=True)
+    end_date = date_parser.parse(end_str.strip(), dayfirst=True)
+    return start_date, end_date
+
+
+@lru_cache(maxsize=65536)
+def parse_date_string(text):
+    """
+    Fuzzy day-first parse of a single string, memoized per distinct string.
+    Returns None if the string does not contain a date.
+    """
+    try:
+        return date_parser.parse(text, dayfirst=True, fuzzy=True)
+    except Exception:
+        return None
+
+
+def infer_date_formats(strings):
+    """
+    Return the candidate formats that parse any of a sample of the strings,
+    most common first.
+    """
+    sample = pd.Index(strings[:FORMAT_SAMPLE_SIZE], dtype=object)
+    hits = []
+    for fmt in CANDIDATE_DATE_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count:
+            hits.append((count, fmt))
+    hits.sort(key=lambda hit: -hit[0])
+    return [fmt for _, fmt in hits]
+
+
+def _is_comparable(dt):
+    """Naive datetimes within the pandas Timestamp range can be compared with the quarter."""
+    return dt.tzinfo is None and pd.Timestamp.min <= dt <= pd.Timestamp.max
+
+
+def parse_date_values(values):
+    """
+    Parse the distinct values of a Date column into a DatetimeIndex.
+    Values are deduplicated first, so the result covers distinct dates, not rows.
+    Timezone-aware results are dropped because they cannot be compared with the
+    quarter range.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if getattr(series.dtype, 'tz', None) is not None:
+            return pd.DatetimeIndex([])
+        return pd.DatetimeIndex(series.dropna().unique())
+    parsed = []
+    strings = []
+    for value in pd.unique(series):
+        if isinstance(value, datetime):
+            # Native Excel datetimes pass through unchanged (NaT is a datetime too)
+            if value is not pd.NaT and _is_comparable(value):
+                parsed.append(value)
+        elif isinstance(value, str):
+            strings.append(value)
+        elif value is not None and not (isinstance(value, float) and value != value):
+            strings.append(str(value))
+    remaining = pd.Index(strings, dtype=object)
+    if len(remaining):
+        for fmt in infer_date_formats(strings):
+            converted = pd.to_datetime(remaining, format=fmt, errors='coerce')
+            matched = converted.notna()
+            parsed.extend(converted[matched])
+            remaining = remaining[~matched]
+            if not len(remaining):
+                break
+    for text in remaining:
+        dt = parse_date_string(text)
+        if dt is not None and _is_comparable(dt):
+            parsed.append(dt)
+    return pd.DatetimeIndex(parsed)
+
+
+def summarize_dates(values, start_date, end_date):
+    """
+    Summarize a Date column against a quarter range.
+    Returns a dict with 'selected' (True if any date falls in the range)
+    and the 'min_date' and 'max_date' found in the column.
+    """
+    dates = parse_date_values(values)
+    if not len(dates):
+        return {'selected': False, 'min_date': None, 'max_date': None}
+    return {
+        'selected': bool(((dates >= start_date) & (dates <= end_date)).any()),
+        'min_date': dates.min(),
+        'max_date': dates.max()
+    }
+
+
+def merge_date_summaries(first, second):
+    """
+    Combine the summaries of two parts of the same Date column.
+    """
+    min_dates = [dt for dt in (first['min_date'], second['min_date']) if dt is not None]
+    max_dates = [dt for dt in (first['max_date'], second['max_date']) if dt is not None]
+    return {
+        'selected': first['selected'] or second['selected'],
+        'min_date': min(min_dates) if min_dates else None,
+        'max_date': max(max_dates) if max_dates else None
+    }
@@ -0,0 +1,141 @@
+# ----------------------
+# DMS Client
+# ----------------------
+# Shared, pooled HTTP client for the document management service (DMS).
+# Connections are kept alive between requests, every call has a timeout, and
+# failed connections and gateway errors are retried a bounded number of times.
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from instrumentation import run_in_context, stage
+
+DMS_BASE_URL = os.environ.get('DMS_BASE_URL', 'http://localhost:5119')
+DMS_CONNECT_TIMEOUT = float(os.environ.get('DMS_CONNECT_TIMEOUT', '3.05'))
+DMS_READ_TIMEOUT = float(os.environ.get('DMS_READ_TIMEOUT', '60'))
+DMS_MAX_RETRIES = int(os.environ.get('DMS_MAX_RETRIES', '3'))
+DMS_POOL_SIZE = int(os.environ.get('DMS_POOL_SIZE', '10'))
+
+# Uploads larger than this are spooled to a temporary file instead of memory
+UPLOAD_SPOOL_MAX_MEMORY = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY', str(8 * 1024 * 1024)))
+
+
+class DMSClient:
+    """
+    Client for the DMS /api/Document endpoints built on one pooled requests.Session.
+    Connection failures are retried for every method (nothing was sent yet), but
+    read errors and 502/503/504 responses only for GET, because an upload
+    stores a new document each time it is sent.
+    """
+
+    def __init__(self, base_url=DMS_BASE_URL, connect_timeout=DMS_CONNECT_TIMEOUT,
+                 read_timeout=DMS_READ_TIMEOUT, max_retries=DMS_MAX_RETRIES, pool_size=DMS_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET'}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='dms-upload')
+
+    def upload(self, client_id, filename, fileobj, mimetype=None):
+        """POST a document to /api/Document/upload and return the response."""
+        files = {'file': (filename, fileobj, mimetype)}
+        data = {'clientId': client_id}
+        return self.session.post(f'{self.base_url}/api/Document/upload', files=files, data=data, timeout=self.timeout)
+
+    def submit_upload(self, client_id, filename, spooled_file, mimetype=None):
+        """
+        Upload a SpooledUpload in the background. Returns a future for the response;
+        the upload reads its own handle, so the caller can parse the file meanwhile.
+        """
+        def run():
+            with stage('dms_upload'), spooled_file.open() as fileobj:
+                return self.upload(client_id, filename, fileobj, mimetype)
+        # Run in the request's context so the upload is timed as one of its stages
+        return self._executor.submit(run_in_context(run))
+
+    def stream(self, client_id, file_path, etag=None):
+        """
+        GET a stored document from /api/Document/stream and return the response.
+        With the ETag of a copy already held, an unchanged document comes back
+        as 304 Not Modified without a body.
+        """
+        params = {'clientId': client_id, 'filePath': file_path}
+        headers = {'If-None-Match': etag} if etag else None
+        return self.session.get(f'{self.base_url}/api/Document/stream', params=params, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class SpooledUpload:
+    """
+    An uploaded file copied once, to memory or to a temporary file above max_memory
+    bytes, that can be opened any number of times with independent read positions.
+    """
+
+    def __init__(self, stream, max_memory=UPLOAD_SPOOL_MAX_MEMORY):
+        self.path = None
+        self.content = None
+        head = stream.read(max_memory + 1)
+        if len(head) <= max_memory:
+            self.content = head
+            self.size = len(head)
+            return
+        fd, self.path = tempfile.mkstemp(prefix='upload-')
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(head)
+            shutil.copyfileobj(stream, temp_file)
+            self.size = temp_file.tell()
+
+    def open(self):
+        if self.path is None:
+            return BytesIO(self.content)
+        return open(self.path, 'rb')
+
+    def close(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_dms_client():
+    """The process-wide DMS client, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DMSClient()
+        return _client
+
+
+def configure_dms_client(**kwargs):
+    """Replace the process-wide DMS client, e.g. to point it at a local stub."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = DMSClient(**kwargs)
+        return _client
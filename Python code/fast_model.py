@@ -0,0 +1,198 @@
+# ----------------------
+# Fast-Path Inference
+# ----------------------
+# Compiles a fitted sklearn text pipeline (CountVectorizer/TfidfVectorizer followed
+# by a linear classifier or MultinomialNB) into a lean predictor. The vectorizer's
+# analyzer and vocabulary are used directly, the idf weights and class weights are
+# applied with plain numpy, and the class is a direct argmax. This skips sklearn's
+# input validation and estimator dispatch on every call. Unsupported pipelines
+# are returned unchanged, and every compiled model is checked against the
+# original before it is used.
+import random
+import time
+from collections import Counter
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, LogisticRegressionCV, Perceptron, RidgeClassifier, RidgeClassifierCV, SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+from sklearn.svm import LinearSVC
+
+# Number of synthetic descriptions used to check a compiled model when no held-out set is given
+SELF_CHECK_SIZE = 500
+
+# Classifiers whose predict() is the argmax (or sign) of X @ coef_.T + intercept_
+LINEAR_CLASSIFIERS = (LogisticRegression, LogisticRegressionCV, LinearSVC, SGDClassifier,
+                      RidgeClassifier, RidgeClassifierCV, Perceptron)
+
+
+class CompiledTextClassifier:
+    """
+    Lean replacement for a fitted vectorizer + classifier pipeline.
+    Scores are weights @ (normalized tf * idf) + bias, with the weights taken from
+    coef_ for linear models and from feature_log_prob_ for MultinomialNB. The arrays
+    are used as they are, so a memory-mapped model stays shared between workers.
+    Single texts, the common case for /predict, skip sklearn entirely; batches use
+    the vectorizer's transform, which is faster than a per-text loop.
+    """
+
+    def __init__(self, pipeline):
+        vectorizer, classifier = pipeline.steps[0][1], pipeline.steps[-1][1]
+        self.pipeline = pipeline
+        self.vectorizer = vectorizer
+        self.classes_ = classifier.classes_
+        self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary = vectorizer.vocabulary_
+        self.binary = vectorizer.binary
+        tfidf = isinstance(vectorizer, TfidfVectorizer)
+        self.sublinear_tf = tfidf and vectorizer.sublinear_tf
+        self.norm = vectorizer.norm if tfidf else None
+        self.idf = vectorizer.idf_ if tfidf and vectorizer.use_idf else None
+        if isinstance(classifier, MultinomialNB):
+            self.weights = classifier.feature_log_prob_
+            self.bias = classifier.class_log_prior_
+            self.binary_decision = False
+        else:
+            self.weights = classifier.coef_
+            self.bias = np.broadcast_to(np.asarray(classifier.intercept_, dtype=np.float64), (classifier.coef_.shape[0],))
+            # Two-class linear models have a single row of weights and predict on sign
+            self.binary_decision = classifier.coef_.shape[0] == 1
+
+    def _token_counts(self, text):
+        """Sorted vocabulary indexes of the text's tokens and how often each occurs."""
+        counts = Counter()
+        for token in self.analyzer(text):
+            index = self.vocabulary.get(token)
+            if index is not None:
+                counts[index] += 1
+        indexes = np.fromiter(sorted(counts), dtype=np.intp, count=len(counts))
+        values = np.fromiter((counts[index] for index in indexes), dtype=np.float64, count=len(counts))
+        return indexes, values
+
+    def _features(self, text):
+        """Sorted feature indexes and normalized tf(-idf) values of one text."""
+        indexes, values = self._token_counts(text)
+        if self.binary:
+            values[:] = 1.0
+        elif self.sublinear_tf:
+            values = np.log(values) + 1.0
+        if self.idf is not None:
+            values *= self.idf[indexes]
+        if self.norm == 'l2':
+            norm = np.sqrt(np.dot(values, values))
+        elif self.norm == 'l1':
+            norm = np.abs(values).sum()
+        else:
+            norm = 0.0
+        if norm > 0:
+            values /= norm
+        return indexes, values
+
+    def _batch_matrix(self, texts):
+        """Feature matrix of several texts."""
+        return self.vectorizer.transform(texts)
+
+    def decision_function(self, texts):
+        if len(texts) == 1:
+            indexes, values = self._features(texts[0])
+            scores = (self.weights[:, indexes] @ values + self.bias)[np.newaxis, :]
+        else:
+            scores = np.asarray(self._batch_matrix(texts) @ self.weights.T) + self.bias
+        return scores
+
+    def predict(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.array([], dtype=self.classes_.dtype)
+        scores = self.decision_function(texts)
+        if self.binary_decision:
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+
+def is_compilable(model):
+    """True for a two-step pipeline of a word/char vectorizer and a supported classifier."""
+    if not isinstance(model, Pipeline) or len(model.steps) != 2:
+        return False
+    vectorizer, classifier = model.steps[0][1], model.steps[1][1]
+    if type(vectorizer) not in (CountVectorizer, TfidfVectorizer):
+        return False
+    return type(classifier) is MultinomialNB or type(classifier) in LINEAR_CLASSIFIERS
+
+
+def synthetic_texts(model, count=SELF_CHECK_SIZE, seed=0):
+    """Deterministic pseudo-descriptions built from the vectorizer's vocabulary."""
+    vocabulary = sorted(model.steps[0][1].vocabulary_)
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        words = rng.sample(vocabulary, min(len(vocabulary), rng.randint(1, 6)))
+        texts.append(' '.join(words + [str(rng.randint(0, 9999))] * rng.randint(0, 1)))
+    return texts
+
+
+def find_mismatches(compiled, model, texts):
+    """Texts on which the compiled model and the original disagree, with both predictions."""
+    fast = list(compiled.predict(texts))
+    reference = list(model.predict(texts))
+    return [(text, expected, actual) for text, expected, actual in zip(texts, reference, fast) if expected != actual]
+
+
+def compile_model(model, check_texts=None):
+    """
+    Compile model for fast inference if its stages allow it, otherwise return it
+    unchanged. The compiled model is checked against the original on check_texts
+    (a synthetic sample of the vocabulary by default) and discarded if any
+    prediction differs.
+    """
+    if isinstance(model, CompiledTextClassifier):
+        return model
+    if not is_compilable(model):
+        print(f"Fast path not available for {type(model).__name__}, using the pipeline")
+        return model
+    compiled = CompiledTextClassifier(model)
+    texts = check_texts if check_texts is not None else synthetic_texts(model)
+    mismatches = find_mismatches(compiled, model, texts)
+    if mismatches:
+        print(f"Fast path disagrees with the pipeline on {len(mismatches)} of {len(texts)} texts, using the pipeline")
+        return model
+    return compiled
+
+
+def load_texts(paths):
+    texts = []
+    for path in paths:
+        if path.endswith(('.xlsx', '.xls')):
+            from sheet_processing import categorize_excel_sheets_fuzzy
+            for sheet in categorize_excel_sheets_fuzzy(path)['sheet_data']:
+                texts.extend(str(row['Description']) for row in sheet['mapped_data'] if row.get('Description'))
+        else:
+            with open(path, encoding='utf-8') as handle:
+                texts.extend(line.strip() for line in handle if line.strip())
+    return texts
+
+
+if __name__ == "__main__":
+    # python fast_model.py [held-out.txt | ledger.xlsx ...]
+    # Checks the compiled model against the saved pipeline and compares latency.
+    import sys
+    import joblib
+    from model_store import MODEL_PATH
+    # The saved pipeline itself, not the slim or compiled artifact load_model() may pick
+    pipeline = joblib.load(MODEL_PATH)
+    texts = load_texts(sys.argv[1:])
+    if not texts and is_compilable(pipeline):
+        texts = synthetic_texts(pipeline)
+    compiled = compile_model(pipeline, texts)
+    if compiled is pipeline:
+        sys.exit(1)
+    print(f"Identical predictions on {len(texts)} held-out texts")
+    for name, predictor in (('pipeline', pipeline), ('compiled', compiled)):
+        started = time.perf_counter()
+        for text in texts[:1000]:
+            predictor.predict([text])
+        single = (time.perf_counter() - started) / min(len(texts), 1000) * 1e6
+        started = time.perf_counter()
+        predictor.predict(texts)
+        batch = (time.perf_counter() - started) * 1e3
+        print(f"{name:>9}: {single:8.1f} us per single prediction, {batch:8.1f} ms for the batch of {len(texts)}")
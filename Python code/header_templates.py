@@ -0,0 +1,184 @@
+# ----------------------
+# Header Mapping Templates
+# ----------------------
+# Clients upload workbooks with the same column layout every quarter. The column
+# mapping resolved for a layout is remembered per client, keyed by a hash of the
+# header signature (column names and their order), so repeat uploads skip the
+# fuzzy matching against FIELD_KEYWORDS. Templates are kept in a bounded LRU,
+# optionally backed by a sqlite file shared by all processes (HEADER_TEMPLATE_DB),
+# and are only valid for the FIELD_KEYWORDS they were resolved with.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from const.field_keywords import FIELD_KEYWORDS
+from prediction_cache import LRUCache
+
+
+def header_signature(columns):
+    """
+    Hash of a sheet's header row. Column order matters, and so does the type of a
+    name, so a header of 2024 and one of '2024' are different layouts.
+    """
+    names = [[type(col).__name__, str(col)] for col in columns]
+    return hashlib.sha256(json.dumps(names).encode('utf-8')).hexdigest()
+
+
+def keywords_fingerprint(field_keywords):
+    """Hash of the field keywords; templates resolved with other keywords are stale."""
+    return hashlib.sha256(json.dumps(field_keywords, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def encode_mapping(mapping, columns):
+    """Column mapping with each column replaced by its position in columns."""
+    positions = {}
+    for position, col in enumerate(columns):
+        positions.setdefault(col, position)
+    encoded = {field: positions[col] if col is not None else None
+               for field, col in mapping.items() if field != 'Other'}
+    encoded['Other'] = [positions[col] for col in mapping['Other']]
+    return encoded
+
+
+def decode_mapping(encoded, columns):
+    """Inverse of encode_mapping for a header with the same signature."""
+    columns = list(columns)
+    mapping = {field: columns[position] if position is not None else None
+               for field, position in encoded.items() if field != 'Other'}
+    mapping['Other'] = [columns[position] for position in encoded['Other']]
+    return mapping
+
+
+class HeaderTemplateStore:
+    """
+    Column mappings keyed by (client id, header signature).
+    lookup() returns the stored mapping for a known layout and otherwise calls
+    resolve(columns) and stores its result. Mappings are stored as column
+    positions, so a template rebuilds the exact column names of the new sheet.
+    hits counts layouts served from memory or disk, misses the ones resolved.
+    """
+
+    def __init__(self, field_keywords=FIELD_KEYWORDS, max_size=5000, db_path=None):
+        self.memory = LRUCache(max_size=max_size)
+        self.db_path = db_path
+        self.keywords_version = keywords_fingerprint(field_keywords)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            # Shared with the sheet worker processes, so wait for their writes
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS header_templates ('
+                'client_id TEXT NOT NULL, signature TEXT NOT NULL, '
+                'keywords_version TEXT NOT NULL, mapping TEXT NOT NULL, created_at REAL NOT NULL, '
+                'PRIMARY KEY (client_id, signature))'
+            )
+            self._db.execute('DELETE FROM header_templates WHERE keywords_version != ?', (self.keywords_version,))
+            self._db.commit()
+
+    def lookup(self, client_id, columns, resolve):
+        """The column mapping for columns, from the client's template if there is one."""
+        columns = list(columns)
+        key = (str(client_id), header_signature(columns))
+        encoded = self.memory.get(key)
+        if encoded is None:
+            encoded = self._load_from_disk(key)
+            if encoded is not None:
+                self.disk_hits += 1
+                self.memory.set(key, encoded)
+        if encoded is not None:
+            self.hits += 1
+            return decode_mapping(encoded, columns)
+        self.misses += 1
+        mapping = resolve(columns)
+        encoded = encode_mapping(mapping, columns)
+        self.memory.set(key, encoded)
+        self._save_to_disk(key, encoded)
+        return mapping
+
+    def _load_from_disk(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT mapping FROM header_templates WHERE client_id = ? AND signature = ? AND keywords_version = ?',
+                key + (self.keywords_version,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _save_to_disk(self, key, encoded):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO header_templates (client_id, signature, keywords_version, mapping, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                key + (self.keywords_version, json.dumps(encoded), time.time())
+            )
+            self._db.commit()
+
+    def invalidate(self, field_keywords=None, client_id=None):
+        """
+        Drop stored templates: all of them, or only those of client_id.
+        Pass the new field_keywords after FIELD_KEYWORDS changes, so templates
+        resolved with the old keywords are no longer used.
+        """
+        with self._lock:
+            if field_keywords is not None:
+                self.keywords_version = keywords_fingerprint(field_keywords)
+            self.invalidations += 1
+            if self._db is not None:
+                if client_id is None:
+                    self._db.execute('DELETE FROM header_templates')
+                else:
+                    self._db.execute('DELETE FROM header_templates WHERE client_id = ?', (str(client_id),))
+                self._db.commit()
+        # Memory keys are cheap to rebuild, so a client invalidation clears them all
+        self.memory.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.memory),
+            'max_size': self.memory.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'evictions': self.memory.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'keywords_version': self.keywords_version,
+            'disk_store': self.db_path
+        }
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def shared_template_store():
+    """The process-wide template store, created on first use with create_template_store."""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = create_template_store()
+        return _shared_store
+
+
+def create_template_store():
+    """
+    Build the template store from environment settings: HEADER_TEMPLATE_CACHE_SIZE
+    (templates kept in memory, 0 disables) and HEADER_TEMPLATE_DB, a sqlite file
+    for the on-disk store.
+    """
+    return HeaderTemplateStore(
+        max_size=int(os.environ.get('HEADER_TEMPLATE_CACHE_SIZE', '5000')),
+        db_path=os.environ.get('HEADER_TEMPLATE_DB') or None
+    )
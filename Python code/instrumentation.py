@@ -0,0 +1,405 @@
+# ----------------------
+# Instrumentation
+# ----------------------
+# Per-request stage timings shared by app.py and main.py.
+#   - stage('excel_parse') times a block; checkpoint('validate') times everything
+#     since the request started (or since the previous checkpoint)
+#   - count('rows', n) adds to a per-endpoint counter
+#   - every request's stages go out in a Server-Timing header and into the
+#     histograms rendered by render_prometheus() for /metrics
+# With PROFILE_SLOW_REQUESTS_MS set, a sampling profiler records the stacks of the
+# threads serving each request and writes them as folded stacks (the input of
+# flamegraph.pl and speedscope) for requests slower than the threshold.
+import bisect
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+METRICS_PREFIX = os.environ.get('METRICS_PREFIX', 'taxmapping')
+
+# Upper bounds, in milliseconds, of the stage and request duration buckets
+DURATION_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 5000]
+
+# Requests slower than this are profiled to PROFILE_DIR (unset or 0 disables the profiler)
+PROFILE_SLOW_REQUESTS_MS = float(os.environ.get('PROFILE_SLOW_REQUESTS_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style, plus count, sum and max."""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'buckets': buckets,
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'max': round(self.max, 3),
+            'mean': round(self.total / self.count, 3) if self.count else 0.0
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _metric_name(*parts):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join(str(part) for part in parts if part))
+
+
+def _flatten(stats, prefix=''):
+    """Numeric leaves of a nested stats dict as (name, value) pairs; everything else is skipped."""
+    for key, value in stats.items():
+        name = f'{prefix}_{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+class Metrics:
+    """
+    Process-wide counters and histograms keyed by name and labels, plus collectors:
+    stats() functions of the caches, batcher and registry read at scrape time.
+    """
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+        self.external_histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS_MS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name, stats_fn):
+        """
+        Expose the numeric values of stats_fn() as gauges named <prefix>_<name>_<key>.
+        Registering a name again replaces it, so two apps in one process can both register.
+        """
+        self.collectors[name] = stats_fn
+
+    def register_histogram(self, name, histogram):
+        """Expose a Histogram kept elsewhere (e.g. by the micro-batcher)."""
+        self.external_histograms[name] = histogram
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, histogram.snapshot()) for key, histogram in histograms]
+        typed = set()
+        for (name, label_key), value in counters:
+            metric = _metric_name(self.prefix, name, 'total')
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{_format_labels(label_key)} {value}')
+        external = [((name, ()), histogram.snapshot()) for name, histogram in list(self.external_histograms.items())]
+        for (name, label_key), snapshot in histograms + external:
+            metric = _metric_name(self.prefix, name)
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            for bound, count in snapshot['buckets'].items():
+                lines.append(f'{metric}_bucket{_format_labels(label_key, [("le", bound)])} {count}')
+            lines.append(f'{metric}_sum{_format_labels(label_key)} {snapshot["sum"]}')
+            lines.append(f'{metric}_count{_format_labels(label_key)} {snapshot["count"]}')
+        for name, stats_fn in list(self.collectors.items()):
+            try:
+                values = list(_flatten(stats_fn()))
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for key, value in values:
+                metric = _metric_name(self.prefix, name, key)
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class RequestTiming:
+    """Stage durations and counts collected while one request is served."""
+
+    def __init__(self, endpoint='unmatched'):
+        self.endpoint = endpoint
+        self.depth = 1
+        self.started = time.perf_counter()
+        self.last_checkpoint = None
+        self.stages = {}
+        self.counts = {}
+        self.threads = {threading.get_ident()}
+        self.samples = Counter()
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, duration_ms):
+        with self._lock:
+            if not self.finished:
+                self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+                return
+        # Background work that outlives its request (e.g. the DMS upload) is still recorded
+        metrics.observe('stage_duration_ms', duration_ms, endpoint=self.endpoint, stage=name)
+
+    def add_count(self, name, value):
+        with self._lock:
+            if not self.finished:
+                self.counts[name] = self.counts.get(name, 0) + value
+                return
+        metrics.inc(name, value, endpoint=self.endpoint)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value: one entry per stage plus the total so far."""
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = [f'{name};dur={duration:.1f}' for name, duration in stages]
+        entries.append(f'total;dur={self.elapsed_ms():.1f}')
+        return ', '.join(entries)
+
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def current_timing():
+    return _current.get()
+
+
+def begin_request(endpoint=None):
+    """
+    Start timing a request in the current context. Returns its RequestTiming.
+    Inside a request that is already being timed (the Flask app mounted in the
+    ASGI service) the enclosing timing is reused and only renamed.
+    """
+    timing = _current.get()
+    if timing is not None and not timing.finished:
+        timing.depth += 1
+        timing.threads.add(threading.get_ident())
+        if endpoint is not None:
+            timing.endpoint = endpoint
+        return timing
+    timing = RequestTiming(endpoint or 'unmatched')
+    _current.set(timing)
+    if profiler is not None:
+        profiler.track(timing)
+    return timing
+
+
+def finish_request(timing, status=None, tail_stage=None):
+    """
+    Record a request's stages, counts and duration in the metrics. tail_stage names
+    the time since the handler's last checkpoint (e.g. the framework serializing
+    the returned value). Slow requests are written out by the profiler.
+    """
+    if timing is None or timing.finished:
+        return
+    timing.depth -= 1
+    if timing.depth > 0:
+        # The enclosing request finishes it
+        return
+    if tail_stage and timing.last_checkpoint is not None:
+        timing.add_stage(tail_stage, (time.perf_counter() - timing.last_checkpoint) * 1000)
+    duration_ms = timing.elapsed_ms()
+    with timing._lock:
+        timing.finished = True
+        stages = list(timing.stages.items())
+        counts = list(timing.counts.items())
+    for name, stage_ms in stages:
+        metrics.observe('stage_duration_ms', stage_ms, endpoint=timing.endpoint, stage=name)
+    for name, value in counts:
+        metrics.inc(name, value, endpoint=timing.endpoint)
+    metrics.observe('request_duration_ms', duration_ms, endpoint=timing.endpoint, status=status or 'unknown')
+    if profiler is not None:
+        profiler.untrack(timing)
+        profiler.dump(timing, duration_ms)
+    if _current.get() is timing:
+        _current.set(None)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage `name` of the current request (or of no request)."""
+    timing = _current.get()
+    if timing is not None:
+        timing.threads.add(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if timing is not None:
+            timing.add_stage(name, duration_ms)
+        else:
+            metrics.observe('stage_duration_ms', duration_ms, endpoint='background', stage=name)
+
+
+def checkpoint(name):
+    """Record the time since the request started, or since the last checkpoint, as stage `name`."""
+    timing = _current.get()
+    if timing is None:
+        return
+    now = time.perf_counter()
+    timing.add_stage(name, (now - (timing.last_checkpoint or timing.started)) * 1000)
+    timing.last_checkpoint = now
+
+
+def count(name, value=1):
+    """Add value to the counter `name` of the current request's endpoint."""
+    timing = _current.get()
+    if timing is not None:
+        timing.add_count(name, value)
+    else:
+        metrics.inc(name, value, endpoint='background')
+
+
+def observe(name, value, buckets=BATCH_SIZE_BUCKETS, **labels):
+    """Record a value that is not tied to an endpoint, e.g. a model batch size."""
+    metrics.observe(name, value, buckets=buckets, **labels)
+
+
+def run_in_context(fn):
+    """Wrap fn so it runs in a copy of the caller's context, e.g. on an executor thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads serving each tracked request every
+    interval_ms. A request slower than threshold_ms has its samples written to
+    output_dir as folded stacks, one 'frame;frame;frame count' line per stack.
+    """
+
+    def __init__(self, threshold_ms, interval_ms=PROFILE_INTERVAL_MS, output_dir=PROFILE_DIR):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self.dumps = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, timing):
+        with self._lock:
+            self._active.add(timing)
+            # Started lazily, so each serve.py worker runs its own sampler after the fork
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def untrack(self, timing):
+        with self._lock:
+            self._active.discard(timing)
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            sampled = [(timing, fold_stack(frames[ident])) for timing in active for ident in list(timing.threads)
+                       if ident in frames and ident != own_ident]
+            del frames
+            # Counted under the lock, so dump() never sees the Counter change size
+            with self._lock:
+                for timing, stack in sampled:
+                    timing.samples[stack] += 1
+
+    def dump(self, timing, duration_ms):
+        """Write the request's samples if it was slow. Returns the file path, or None."""
+        if duration_ms < self.threshold_ms:
+            return None
+        with self._lock:
+            samples = timing.samples.most_common()
+        if not samples:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = _metric_name(timing.endpoint.strip('/')) or 'root'
+        path = os.path.join(self.output_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{duration_ms:.0f}ms-{os.getpid()}.folded')
+        with open(path, 'w', encoding='utf-8') as handle:
+            for stack, count in samples:
+                handle.write(f'{stack} {count}\n')
+        self.dumps += 1
+        print(f"Slow request {timing.endpoint} took {duration_ms:.0f}ms; profile written to {path}")
+        return path
+
+
+def fold_stack(frame):
+    """A frame and its callers as 'outermost;...;innermost', one 'function (file:line)' per frame."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+profiler = SamplingProfiler(PROFILE_SLOW_REQUESTS_MS) if PROFILE_SLOW_REQUESTS_MS > 0 else None
+
+
+def configure_profiler(threshold_ms, interval_ms=PROFILE_INTERVAL_MS, output_dir=PROFILE_DIR):
+    """Replace the process-wide profiler; a threshold of 0 or None disables it."""
+    global profiler
+    profiler = SamplingProfiler(threshold_ms, interval_ms, output_dir) if threshold_ms else None
+    return profiler
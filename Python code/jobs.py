@@ -0,0 +1,500 @@
+# ----------------------
+# Workbook Jobs
+# ----------------------
+# Asynchronous workbook processing for large files. A submit endpoint queues the
+# job in a sqlite store shared by all web workers and returns its id at once.
+# Each web worker runs a dispatcher that claims queued jobs for its pool of worker
+# processes; claims are made against the store, so at most JOB_WORKERS jobs run
+# at once however many web workers there are. A worker process does the DMS
+# transfer, runs categorize_excel_sheets_fuzzy, writes per-sheet progress and
+# serializes the result to a JSON file next to the database. Jobs and results
+# are removed after JOB_TTL seconds.
+#
+# Dispatchers write a heartbeat to the store. Jobs claimed by a web worker that
+# stopped sending it (it died or was restarted) are queued again, up to
+# JOB_MAX_ATTEMPTS runs, then failed.
+import atexit
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Jobs running at once, across all web workers
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_STORE_DIR = os.environ.get('JOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'taxmapping-jobs'))
+# Seconds a job and its result are kept after it was last updated
+JOB_TTL = float(os.environ.get('JOB_TTL', str(24 * 3600)))
+# Minimum seconds between sweeps for expired jobs
+JOB_CLEANUP_INTERVAL = float(os.environ.get('JOB_CLEANUP_INTERVAL', '300'))
+# Seconds between a dispatcher's looks at the queue (submits wake it at once) and heartbeats
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+# Seconds without a heartbeat after which a web worker's running jobs are taken back
+JOB_OWNER_TIMEOUT = float(os.environ.get('JOB_OWNER_TIMEOUT', '30'))
+# Runs of a job before it is failed rather than queued again
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '2'))
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobStore:
+    """
+    Job records in sqlite and results as files, under one directory. Every call
+    opens its own connection, so the store can be used from any thread and from
+    the worker processes at the same time.
+    """
+
+    def __init__(self, directory=JOB_STORE_DIR, ttl=JOB_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.db_path = os.path.join(directory, 'jobs.sqlite3')
+        self.results_dir = os.path.join(directory, 'results')
+        self.inputs_dir = os.path.join(directory, 'inputs')
+        os.makedirs(self.results_dir, exist_ok=True)
+        os.makedirs(self.inputs_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, kind TEXT NOT NULL, client_id TEXT, filename TEXT, '
+                'status TEXT NOT NULL, sheets_total INTEGER, sheets_done INTEGER NOT NULL DEFAULT 0, '
+                'current_sheet TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, '
+                'finished_at REAL, params TEXT, owner TEXT, attempts INTEGER NOT NULL DEFAULT 0)'
+            )
+            # Stores created before jobs were queued in the database
+            columns = {row[1] for row in db.execute('PRAGMA table_info(jobs)')}
+            for column, definition in (('params', 'TEXT'), ('owner', 'TEXT'),
+                                       ('attempts', 'INTEGER NOT NULL DEFAULT 0')):
+                if column not in columns:
+                    db.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+            db.execute('CREATE TABLE IF NOT EXISTS owners (id TEXT PRIMARY KEY, seen_at REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as db:
+            db.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def create(self, kind, client_id=None, filename=None, job_id=None, params=None):
+        """
+        Add a job. It is queued once it has params (the run_workbook_job arguments
+        after the job id), given here or with enqueue().
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT INTO jobs (id, kind, client_id, filename, status, created_at, updated_at, params) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (job_id, kind, client_id, filename, QUEUED, now, now,
+                        json.dumps(params) if params is not None else None))
+        return job_id
+
+    def enqueue(self, job_id, params):
+        self._update(job_id, params=json.dumps(params))
+
+    def claim(self, owner, limit):
+        """
+        Mark the oldest queued job as running for owner, unless limit jobs are
+        running already. Returns (job_id, params) or None.
+        """
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            running = db.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (RUNNING,)).fetchone()[0]
+            if running >= limit:
+                return None
+            row = db.execute('SELECT id, params FROM jobs WHERE status = ? AND params IS NOT NULL '
+                             'ORDER BY created_at LIMIT 1', (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                       (RUNNING, owner, time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, owner):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO owners (id, seen_at) VALUES (?, ?)', (owner, time.time()))
+
+    def remove_owner(self, owner):
+        with self._connect() as db:
+            db.execute('DELETE FROM owners WHERE id = ?', (owner,))
+
+    def recover_orphans(self, timeout=JOB_OWNER_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS, now=None):
+        """
+        Take back running jobs whose owner has not sent a heartbeat for timeout
+        seconds: queue them again, or fail them after max_attempts runs or if
+        their upload is gone. Returns (requeued, failed).
+        """
+        oldest = (now or time.time()) - timeout
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            orphans = db.execute(
+                'SELECT id, params, attempts FROM jobs WHERE status = ? AND (owner IS NULL OR owner NOT IN '
+                '(SELECT id FROM owners WHERE seen_at >= ?))', (RUNNING, oldest)
+            ).fetchall()
+            requeued = failed = 0
+            now = time.time()
+            for job_id, params, attempts in orphans:
+                source = json.loads(params)[0] if params else None
+                if source and attempts < max_attempts and (source[0] != 'upload' or os.path.exists(source[1])):
+                    db.execute('UPDATE jobs SET status = ?, owner = NULL, sheets_done = 0, current_sheet = NULL, '
+                               'updated_at = ? WHERE id = ?', (QUEUED, now, job_id))
+                    requeued += 1
+                else:
+                    db.execute('UPDATE jobs SET status = ?, owner = NULL, current_sheet = NULL, error = ?, '
+                               'updated_at = ?, finished_at = ? WHERE id = ?',
+                               (FAILED, 'Job worker stopped before finishing', now, now, job_id))
+                    failed += 1
+            db.execute('DELETE FROM owners WHERE seen_at < ?', (oldest,))
+        return requeued, failed
+
+    def input_path(self, job_id, filename=''):
+        return os.path.join(self.inputs_dir, job_id + os.path.splitext(filename or '')[1])
+
+    def result_path(self, job_id):
+        return os.path.join(self.results_dir, f'{job_id}.json')
+
+    def set_progress(self, job_id, sheets_done, sheets_total, current_sheet=None):
+        self._update(job_id, sheets_done=sheets_done, sheets_total=sheets_total, current_sheet=current_sheet)
+
+    def finish(self, job_id, result_bytes):
+        """
+        Store the serialized result (written to a temp file and renamed into place)
+        and mark the job done. Returns the result path.
+        """
+        path = self.result_path(job_id)
+        with open(f'{path}.tmp', 'wb') as handle:
+            handle.write(result_bytes)
+        os.replace(f'{path}.tmp', path)
+        self._update(job_id, status=DONE, current_sheet=None, owner=None, finished_at=time.time())
+        return path
+
+    def fail(self, job_id, error):
+        self._update(job_id, status=FAILED, error=str(error), current_sheet=None, owner=None, finished_at=time.time())
+
+    def get(self, job_id):
+        """The job as a dict, or None if it does not exist (or has expired)."""
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if self.ttl and job['updated_at'] < time.time() - self.ttl:
+            return None
+        return job
+
+    def read_result(self, job_id):
+        try:
+            with open(self.result_path(job_id), 'rb') as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def cleanup(self, now=None):
+        """Delete jobs not updated for ttl seconds, with their results and inputs. Returns the number removed."""
+        if not self.ttl:
+            return 0
+        oldest = (now or time.time()) - self.ttl
+        with self._connect() as db:
+            expired = [row[0] for row in db.execute('SELECT id FROM jobs WHERE updated_at < ?', (oldest,))]
+            db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        for job_id in expired:
+            for path in [self.result_path(job_id)] + [os.path.join(self.inputs_dir, name)
+                                                      for name in os.listdir(self.inputs_dir) if name.startswith(job_id)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return len(expired)
+
+    def counts(self):
+        with self._connect() as db:
+            return dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+def describe_job(job):
+    """Public view of a job record for the status endpoint."""
+    total = job['sheets_total']
+    return {
+        'jobId': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'clientId': job['client_id'],
+        'filename': job['filename'],
+        'sheetsTotal': total,
+        'sheetsDone': job['sheets_done'],
+        'currentSheet': job['current_sheet'],
+        'progress': round(job['sheets_done'] / total, 4) if total else (1.0 if job['status'] == DONE else 0.0),
+        'error': job['error'],
+        'createdAt': job['created_at'],
+        'updatedAt': job['updated_at'],
+        'finishedAt': job['finished_at']
+    }
+
+
+_dms_clients = {}
+
+
+def _dms_client(base_url):
+    from dms_client import DMSClient
+    if base_url not in _dms_clients:
+        _dms_clients[base_url] = DMSClient(base_url=base_url)
+    return _dms_clients[base_url]
+
+
+def run_workbook_job(store_dir, job_id, serialize, source, quarter_date_range=None, dms_base_url=None):
+    """
+    Worker entry point. source is ('upload', path, client_id, filename, mimetype):
+    a stored upload that is also sent to the DMS while it is parsed, or
+    ('dms', client_id, filename): a document fetched from the DMS first.
+    The categorize_excel_sheets_fuzzy result is encoded with serialize and stored
+    here, so only its path goes back to the web worker; failures are raised.
+    """
+    store = JobStore(store_dir, ttl=None)
+    return store.finish(job_id, serialize(_process_workbook(store, job_id, source, quarter_date_range,
+                                                            dms_base_url)))
+
+
+def _process_workbook(store, job_id, source, quarter_date_range, dms_base_url):
+    from io import BytesIO
+    from sheet_processing import categorize_excel_sheets_fuzzy
+
+    def progress(sheets_done, sheets_total, sheet_name):
+        store.set_progress(job_id, sheets_done, sheets_total, sheet_name)
+
+    if source[0] == 'dms':
+        _, client_id, filename = source
+        resp = _dms_client(dms_base_url).stream(client_id, filename)
+        if resp.status_code != 200:
+            raise RuntimeError(f'Failed to fetch file from external API: {resp.text}')
+        return categorize_excel_sheets_fuzzy(BytesIO(resp.content), quarter_date_range, workers=1, progress=progress,
+                                            client_id=client_id, filename=filename)
+    _, path, client_id, filename, mimetype = source
+    dms = _dms_client(dms_base_url)
+
+    def upload():
+        with open(path, 'rb') as fileobj:
+            return dms.upload(client_id, filename, fileobj, mimetype)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            upload_future = executor.submit(upload)
+            try:
+                result = categorize_excel_sheets_fuzzy(path, quarter_date_range, workers=1, progress=progress,
+                                                      client_id=client_id, filename=filename)
+                parse_error = None
+            except Exception as e:
+                parse_error = e
+            # As in /getData, a failed upload is reported before a failed parse
+            try:
+                upload_resp = upload_future.result()
+            except Exception as e:
+                raise RuntimeError(f'Exception during upload: {str(e)}')
+            if upload_resp.status_code != 200:
+                raise RuntimeError(f'Failed to upload file to external API: {upload_resp.text}')
+        if parse_error is not None:
+            raise parse_error
+        return result
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class JobManager:
+    """
+    Queues workbook jobs in the store and runs the ones its dispatcher claims on
+    a process pool. serialize turns a result into the bytes served by the result
+    endpoint, so results are encoded the same way as the synchronous responses;
+    it runs in the worker processes and must be picklable.
+    """
+
+    def __init__(self, store, serialize, workers=JOB_WORKERS, cleanup_interval=JOB_CLEANUP_INTERVAL,
+                 poll_interval=JOB_POLL_INTERVAL, owner_timeout=JOB_OWNER_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS):
+        self.store = store
+        self.serialize = serialize
+        self.workers = workers
+        self.cleanup_interval = cleanup_interval
+        self.poll_interval = poll_interval
+        self.owner_timeout = owner_timeout
+        self.max_attempts = max_attempts
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.requeued = 0
+        self.orphaned = 0
+        self._last_cleanup = 0.0
+        self._pool = None
+        self._context = None
+        self._pid = None
+        self._owner = None
+        self._running = 0
+        self._dispatcher = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the pool and dispatcher of this process, once (a fork inherits neither)."""
+        with self._lock:
+            if self._pid == os.getpid() and self._dispatcher is not None:
+                return
+            start_methods = multiprocessing.get_all_start_methods()
+            self._context = multiprocessing.get_context('forkserver' if 'forkserver' in start_methods else 'spawn')
+            if 'forkserver' in start_methods:
+                self._context.set_forkserver_preload(['sheet_processing', 'jobs'])
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context)
+            self._pid = os.getpid()
+            self._owner = f'{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}'
+            self._running = 0
+            self._stop.clear()
+            self.store.heartbeat(self._owner)
+            self._dispatcher = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        last_heartbeat = 0.0
+        while not self._stop.is_set():
+            try:
+                now = time.time()
+                if now - last_heartbeat >= self.poll_interval:
+                    last_heartbeat = now
+                    self.store.heartbeat(self._owner)
+                    requeued, failed = self.store.recover_orphans(self.owner_timeout, self.max_attempts)
+                    self.requeued += requeued
+                    self.orphaned += failed
+                while self._running < self.workers and self._claim_next():
+                    pass
+            except Exception as e:
+                print(f"Job dispatcher error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim_next(self):
+        claimed = self.store.claim(self._owner, self.workers)
+        if claimed is None:
+            return False
+        job_id, (source, quarter_date_range, dms_base_url) = claimed
+        with self._lock:
+            self._running += 1
+        try:
+            future = self._pool.submit(run_workbook_job, self.store.directory, job_id, self.serialize,
+                                       tuple(source), quarter_date_range, dms_base_url)
+        except BrokenProcessPool as e:
+            self._replace_pool()
+            self._finish(job_id, error=f'Job worker failed: {e}')
+            return True
+        future.add_done_callback(lambda done: self._record(job_id, done))
+        return True
+
+    def _replace_pool(self):
+        with self._lock:
+            broken = self._pool
+            if broken is None:
+                return
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context)
+        broken.shutdown(wait=False)
+
+    def maybe_cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        try:
+            self.expired += self.store.cleanup(now)
+        except Exception as e:
+            print(f"Job cleanup failed: {e}")
+
+    def submit_upload(self, stream, client_id, filename, mimetype, quarter_date_range=None, dms_base_url=None):
+        """Store an uploaded workbook and queue it for upload to the DMS and processing. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        path = self.store.input_path(job_id, filename)
+        with open(path, 'wb') as handle:
+            shutil.copyfileobj(stream, handle)
+        return self._submit('upload', client_id, filename, job_id,
+                            [('upload', path, client_id, filename, mimetype), quarter_date_range, dms_base_url])
+
+    def submit_document(self, client_id, filename, quarter_date_range=None, dms_base_url=None):
+        """Queue a DMS document for download and processing. Returns the job id."""
+        return self._submit('document', client_id, filename, None,
+                            [('dms', client_id, filename), quarter_date_range, dms_base_url])
+
+    def _submit(self, kind, client_id, filename, job_id, params):
+        self.maybe_cleanup()
+        job_id = self.store.create(kind, client_id, filename, job_id=job_id, params=params)
+        self.submitted += 1
+        self._start()
+        self._wake.set()
+        return job_id
+
+    def _record(self, job_id, future):
+        try:
+            future.result()
+            self._finish(job_id)
+        except BrokenProcessPool as e:
+            self._replace_pool()
+            self._finish(job_id, error=f'Job worker failed: {e}')
+        except Exception as e:
+            self._finish(job_id, error=f'Exception occurred: {str(e)}')
+
+    def _finish(self, job_id, error=None):
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+            self.store.fail(job_id, error)
+        with self._lock:
+            self._running -= 1
+        self._wake.set()
+
+    def status(self, job_id):
+        self.maybe_cleanup()
+        # Any web worker polling a job keeps the queue moving, even if the one it was submitted to is gone
+        self._start()
+        return self.store.get(job_id)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pid != os.getpid() or self._dispatcher is None:
+                return
+            dispatcher, pool, owner = self._dispatcher, self._pool, self._owner
+            self._dispatcher = self._pool = None
+            self._stop.set()
+            self._wake.set()
+        dispatcher.join(timeout=self.poll_interval + 1)
+        pool.shutdown(wait=wait)
+        if wait:
+            # Nothing this process claimed is still running
+            self.store.remove_owner(owner)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'running_here': self._running,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'requeued': self.requeued,
+            'orphaned': self.orphaned,
+            'expired': self.expired,
+            'jobs': self.store.counts()
+        }
+
+
+def create_job_manager(serialize):
+    """Build the job manager from JOB_STORE_DIR, JOB_TTL, JOB_WORKERS and JOB_CLEANUP_INTERVAL."""
+    manager = JobManager(JobStore(JOB_STORE_DIR, JOB_TTL), serialize)
+    atexit.register(manager.shutdown, False)
+    return manager
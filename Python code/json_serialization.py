@@ -0,0 +1,99 @@
+# ----------------------
+# JSON Serialization
+# ----------------------
+# Fast JSON encoding for the sheet and prediction payloads of both apps, built on
+# orjson. mapped_data is full of pandas Timestamps, numpy scalars and NaN: numpy
+# scalars and floats are encoded in native code, Timestamps by a small default(),
+# and missing values (NaN, NaT, pd.NA) come out as null rather than the invalid
+# NaN token the standard library writes.
+#
+# The Flask provider keeps the output of Flask's default provider: sorted keys
+# and dates as HTTP dates ("Tue, 01 Jul 2025 00:00:00 GMT").
+import datetime
+import decimal
+import functools
+import uuid
+import numpy as np
+import orjson
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+BASE_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Values orjson does not encode itself. Missing values become null."""
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+@functools.lru_cache(maxsize=65536)
+def http_date(value):
+    """
+    Same string as werkzeug.http.http_date, which Flask uses for dates. Ledgers
+    repeat the same few hundred dates, so results are cached.
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+def _http_date_default(obj):
+    """As _default, with dates and datetimes written the way Flask writes them."""
+    if isinstance(obj, datetime.date) and obj is not pd.NaT:
+        return http_date(obj)
+    return _default(obj)
+
+
+def dumps(obj, sort_keys=False, http_dates=False, indent=False):
+    """
+    Encode obj as UTF-8 JSON bytes. Keys keep their order unless sort_keys is set;
+    with http_dates, dates are written as HTTP dates instead of ISO 8601.
+    """
+    option = BASE_OPTIONS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    if http_dates:
+        option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=_http_date_default, option=option)
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding with orjson. Output matches the default provider
+    (sorted keys, HTTP dates, indented in debug mode) except that NaN is null and
+    non-ASCII text is written as UTF-8 rather than escaped. Parsing is unchanged.
+    """
+
+    def dumps_bytes(self, obj):
+        """obj encoded as in a response body, without the trailing newline."""
+        return dumps(obj, sort_keys=self.sort_keys, http_dates=True)
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), http_dates=True,
+                     indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = dumps(obj, sort_keys=self.sort_keys, http_dates=True, indent=indent)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,499 @@
+# ----------------------
+# Load Testing
+# ----------------------
+# Reproduces production-like load on one machine, fully offline:
+#   - a stub DMS serves /api/Document/stream from DMS/Uploads (with ETags) and
+#     accepts /api/Document/upload
+#   - the Flask and FastAPI apps run under serve.py against the stub DMS and a
+#     small model trained on synthetic ledgers (or use --flask-url/--fastapi-url
+#     to target servers that are already running)
+#   - concurrent clients send a weighted mix of /predict, /predict_bulk,
+#     /getMappedCategory, /getData uploads and /getSheetData fetches
+# The report gives throughput, p50/p95/p99 latency and error rate per request
+# type, and the servers' RSS over time.
+#
+#   python loadtest.py --concurrency 16 --duration 60 --mix predict=50,bulk=10,sheet=25,upload=5,mapped=10
+import argparse
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DMS_UPLOADS_DIR = os.path.join(SCRIPT_DIR, '..', 'DMS', 'Uploads')
+LOADTEST_CLIENT_ID = 'loadtest'
+LOADTEST_PERIOD = '1/4/2025-30/6/2025'
+
+DEFAULT_MIX = 'predict=50,bulk=10,mapped=10,upload=5,sheet=25'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class StubDMSServer:
+    """
+    Stand-in for the DMS document endpoints. stream serves the file in documents_dir
+    named by filePath, with an ETag and 304 Not Modified like the real service;
+    upload reads and discards the file. latency_ms delays every response.
+    """
+
+    def __init__(self, documents_dir=DMS_UPLOADS_DIR, host='127.0.0.1', port=0, latency_ms=0.0):
+        self.documents_dir = documents_dir
+        self.latency = latency_ms / 1000
+        self.uploads = 0
+        self.streams = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b'', headers=None):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if urlparse(self.path).path != '/api/Document/upload':
+                    return self.reply(404, b'not found')
+                remaining = int(self.headers.get('Content-Length', 0))
+                while remaining:
+                    remaining -= len(self.rfile.read(min(remaining, 65536)))
+                with stub._lock:
+                    stub.uploads += 1
+                self.reply(200, b'{"message": "File uploaded successfully"}', {'Content-Type': 'application/json'})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/api/Document/stream':
+                    return self.reply(404, b'not found')
+                query = parse_qs(url.query)
+                file_path = query.get('filePath', [''])[0]
+                path = os.path.join(stub.documents_dir, os.path.basename(file_path.replace('\\', '/')))
+                if not file_path or not os.path.isfile(path):
+                    return self.reply(404, b'Document not found or access denied.')
+                info = os.stat(path)
+                etag = f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+                with stub._lock:
+                    stub.streams += 1
+                if self.headers.get('If-None-Match') == etag:
+                    with stub._lock:
+                        stub.not_modified += 1
+                    return self.reply(304, headers={'ETag': etag})
+                with open(path, 'rb') as handle:
+                    body = handle.read()
+                self.reply(200, body, {'ETag': etag, 'Content-Type': XLSX_MIMETYPE})
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-dms', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def workbook_files(documents_dir=DMS_UPLOADS_DIR):
+    return sorted(name for name in os.listdir(documents_dir) if name.lower().endswith('.xlsx'))
+
+
+def write_loadtest_model(model_dir, samples=5000):
+    """
+    Train a small TF-IDF + logistic regression model on synthetic ledger
+    descriptions and save it as a versioned artifact the registry will serve.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    import joblib
+    import numpy as np
+    from synthetic_ledger import StubClassifier, ledger_descriptions
+    texts = ledger_descriptions(np.random.default_rng(0), samples)
+    pipeline = make_pipeline(TfidfVectorizer(ngram_range=(1, 2)), LogisticRegression(max_iter=500))
+    pipeline.fit(texts, StubClassifier().predict(texts))
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, 'ultra_high_accuracy_classifier-loadtest.joblib')
+    joblib.dump(pipeline, path)
+    # Old enough for the registry to treat it as fully written
+    settled = time.time() - 60
+    os.utime(path, (settled, settled))
+    return path
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """One of the apps running under serve.py in a subprocess."""
+
+    def __init__(self, app_name, port, workers, env):
+        self.app_name = app_name
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}'
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, 'serve.py'), '--app', app_name,
+             '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers)],
+            cwd=SCRIPT_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, path, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.app_name} server exited with {self.process.returncode}:\n{self.output()}")
+            try:
+                if requests.get(self.url + path, timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"{self.app_name} server did not start within {timeout}s:\n{self.output()}")
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode('utf-8', 'replace')[-4000:]
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', encoding='utf-8') as handle:
+                # The command name is in parentheses and may contain spaces
+                parent = int(handle.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def rss_mb(pid):
+    """Resident set size of a process in MB, or 0 if it is gone."""
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as handle:
+            for line in handle:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler:
+    """Samples the total RSS of each server's process tree every interval seconds."""
+
+    def __init__(self, pids, interval=1.0):
+        self.pids = pids
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._started = None
+
+    def _sample(self):
+        sample = {'t': round(time.perf_counter() - self._started, 2)}
+        for name, pid in self.pids.items():
+            sample[name] = round(sum(rss_mb(member) for member in process_tree(pid)), 1)
+        self.samples.append(sample)
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+class Workload:
+    """
+    Builds the requests of the mix. Each request type is a function of a
+    requests.Session and a random.Random that returns the response.
+    """
+
+    def __init__(self, flask_url, fastapi_url, documents_dir=DMS_UPLOADS_DIR, bulk_size=500, mapped_size=200, seed=0):
+        from synthetic_ledger import ledger_records
+        self.flask_url = flask_url
+        self.fastapi_url = fastapi_url
+        self.records = ledger_records(max(bulk_size, mapped_size, 1000), seed=seed)
+        self.bulk_size = bulk_size
+        self.mapped_size = mapped_size
+        self.documents = []
+        for name in workbook_files(documents_dir):
+            with open(os.path.join(documents_dir, name), 'rb') as handle:
+                self.documents.append((name, handle.read()))
+        self.requests = {
+            'predict': self.predict,
+            'bulk': self.bulk,
+            'mapped': self.mapped,
+            'upload': self.upload,
+            'sheet': self.sheet,
+        }
+
+    def _sample(self, rng, size):
+        start = rng.randrange(0, len(self.records) - size + 1)
+        return self.records[start:start + size]
+
+    def predict(self, session, rng):
+        description = rng.choice(self.records)['Description']
+        return session.post(f'{self.fastapi_url}/predict', json={'description': description}, timeout=60)
+
+    def bulk(self, session, rng):
+        return session.post(f'{self.fastapi_url}/predict_bulk', json={'data': self._sample(rng, self.bulk_size)}, timeout=120)
+
+    def mapped(self, session, rng):
+        items = [{'transactionDescription': record['Description'], 'id': record['id']}
+                 for record in self._sample(rng, self.mapped_size)]
+        return session.post(f'{self.flask_url}/getMappedCategory', json=items, timeout=120)
+
+    def upload(self, session, rng):
+        name, content = rng.choice(self.documents)
+        return session.post(f'{self.flask_url}/getData', data={'clientId': LOADTEST_CLIENT_ID},
+                            files={'file': (name, content, XLSX_MIMETYPE)}, timeout=120)
+
+    def sheet(self, session, rng):
+        name, _ = rng.choice(self.documents)
+        params = {'clientId': LOADTEST_CLIENT_ID, 'filename': name, 'currentPeriod': LOADTEST_PERIOD}
+        return session.get(f'{self.flask_url}/getSheetData', params=params, timeout=120)
+
+
+def parse_mix(mix):
+    """'predict=50,bulk=10' -> {'predict': 50.0, 'bulk': 10.0}; zero weights are dropped."""
+    weights = {}
+    for part in mix.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def drive(workload, mix, concurrency=8, duration=30.0, seed=0):
+    """
+    Send requests from `concurrency` threads for `duration` seconds, each picking
+    request types by weight. Returns a list of (type, latency seconds, ok, error).
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            error = None
+            try:
+                response = workload.requests[name](session, rng)
+                ok = response.status_code < 400
+                if not ok:
+                    error = f'HTTP {response.status_code}'
+            except requests.RequestException as e:
+                ok = False
+                error = type(e).__name__
+            local.append((name, time.perf_counter() - started, ok, error))
+        session.close()
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=client, args=(index,), name=f'loadtest-{index}') for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, elapsed, rss_samples=None):
+    """Per request type and overall: count, throughput, error rate and latency percentiles in ms."""
+    groups = {}
+    for name, latency, ok, error in results:
+        groups.setdefault(name, []).append((latency, ok, error))
+    groups['all'] = [(latency, ok, error) for _, latency, ok, error in results]
+    report = {'elapsed_seconds': round(elapsed, 2), 'requests': {}}
+    for name, entries in groups.items():
+        latencies = sorted(latency * 1000 for latency, _, _ in entries)
+        errors = [error for _, ok, error in entries if not ok]
+        error_kinds = {}
+        for error in errors:
+            error_kinds[error] = error_kinds.get(error, 0) + 1
+        report['requests'][name] = {
+            'count': len(entries),
+            'throughput_rps': round(len(entries) / elapsed, 2) if elapsed else None,
+            'error_rate': round(len(errors) / len(entries), 4) if entries else 0.0,
+            'errors': error_kinds,
+            'p50_ms': _round(percentile(latencies, 0.50)),
+            'p95_ms': _round(percentile(latencies, 0.95)),
+            'p99_ms': _round(percentile(latencies, 0.99)),
+            'max_ms': _round(latencies[-1] if latencies else None)
+        }
+    if rss_samples:
+        report['rss_mb'] = rss_samples
+        report['rss_peak_mb'] = {name: max(sample[name] for sample in rss_samples)
+                                 for name in rss_samples[0] if name != 't'}
+    return report
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def print_report(report):
+    print(f"\n{'request':>10} {'count':>8} {'req/s':>9} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in report['requests'].items():
+        print(f"{name:>10} {row['count']:>8} {row['throughput_rps'] or 0:>9.1f} {row['error_rate']:>8.2%} "
+              f"{row['p50_ms'] or 0:>9.1f} {row['p95_ms'] or 0:>9.1f} {row['p99_ms'] or 0:>9.1f} {row['max_ms'] or 0:>9.1f}")
+        for error, occurrences in row['errors'].items():
+            print(f"{'':>10} {occurrences:>8} x {error}")
+    if report.get('rss_mb'):
+        print("\nServer RSS (MB) over time:")
+        for sample in report['rss_mb']:
+            print('  ' + '  '.join(f"{key}={value}" for key, value in sample.items()))
+
+
+def run_loadtest(mix=DEFAULT_MIX, concurrency=8, duration=30.0, server_workers=1, bulk_size=500, mapped_size=200,
+                 flask_url=None, fastapi_url=None, documents_dir=DMS_UPLOADS_DIR, dms_latency_ms=0.0,
+                 rss_interval=1.0, seed=0):
+    """
+    Start the stub DMS and (unless URLs are given) both apps, drive the mix and
+    return the report. Everything is stopped again before returning.
+    """
+    mix = parse_mix(mix) if isinstance(mix, str) else mix
+    servers = {}
+    with StubDMSServer(documents_dir, latency_ms=dms_latency_ms) as dms, tempfile.TemporaryDirectory() as model_dir:
+        try:
+            if flask_url is None or fastapi_url is None:
+                write_loadtest_model(model_dir)
+                env = dict(os.environ, DMS_BASE_URL=dms.url, MODEL_DIR=model_dir, MODEL_POLL_INTERVAL='0',
+                           PYTHONUNBUFFERED='1')
+                if flask_url is None:
+                    servers['flask'] = AppServer('flask', free_port(), server_workers, env)
+                if fastapi_url is None:
+                    servers['fastapi'] = AppServer('fastapi', free_port(), server_workers, env)
+                if 'flask' in servers:
+                    servers['flask'].wait_ready('/modelInfo')
+                    flask_url = servers['flask'].url
+                if 'fastapi' in servers:
+                    servers['fastapi'].wait_ready('/')
+                    fastapi_url = servers['fastapi'].url
+            workload = Workload(flask_url, fastapi_url, documents_dir, bulk_size, mapped_size, seed)
+            sampler = RssSampler({name: server.process.pid for name, server in servers.items()}, rss_interval).start()
+            started = time.perf_counter()
+            results = drive(workload, mix, concurrency, duration, seed)
+            elapsed = time.perf_counter() - started
+            sampler.stop()
+        finally:
+            for server in servers.values():
+                server.stop()
+        report = summarize(results, elapsed, sampler.samples if servers else None)
+        report['config'] = {'mix': mix, 'concurrency': concurrency, 'duration': duration,
+                            'server_workers': server_workers, 'bulk_size': bulk_size, 'mapped_size': mapped_size}
+        report['dms'] = {'streams': dms.streams, 'not_modified': dms.not_modified, 'uploads': dms.uploads}
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the Flask and FastAPI apps against a stub DMS.")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Weighted request types: predict, bulk, mapped, upload, sheet")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of load")
+    parser.add_argument('--server-workers', type=int, default=1, help="serve.py workers per app")
+    parser.add_argument('--bulk-size', type=int, default=500, help="Records per /predict_bulk request")
+    parser.add_argument('--mapped-size', type=int, default=200, help="Items per /getMappedCategory request")
+    parser.add_argument('--documents', default=DMS_UPLOADS_DIR, help="Workbooks served by the stub DMS")
+    parser.add_argument('--dms-latency-ms', type=float, default=0.0)
+    parser.add_argument('--flask-url', help="Use a running Flask app instead of starting one")
+    parser.add_argument('--fastapi-url', help="Use a running FastAPI app instead of starting one")
+    parser.add_argument('--rss-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the report as JSON")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+    unknown = [name for name in mix if name not in ('predict', 'bulk', 'mapped', 'upload', 'sheet')]
+    if unknown or not mix:
+        parser.error(f"invalid --mix: {args.mix}")
+    report = run_loadtest(mix, args.concurrency, args.duration, args.server_workers, args.bulk_size, args.mapped_size,
+                          args.flask_url, args.fastapi_url, args.documents, args.dms_latency_ms, args.rss_interval, args.seed)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+    return 1 if report['requests'].get('all', {}).get('error_rate') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional, Union
-import joblib
 import os
 import socket
+from instrumentation import begin_request, checkpoint, count, finish_request, metrics
+from json_serialization import dumps
+from micro_batcher import MicroBatcher
+from model_registry import get_registry
+from model_store import MODEL_DIR, active_model_path
+from prediction_cache import shared_prediction_cache
 
 # --- Utility Functions ---
 def get_local_ip():
@@ -22,10 +28,89 @@ def get_local_ip():
         return "127.0.0.1"
 
 
+# Fallback column names tried when the requested description column is missing
+COMMON_DESCRIPTION_VARIATIONS = [
+    'description', 'Description', 'DESCRIPTION',
+    'transaction description', 'Transaction Description', 'TRANSACTION DESCRIPTION',
+    'transaction_description', 'Transaction_Description',
+    'desc', 'Desc', 'DESC'
+]
+
+
+def resolve_description_keys(record_keys, description_column):
+    """
+    Work out which keys of a record hold its description.
+    Returns the candidate keys in lookup order: the exact column if present,
+    otherwise the first case-insensitive match followed by the first common
+    variation. The first candidate with a non-null value is the description.
+    """
+    if description_column in record_keys:
+        return (description_column,)
+    candidates = []
+    lowered_column = description_column.lower()
+    for key in record_keys:
+        if key.lower() == lowered_column:
+            candidates.append(key)
+            break
+    for variation in COMMON_DESCRIPTION_VARIATIONS:
+        if variation in record_keys:
+            candidates.append(variation)
+            break
+    return tuple(candidates)
+
+
 # --- Model Loading ---
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "saved_model")
-MODEL_PATH = os.path.join(MODEL_DIR, "ultra_high_accuracy_classifier.joblib")
+# The registry loads and warms the newest model artifact and swaps in new ones
+# as they appear in saved_model; `model` always points at the serving model
 model = None
+model_registry = get_registry()
+
+
+def use_model(model_version):
+    global model
+    model = model_version.model
+
+
+prediction_cache = shared_prediction_cache(active_model_path(), version_fn=model_registry.version_of)
+
+# Maximum number of descriptions sent to the model in a single predict() call
+PREDICT_BULK_CHUNK_SIZE = int(os.environ.get("PREDICT_BULK_CHUNK_SIZE", "5000"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response encoded with orjson. Returned for output that is already built,
+    so FastAPI does not validate it against the response model again.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def predict_texts(texts):
+    """Predict a list of descriptions with the current model, through the shared cache."""
+    return prediction_cache.predict(model, texts)
+
+
+# Concurrent /predict calls are grouped into batches of up to PREDICT_BATCH_MAX_SIZE
+# descriptions, waiting at most PREDICT_BATCH_MAX_WAIT_MS for a batch to fill
+predict_batcher = MicroBatcher(
+    predict_texts,
+    max_batch_size=int(os.environ.get("PREDICT_BATCH_MAX_SIZE", "64")),
+    max_wait_ms=float(os.environ.get("PREDICT_BATCH_MAX_WAIT_MS", "5"))
+)
+
+metrics.register_collector("prediction_cache", prediction_cache.stats)
+metrics.register_collector("model_registry", model_registry.stats)
+metrics.register_collector("predict_batcher", lambda: {
+    "queue_depth": predict_batcher.stats()["queue_depth"],
+    "failed_batches": predict_batcher.failed_batches
+})
+metrics.register_histogram("predict_batch_size", predict_batcher.batch_sizes)
+metrics.register_histogram("predict_queue_wait_ms", predict_batcher.queue_waits_ms)
 
 
 @asynccontextmanager
@@ -35,10 +120,11 @@ async def lifespan(app: FastAPI):
     Load the model on startup and clean up on shutdown.
     """
     # Startup
-    global model
-    try:
-        model = joblib.load(MODEL_PATH)
-        print("Model loaded successfully.")
+    model_registry.add_listener(use_model)
+    model_registry.check()
+    model_registry.start()
+    if model is not None:
+        print(f"Model {model_registry.version} loaded successfully.")
         
         # Print network access information
         local_ip = get_local_ip()
@@ -48,36 +134,54 @@ async def lifespan(app: FastAPI):
         print(f"   Web Interface: http://{local_ip}:8000/web")
         print(f"   API Documentation: http://{local_ip}:8000/docs")
         print(f"\n   Share the network URL with other users on your network!")
-        
-    except FileNotFoundError:
-        print(f"Error: Model file not found at {MODEL_PATH}")
-        model = None  # Ensure model is None if loading fails
-    except Exception as e:
-        print(f"An error occurred while loading the model: {e}")
-        model = None
+    else:
+        print(f"Error: no model loaded from {MODEL_DIR}; waiting for an artifact to appear")
     
+    await predict_batcher.start()
+
     yield
     
     # Shutdown (cleanup if needed)
+    await predict_batcher.stop()
+    model_registry.stop()
     print("Application shutting down...")
 
 
 # --- Application Setup ---
-app = FastAPI(
-    title="Tax Category Classifier API",
-    description="An API to predict the category based on its description.",
-    version="1.0.0",
-    lifespan=lifespan
-)
+# The endpoints are registered on a router, so service.py can serve them from its
+# own app built by create_app()
+router = APIRouter()
+
+
+async def add_server_timing(request: Request, call_next):
+    """
+    Time the request and report its stages in a Server-Timing header.
+    Handlers mark the end of body validation and of their own work with
+    checkpoint(); the rest, up to the response, is FastAPI serializing the result.
+    """
+    timing = begin_request()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        route = request.scope.get("route")
+        # Requests passed on to the mounted Flask app are named by its url rule
+        if isinstance(route, APIRoute):
+            timing.endpoint = route.path
+        finish_request(timing, status=status, tail_stage="serialize")
+        response.headers["Server-Timing"] = timing.server_timing()
+        return response
+    finally:
+        finish_request(timing, status=status)
 
-# Add CORS middleware to allow requests from the HTML file
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allows all origins
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods
-    allow_headers=["*"],  # Allows all headers
-)
+
+async def add_model_version(request: Request, call_next):
+    """Report which model version served the request."""
+    response = await call_next(request)
+    version = model_registry.version_of(model)
+    if version is not None:
+        response.headers["X-Model-Version"] = version
+    return response
 
 
 # --- Pydantic Models for Request and Response ---
@@ -98,6 +202,11 @@ class BulkPredictionRequest(BaseModel):
         default="Description", 
         description="Name of the column containing transaction descriptions (e.g., 'Description' or 'Transaction Description')"
     )
+    chunk_size: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Maximum number of descriptions per model call (defaults to PREDICT_BULK_CHUNK_SIZE)"
+    )
 
 
 class BulkPredictionResponse(BaseModel):
@@ -110,13 +219,13 @@ class BulkPredictionResponse(BaseModel):
 
 
 # --- API Endpoints ---
-@app.get("/", tags=["General"])
+@router.get("/", tags=["General"])
 def read_root():
     """A simple endpoint to check if the API is running."""
     return {"message": "Welcome to the Product Category Classifier API!"}
 
 
-@app.get("/web", response_class=HTMLResponse, tags=["Web Interface"])
+@router.get("/web", response_class=HTMLResponse, tags=["Web Interface"])
 def get_web_interface():
     """
     Serves the HTML web interface for the API.
@@ -178,10 +287,35 @@ def get_web_interface():
         )
 
 
-@app.post("/predict", response_model=PredictionResponse, tags=["Prediction"])
-def predict_category(request: PredictionRequest):
+@router.get("/cache/stats", tags=["General"])
+def get_cache_stats():
+    """Hit, miss and eviction counts for the shared prediction cache."""
+    return prediction_cache.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["General"])
+def get_metrics():
+    """Stage and request duration histograms, counters and cache stats for Prometheus."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/model/info", tags=["General"])
+def get_model_info():
+    """The serving model version, when it was loaded and how many hot swaps happened."""
+    return model_registry.stats()
+
+
+@router.get("/predict/batching/stats", tags=["General"])
+def get_batching_stats():
+    """Batch-size and queue-wait histograms for the /predict micro-batcher."""
+    return predict_batcher.stats()
+
+
+@router.post("/predict", response_model=PredictionResponse, tags=["Prediction"])
+async def predict_category(request: PredictionRequest):
     """
     Predicts the product category based on its description.
+    Concurrent requests are micro-batched into a single model call.
 
     - **description**: The text description of the product.
     - **returns**: The predicted category for the product.
@@ -197,14 +331,12 @@ def predict_category(request: PredictionRequest):
             status_code=400,
             detail="Description cannot be empty."
         )
+    checkpoint("validate")
 
-    # The model expects a list or iterable of texts
-    description_to_predict = [request.description]
-
-    # Predict using the loaded model
+    # Predict using the loaded model, batched with other concurrent requests
     try:
-        prediction = model.predict(description_to_predict)
-        predicted_category = prediction[0]
+        predicted_category = await predict_batcher.submit(request.description)
+        checkpoint("predict")
         return PredictionResponse(category=predicted_category)
     except Exception as e:
         raise HTTPException(
@@ -213,13 +345,118 @@ def predict_category(request: PredictionRequest):
         )
 
 
-@app.post("/predict_bulk", response_model=BulkPredictionResponse, tags=["Prediction"])
-def predict_bulk_categories(request: BulkPredictionRequest):
+def predict_bulk_batches(request: BulkPredictionRequest):
+    """
+    Validate and predict request.data one chunk at a time.
+    Yields (records, errors) for each chunk, in order. Each record is a copy of the
+    input with 'category_mapped' added; errors carry the index of the failing record.
+    """
+    chunk_size = request.chunk_size or PREDICT_BULK_CHUNK_SIZE
+    key_cache = {}
+
+    for chunk_start in range(0, len(request.data), chunk_size):
+        processed_data = []
+        errors = []
+        pending_indices = []
+        pending_texts = []
+
+        for idx, record in enumerate(request.data[chunk_start:chunk_start + chunk_size], start=chunk_start):
+            # Create a copy of the original record
+            processed_record = record.copy()
+            processed_record['category_mapped'] = None
+            processed_data.append(processed_record)
+
+            # Records in one request almost always share a layout, so the
+            # description column is only looked up once per distinct key set
+            record_keys = tuple(record.keys())
+            candidate_keys = key_cache.get(record_keys)
+            if candidate_keys is None:
+                candidate_keys = resolve_description_keys(record_keys, request.description_column)
+                key_cache[record_keys] = candidate_keys
+
+            description_text = None
+            for key in candidate_keys:
+                description_text = record[key]
+                if description_text is not None:
+                    break
+
+            if description_text is None:
+                errors.append({
+                    "index": idx,
+                    "error": f"Description column '{request.description_column}' not found in record. Available columns: {list(record.keys())}"
+                })
+                continue
+
+            # Validate description is not empty
+            description_text = str(description_text)
+            if not description_text.strip():
+                errors.append({
+                    "index": idx,
+                    "error": "Description is empty or whitespace"
+                })
+                continue
+
+            pending_indices.append(idx)
+            pending_texts.append(description_text)
+
+        # Make predictions for the whole chunk, writing results back by index
+        try:
+            predictions = prediction_cache.predict(model, pending_texts) if pending_texts else []
+        except Exception:
+            # Fall back to one call per record so failures are still
+            # reported against the record that caused them
+            predictions = None
+
+        for offset, idx in enumerate(pending_indices):
+            processed_record = processed_data[idx - chunk_start]
+            if predictions is not None:
+                processed_record['category_mapped'] = predictions[offset]
+                continue
+            try:
+                prediction = prediction_cache.predict(model, [pending_texts[offset]])
+                processed_record['category_mapped'] = prediction[0]
+            except Exception as e:
+                errors.append({
+                    "index": idx,
+                    "error": f"Prediction failed: {str(e)}"
+                })
+
+        errors.sort(key=lambda error: error["index"])
+        yield processed_data, errors
+
+
+def stream_bulk_predictions(request: BulkPredictionRequest):
+    """
+    NDJSON lines for /predict_bulk: one 'batch' line per chunk as soon as it is
+    predicted, then a 'summary' line with the counts and every error.
+    """
+    all_errors = []
+    for processed_data, errors in predict_bulk_batches(request):
+        all_errors.extend(errors)
+        yield dumps({"type": "batch", "data": processed_data, "errors": errors}) + b"\n"
+    yield dumps({
+        "type": "summary",
+        "processed_count": len(request.data),
+        "success_count": len(request.data) - len(all_errors),
+        "error_count": len(all_errors),
+        "errors": all_errors
+    }) + b"\n"
+
+
+@router.post("/predict_bulk", response_model=BulkPredictionResponse, tags=["Prediction"])
+def predict_bulk_categories(
+    request: BulkPredictionRequest,
+    http_request: Request = None,
+    stream: bool = False
+):
     """
     Predicts categories for multiple transactions in JSON format.
     
     - **data**: List of transaction records (JSON objects)
     - **description_column**: Name of the column containing descriptions (configurable)
+    - **chunk_size**: Maximum number of descriptions per model call (optional)
+    - **stream**: Stream one NDJSON line per chunk plus a final summary line (optional,
+      also selected by `Accept: application/x-ndjson`)
     - **returns**: Original data with added 'category_mapped' column
     
     The endpoint will look for either 'Description' or 'Transaction Description' column
@@ -236,99 +473,56 @@ def predict_bulk_categories(request: BulkPredictionRequest):
             status_code=400,
             detail="Data list cannot be empty."
         )
-    
-    # Process the data
+
+    checkpoint("validate")
+    count("records", len(request.data))
+
+    accept = http_request.headers.get("accept", "") if http_request is not None else ""
+    if stream or NDJSON_MEDIA_TYPE in accept:
+        return StreamingResponse(stream_bulk_predictions(request), media_type=NDJSON_MEDIA_TYPE)
+
     processed_data = []
-    success_count = 0
-    error_count = 0
     errors = []
-    
-    for idx, record in enumerate(request.data):
-        try:
-            # Create a copy of the original record
-            processed_record = record.copy()
-            
-            # Look for the description column (case-insensitive search)
-            description_text = None
-            description_key = None
-            
-            # First, try exact match
-            if request.description_column in record:
-                description_text = record[request.description_column]
-                description_key = request.description_column
-            else:
-                # Try case-insensitive search
-                for key in record.keys():
-                    if key.lower() == request.description_column.lower():
-                        description_text = record[key]
-                        description_key = key
-                        break
-                
-                # If still not found, try common variations
-                if description_text is None:
-                    common_variations = [
-                        'description', 'Description', 'DESCRIPTION',
-                        'transaction description', 'Transaction Description', 'TRANSACTION DESCRIPTION',
-                        'transaction_description', 'Transaction_Description',
-                        'desc', 'Desc', 'DESC'
-                    ]
-                    
-                    for variation in common_variations:
-                        if variation in record:
-                            description_text = record[variation]
-                            description_key = variation
-                            break
-            
-            if description_text is None:
-                error_count += 1
-                errors.append({
-                    "index": idx,
-                    "error": f"Description column '{request.description_column}' not found in record. Available columns: {list(record.keys())}"
-                })
-                # Add the record anyway but with empty category
-                processed_record['category_mapped'] = None
-                processed_data.append(processed_record)
-                continue
-            
-            # Validate description is not empty
-            if not str(description_text).strip():
-                error_count += 1
-                errors.append({
-                    "index": idx,
-                    "error": "Description is empty or whitespace"
-                })
-                processed_record['category_mapped'] = None
-                processed_data.append(processed_record)
-                continue
-            
-            # Make prediction
-            description_to_predict = [str(description_text)]
-            prediction = model.predict(description_to_predict)
-            predicted_category = prediction[0]
-            
-            # Add the predicted category to the record
-            processed_record['category_mapped'] = predicted_category
-            processed_data.append(processed_record)
-            success_count += 1
-            
-        except Exception as e:
-            error_count += 1
-            errors.append({
-                "index": idx,
-                "error": f"Prediction failed: {str(e)}"
-            })
-            # Add the record anyway but with empty category
-            processed_record = record.copy()
-            processed_record['category_mapped'] = None
-            processed_data.append(processed_record)
-    
-    return BulkPredictionResponse(
-        data=processed_data,
-        processed_count=len(request.data),
-        success_count=success_count,
-        error_count=error_count,
-        errors=errors
+    for batch_data, batch_errors in predict_bulk_batches(request):
+        processed_data.extend(batch_data)
+        errors.extend(batch_errors)
+    error_count = len(errors)
+    success_count = len(request.data) - error_count
+    checkpoint("predict")
+
+    # The records are already built, so they are encoded directly instead of
+    # being revalidated against BulkPredictionResponse (which documents the shape)
+    return FastJSONResponse({
+        "data": processed_data,
+        "processed_count": len(request.data),
+        "success_count": success_count,
+        "error_count": error_count,
+        "errors": errors
+    })
+
+
+# --- Application ---
+def create_app(title="Tax Category Classifier API",
+               description="An API to predict the category based on its description.",
+               version="1.0.0"):
+    """A FastAPI app with the prediction endpoints, their middleware and the model lifespan."""
+    application = FastAPI(title=title, description=description, version=version, lifespan=lifespan)
+    # Add CORS middleware to allow requests from the HTML file
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allows all origins
+        allow_credentials=True,
+        allow_methods=["*"],  # Allows all methods
+        allow_headers=["*"],  # Allows all headers
+        expose_headers=["X-Model-Version", "Server-Timing", "X-Unique-Descriptions"]
     )
+    application.middleware("http")(add_server_timing)
+    application.middleware("http")(add_model_version)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
 
 
 # --- Server Startup ---
@@ -348,4 +542,5 @@ if __name__ == "__main__":
         port=8000,
         reload=True,  # Auto-reload on code changes
         log_level="info"
-    )
\ No newline at end of file
+    )
+
@@ -0,0 +1,126 @@
+# ----------------------
+# Micro-Batching
+# ----------------------
+# Collects concurrent single-description /predict calls into one vectorized
+# predict() so each request does not pay the full pipeline overhead.
+import asyncio
+import time
+from instrumentation import Histogram
+
+# Upper bounds of the histogram buckets exposed by MicroBatcher.stats()
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+QUEUE_WAIT_BUCKETS_MS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+class MicroBatcher:
+    """
+    Queues single predictions and runs them as one predict_fn(texts) call once
+    max_batch_size items are waiting or the oldest has waited max_wait_ms.
+    predict_fn runs in an executor so the event loop stays free; each caller
+    gets its own result through a future. If a batch fails, its texts are
+    predicted one at a time, so only the callers whose text fails get the error.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0, executor=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_waits_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self.failed_batches = 0
+        self.failed_items = 0
+        self._queue = None
+        self._worker = None
+        self._loop = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            # (Re)start on the current event loop, e.g. after a server restart
+            self._queue = asyncio.Queue()
+            self._loop = loop
+            self._worker = loop.create_task(self._run())
+
+    async def start(self):
+        self._ensure_worker()
+
+    async def stop(self):
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, text):
+        """Queue one text and wait for its prediction."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            started = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                self.queue_waits_ms.observe((started - enqueued_at) * 1000)
+            self.batch_sizes.observe(len(batch))
+            texts = [text for text, _, _ in batch]
+            try:
+                predictions = await loop.run_in_executor(self.executor, self.predict_fn, texts)
+            except Exception:
+                self.failed_batches += 1
+                await self._run_one_by_one(batch)
+                continue
+            self._resolve(batch, predictions)
+
+    async def _run_one_by_one(self, batch):
+        loop = asyncio.get_running_loop()
+        for item in batch:
+            try:
+                predictions = await loop.run_in_executor(self.executor, self.predict_fn, [item[0]])
+            except Exception as e:
+                self.failed_items += 1
+                if not item[1].done():
+                    item[1].set_exception(e)
+                continue
+            self._resolve([item], predictions)
+
+    def _resolve(self, batch, predictions):
+        predictions = list(predictions)
+        for (_, future, _), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(prediction)
+        # Callers beyond the returned predictions must not wait forever
+        for _, future, _ in batch[len(predictions):]:
+            if not future.done():
+                future.set_exception(RuntimeError(f'predict returned {len(predictions)} results for {len(batch)} texts'))
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'failed_batches': self.failed_batches,
+            'failed_items': self.failed_items,
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_waits_ms.snapshot()
+        }
@@ -0,0 +1,266 @@
+# ----------------------
+# Model Registry
+# ----------------------
+# Serves the newest versioned model artifact in saved_model and swaps in new ones
+# without a restart. Artifacts are named
+#   ultra_high_accuracy_classifier-<version>.joblib / .mmap.joblib / .slim
+# A background thread polls the directory. A new artifact is loaded and warmed
+# with a sample batch off the request path, and only then replaces the serving
+# model in a single reference assignment. Requests that already hold the old
+# model finish with it. Without versioned artifacts the unversioned model from
+# model_store is served, as before.
+import os
+import re
+import threading
+import time
+from model_store import MODEL_DIR, MODEL_MMAP, MODEL_SLIM, active_model_path, load_artifact, prepare_model
+from prediction_cache import model_file_version
+
+MODEL_NAME = 'ultra_high_accuracy_classifier'
+VERSIONED_ARTIFACT = re.compile(rf'^{MODEL_NAME}-(?P<version>[A-Za-z0-9_.]+?)(?P<suffix>\.slim|\.mmap\.joblib|\.joblib)$')
+# Preferred artifact kind when one version is present in several forms
+SUFFIX_PREFERENCE = ['.slim', '.mmap.joblib', '.joblib']
+
+# Seconds between checks for a new artifact (0 disables the watcher)
+MODEL_POLL_INTERVAL = float(os.environ.get('MODEL_POLL_INTERVAL', '10'))
+# Artifacts modified more recently than this are assumed to still be copying
+MODEL_SETTLE_SECONDS = float(os.environ.get('MODEL_SETTLE_SECONDS', '2'))
+# Optional file with one warmup description per line
+MODEL_WARMUP_FILE = os.environ.get('MODEL_WARMUP_FILE')
+
+WARMUP_TEXTS = [
+    'DIRECT DEBIT HMRC VAT',
+    'CARD PAYMENT TO AMAZON MKTPLACE',
+    'TESCO STORES 2341',
+    'TRAINLINE.COM LONDON',
+    'BANK CHARGES',
+    'SALARY PAYMENT',
+    'BT GROUP PLC',
+    'INTEREST PAID',
+]
+
+
+class ModelVersion:
+    """A loaded model together with the version and artifact it came from."""
+
+    def __init__(self, model, version, path, warmup_ms=0.0):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.warmup_ms = warmup_ms
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'model_type': type(self.model).__name__,
+            'loaded_at': self.loaded_at,
+            'warmup_ms': round(self.warmup_ms, 3)
+        }
+
+
+def artifact_mtime(path):
+    """Modification time of an artifact; meta.json marks a complete slim directory."""
+    return os.path.getmtime(os.path.join(path, 'meta.json') if os.path.isdir(path) else path)
+
+
+def find_latest_artifact(model_dir=MODEL_DIR, settle_seconds=MODEL_SETTLE_SECONDS):
+    """
+    (version, path) of the most recently written versioned artifact, or of the
+    unversioned model if there are none. Returns None if there is no model at all.
+    """
+    candidates = {}
+    now = time.time()
+    try:
+        names = os.listdir(model_dir)
+    except OSError:
+        names = []
+    for name in names:
+        match = VERSIONED_ARTIFACT.match(name)
+        if not match:
+            continue
+        path = os.path.join(model_dir, name)
+        try:
+            mtime = artifact_mtime(path)
+        except OSError:
+            continue
+        if now - mtime < settle_seconds:
+            continue
+        candidates.setdefault(match.group('version'), []).append(
+            (SUFFIX_PREFERENCE.index(match.group('suffix')), mtime, path))
+    if candidates:
+        # Newest version by its newest artifact, then its preferred artifact kind
+        version = max(candidates, key=lambda version: max(mtime for _, mtime, _ in candidates[version]))
+        return version, min(candidates[version])[2]
+    if os.path.abspath(model_dir) == os.path.abspath(MODEL_DIR):
+        path = active_model_path()
+    else:
+        base = os.path.join(model_dir, MODEL_NAME)
+        path = active_model_path(f'{base}.joblib', f'{base}.mmap.joblib', MODEL_MMAP, f'{base}.slim', MODEL_SLIM)
+    if not os.path.exists(path):
+        return None
+    return model_file_version(path), path
+
+
+def load_warmup_texts():
+    if MODEL_WARMUP_FILE and os.path.exists(MODEL_WARMUP_FILE):
+        with open(MODEL_WARMUP_FILE, encoding='utf-8') as handle:
+            texts = [line.strip() for line in handle if line.strip()]
+        if texts:
+            return texts
+    return list(WARMUP_TEXTS)
+
+
+class ModelRegistry:
+    """
+    Holds the serving ModelVersion and replaces it when a newer artifact appears.
+    Listeners are called with each new ModelVersion after it has been warmed up.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, poll_interval=MODEL_POLL_INTERVAL,
+                 settle_seconds=MODEL_SETTLE_SECONDS, warmup_texts=None, loader=None):
+        self.model_dir = model_dir
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.warmup_texts = warmup_texts if warmup_texts is not None else load_warmup_texts()
+        self.loader = loader or (lambda path: prepare_model(load_artifact(path)))
+        self.current = None
+        self.previous = None
+        self.swaps = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+        self._failed = None
+        self._listeners = []
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def model(self):
+        current = self.current
+        return current.model if current is not None else None
+
+    @property
+    def version(self):
+        current = self.current
+        return current.version if current is not None else None
+
+    def version_of(self, model):
+        """Version of a model served now or just before the last swap, else None."""
+        for entry in (self.current, self.previous):
+            if entry is not None and entry.model is model:
+                return entry.version
+        return None
+
+    def add_listener(self, listener):
+        """
+        Call listener(ModelVersion) on every swap, and now if a model is already
+        serving. Adding a listener again (e.g. on every app startup) does not
+        register it twice.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+        if self.current is not None:
+            listener(self.current)
+
+    def warm(self, model):
+        """Run the warmup texts as one batch and one at a time. Returns the time taken in ms."""
+        started = time.perf_counter()
+        if self.warmup_texts:
+            model.predict(self.warmup_texts)
+            for text in self.warmup_texts:
+                model.predict([text])
+        return (time.perf_counter() - started) * 1000
+
+    def install(self, entry):
+        """Make entry the serving model and notify the listeners."""
+        self.previous, self.current = self.current, entry
+        self.swaps += 1
+        for listener in self._listeners:
+            listener(entry)
+
+    def check(self):
+        """
+        Load, warm and swap in the latest artifact if it is not the one serving.
+        Returns True if the serving model changed. Load failures are reported and
+        the current model keeps serving.
+        """
+        with self._check_lock:
+            self.last_check = time.time()
+            latest = find_latest_artifact(self.model_dir, self.settle_seconds)
+            if latest is None:
+                if self.current is None and self._failed != 'missing':
+                    self._failed = 'missing'
+                    print(f"Error loading model: no model artifact found in {self.model_dir}")
+                return False
+            version, path = latest
+            if self.current is not None and (self.current.version, self.current.path) == (version, path):
+                return False
+            attempt = (version, path, artifact_mtime(path))
+            if attempt == self._failed:
+                return False
+            try:
+                started = time.perf_counter()
+                model = self.loader(path)
+                load_ms = (time.perf_counter() - started) * 1000
+                warmup_ms = self.warm(model)
+            except Exception as e:
+                self._failed = attempt
+                self.failures += 1
+                self.last_error = f"{version}: {e}"
+                print(f"Error loading model {version} from {path}: {e}")
+                return False
+            self._failed = None
+            previous = self.version
+            self.install(ModelVersion(model, version, path, warmup_ms))
+            print(f"Serving model {version} (was {previous}); loaded in {load_ms:.0f}ms, warmed in {warmup_ms:.0f}ms")
+            return True
+
+    def start(self):
+        """Start the background watcher (idempotent; a no-op if polling is disabled)."""
+        if self.poll_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Model watcher error: {e}")
+
+    def stats(self):
+        current = self.current
+        return {
+            'serving': current.describe() if current is not None else None,
+            'previous_version': self.previous.version if self.previous is not None else None,
+            'swaps': self.swaps,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_check': self.last_check,
+            'poll_interval': self.poll_interval,
+            'watching': self._thread is not None and self._thread.is_alive()
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide registry. Created in the serve.py parent, it is inherited by the workers."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,88 @@
+# ----------------------
+# Model Store
+# ----------------------
+# One place to load the classifier artifacts; model_registry.py decides which
+# model is serving and swaps in new ones. When an uncompressed copy of
+# the artifact exists, its numpy arrays are memory-mapped instead of read into
+# private memory, so every worker maps the same page-cache pages. serve.py loads
+# it in the parent before forking, and the workers inherit it copy-on-write.
+import os
+import joblib
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(os.path.dirname(__file__), "saved_model"))
+MODEL_PATH = os.path.join(MODEL_DIR, "ultra_high_accuracy_classifier.joblib")
+# Uncompressed copy of MODEL_PATH that can be memory-mapped (see export_mmap_artifact)
+MMAP_MODEL_PATH = os.environ.get('MODEL_MMAP_PATH', os.path.join(MODEL_DIR, "ultra_high_accuracy_classifier.mmap.joblib"))
+# Slim artifact directory written by slim_model.py, preferred when present (MODEL_SLIM=0 ignores it)
+SLIM_MODEL_PATH = os.environ.get('MODEL_SLIM_PATH', os.path.join(MODEL_DIR, "ultra_high_accuracy_classifier.slim"))
+MODEL_SLIM = os.environ.get('MODEL_SLIM', '1').lower() not in ('0', 'false', 'no')
+# Set MODEL_MMAP=0 to always read the model into process memory
+MODEL_MMAP = os.environ.get('MODEL_MMAP', '1').lower() not in ('0', 'false', 'no')
+# Set FAST_MODEL=0 to serve predictions from the sklearn pipeline instead of fast_model
+FAST_MODEL = os.environ.get('FAST_MODEL', '1').lower() not in ('0', 'false', 'no')
+
+def load_model(model_path=MODEL_PATH, mmap_path=MMAP_MODEL_PATH, mmap=MODEL_MMAP,
+               slim_path=SLIM_MODEL_PATH, slim=MODEL_SLIM):
+    """
+    Load the classifier from the first usable artifact: the slim artifact at
+    slim_path, the uncompressed copy at mmap_path (memory-mapped), or a plain
+    joblib.load of model_path. Derived artifacts are only used while they are at
+    least as new as model_path. Raises if the model cannot be loaded.
+    """
+    return load_artifact(active_model_path(model_path, mmap_path, mmap, slim_path, slim), mmap)
+
+
+def load_artifact(path, mmap=MODEL_MMAP):
+    """
+    Load one model artifact: a slim artifact directory, an uncompressed
+    .mmap.joblib copy (memory-mapped) or a joblib file.
+    """
+    if os.path.isdir(path):
+        from slim_model import SlimTextClassifier
+        return SlimTextClassifier(path, mmap=mmap)
+    if mmap and os.fspath(path).endswith('.mmap.joblib'):
+        return joblib.load(path, mmap_mode='r')
+    return joblib.load(path)
+
+
+def prepare_model(model):
+    """Compile a loaded model for the fast path unless FAST_MODEL=0."""
+    if FAST_MODEL:
+        from fast_model import compile_model
+        return compile_model(model)
+    return model
+
+
+def active_model_path(model_path=MODEL_PATH, mmap_path=MMAP_MODEL_PATH, mmap=MODEL_MMAP,
+                      slim_path=SLIM_MODEL_PATH, slim=MODEL_SLIM):
+    """The artifact load_model() reads: slim_path, mmap_path or model_path."""
+    if slim and _is_current(os.path.join(slim_path, 'meta.json'), model_path):
+        return slim_path
+    if mmap and _is_current(mmap_path, model_path):
+        return mmap_path
+    return model_path
+
+
+def _is_current(mmap_path, model_path):
+    if not os.path.exists(mmap_path):
+        return False
+    if not os.path.exists(model_path):
+        return True
+    return os.path.getmtime(mmap_path) >= os.path.getmtime(model_path)
+
+
+def export_mmap_artifact(model_path=MODEL_PATH, mmap_path=MMAP_MODEL_PATH):
+    """
+    Write an uncompressed copy of the model that joblib can memory-map.
+    The file is written next to its destination and renamed into place, so
+    running workers never see a partial artifact.
+    """
+    model = joblib.load(model_path)
+    temp_path = f"{mmap_path}.tmp"
+    joblib.dump(model, temp_path, compress=0)
+    os.replace(temp_path, mmap_path)
+    return mmap_path
+
+
+if __name__ == "__main__":
+    print(f"Wrote {export_mmap_artifact()}")
@@ -0,0 +1,291 @@
+# ----------------------
+# Prediction Cache
+# ----------------------
+# Shared by app.py and main.py so repeated transaction descriptions are only
+# sent to the classifier once per model version.
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import observe, stage
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional TTL (in seconds).
+    With max_bytes, it is also bounded by the total of sizeof(value) over its
+    entries; a value larger than max_bytes on its own is not cached.
+    Keeps hit, miss and eviction counters for the stats endpoints.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, max_bytes=None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.bytes -= size
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self._entries) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+        if self.max_bytes is not None:
+            stats.update({'bytes': self.bytes, 'max_bytes': self.max_bytes})
+        return stats
+
+
+def normalize_description(text):
+    """Collapse whitespace so trivially different descriptions share a cache entry."""
+    return ' '.join(str(text).split())
+
+
+def model_file_version(model_path):
+    """Version string for the model artifact, changes whenever the file is replaced."""
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class PredictionCache:
+    """
+    Caches model predictions keyed by model version and normalized description.
+    The in-memory LRU can be backed by a sqlite file so entries survive restarts.
+    When a new model starts serving, older entries are dropped. Requests still
+    running on a model that has been replaced keep their own entries and never
+    invalidate the new model's. The version comes from version_fn(model) when
+    given (e.g. the model registry), else from the model file.
+    """
+
+    def __init__(self, model_path, max_size=100000, ttl=None, db_path=None, version_fn=None):
+        self.model_path = model_path
+        self.version_fn = version_fn
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.ttl = ttl
+        self.db_path = db_path
+        self.disk_hits = 0
+        self.invalidations = 0
+        self._version = None
+        self._model_id = None
+        self._retired = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'model_version TEXT NOT NULL, description TEXT NOT NULL, '
+                'category TEXT, created_at REAL NOT NULL, '
+                'PRIMARY KEY (model_version, description))'
+            )
+            self._db.commit()
+
+    def _current_version(self, model):
+        """
+        Return (version, generation, serving) for model. generation tells models
+        apart that share a version; serving is False for a model that has been
+        replaced. A model not seen before replaces the current one and drops the
+        entries cached for older models.
+        """
+        version = self.version_fn(model) if self.version_fn is not None else None
+        if version is None:
+            version = model_file_version(self.model_path)
+        generation = (version, id(model))
+        with self._lock:
+            if generation == (self._version, self._model_id):
+                return version, generation, True
+            if generation in self._retired:
+                return version, generation, False
+            if self._model_id is not None:
+                self.invalidations += 1
+                self._retired[(self._version, self._model_id)] = None
+                while len(self._retired) > RETIRED_MODELS:
+                    self._retired.popitem(last=False)
+            self.memory.clear()
+            self._version = version
+            self._model_id = id(model)
+            if self._db is not None:
+                self._db.execute('DELETE FROM predictions WHERE model_version != ?', (str(version),))
+                self._db.commit()
+        return version, generation, True
+
+    def _load_from_disk(self, version, descriptions):
+        if self._db is None or not descriptions:
+            return {}
+        found = {}
+        oldest = time.time() - self.ttl if self.ttl else None
+        rows = []
+        with self._lock:
+            for start in range(0, len(descriptions), DISK_LOOKUP_CHUNK):
+                chunk = descriptions[start:start + DISK_LOOKUP_CHUNK]
+                rows.extend(self._db.execute(
+                    'SELECT description, category, created_at FROM predictions '
+                    f'WHERE model_version = ? AND description IN ({", ".join("?" * len(chunk))})',
+                    (str(version), *chunk)
+                ).fetchall())
+        for description, category, created_at in rows:
+            if oldest is None or created_at >= oldest:
+                found[description] = category
+        return found
+
+    def _save_to_disk(self, version, predictions):
+        if self._db is None or not predictions:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO predictions (model_version, description, category, created_at) VALUES (?, ?, ?, ?)',
+                [(str(version), description, str(category), now) for description, category in predictions.items()]
+            )
+            self._db.commit()
+
+    def predict(self, model, texts):
+        """
+        Return one prediction per text, only calling model.predict for descriptions
+        that are not cached. Model errors are raised to the caller.
+        """
+        version, generation, serving = self._current_version(model)
+        keys = [normalize_description(text) for text in texts]
+        # The model sees the text as given; normalizing only decides what is shared
+        originals = {}
+        for key, text in zip(keys, texts):
+            originals.setdefault(key, text)
+        results = {}
+        missing = []
+        for key in originals:
+            cached = self.memory.get((generation, key), _MISSING)
+            if cached is _MISSING:
+                missing.append(key)
+            else:
+                results[key] = cached
+        if missing and serving:
+            from_disk = self._load_from_disk(version, missing)
+            self.disk_hits += len(from_disk)
+            for key, category in from_disk.items():
+                self.memory.set((generation, key), category)
+            results.update(from_disk)
+            missing = [key for key in missing if key not in from_disk]
+        if missing:
+            with stage('model_predict'):
+                predicted = dict(zip(missing, model.predict([originals[key] for key in missing])))
+            observe('model_batch_size', len(missing))
+            for key, category in predicted.items():
+                self.memory.set((generation, key), category)
+            if serving:
+                self._save_to_disk(version, predicted)
+            results.update(predicted)
+        return [results[key] for key in keys]
+
+    def clear(self):
+        self.memory.clear()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute('DELETE FROM predictions')
+                self._db.commit()
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats.update({
+            'disk_hits': self.disk_hits,
+            'disk_store': self.db_path,
+            'invalidations': self.invalidations,
+            'model_version': self._version
+        })
+        return stats
+
+
+_MISSING = object()
+
+# Replaced models remembered, so their late requests are recognised as stale
+RETIRED_MODELS = 8
+# Descriptions per sqlite lookup, below sqlite's limit on query parameters
+DISK_LOOKUP_CHUNK = 500
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_prediction_cache(model_path, version_fn=None):
+    """
+    The process-wide prediction cache, created on first use with
+    create_prediction_cache. app.py and main.py both use it, so when they are
+    served together by service.py they share one cache.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = create_prediction_cache(model_path, version_fn)
+        return _shared_cache
+
+
+def create_prediction_cache(model_path, version_fn=None):
+    """
+    Build the prediction cache from environment settings:
+    PREDICTION_CACHE_SIZE (0 disables the in-memory cache), PREDICTION_CACHE_TTL
+    in seconds and PREDICTION_CACHE_DB, a sqlite file for the on-disk store.
+    """
+    ttl = os.environ.get('PREDICTION_CACHE_TTL')
+    return PredictionCache(
+        model_path,
+        max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', '100000')),
+        ttl=float(ttl) if ttl else None,
+        db_path=os.environ.get('PREDICTION_CACHE_DB') or None,
+        version_fn=version_fn
+    )
@@ -0,0 +1,142 @@
+# ----------------------
+# Production Server
+# ----------------------
+# Pre-forking server for app.py (Flask), main.py (FastAPI) or service.py (both in one app).
+# The parent loads the model and the heavy libraries once, freezes the heap and
+# forks the workers, which inherit all of it copy-on-write and share one
+# listening socket. Workers start in milliseconds and only pay for the memory
+# they write to. Dead workers are replaced; SIGTERM/SIGINT stop them all.
+#
+#   python serve.py --app fastapi --workers 4
+#   python serve.py --app service --workers 4
+#   SERVE_APP=flask SERVE_WORKERS=8 python serve.py
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+DEFAULT_PORTS = {'flask': 5000, 'fastapi': 8000, 'service': 8000}
+ASGI_APPS = {'fastapi': 'main:app', 'service': 'service:app'}
+
+
+def preload():
+    """
+    Load the model and import the heavy libraries in the parent. The apps
+    themselves are imported after the fork, so connections and threads they
+    create at import time (e.g. the sqlite prediction cache) stay per worker.
+    """
+    from model_registry import get_registry
+    # Workers inherit the registry with this model already serving, so their own
+    # startup check finds nothing new to load
+    get_registry().check()
+    import sheet_processing  # noqa: F401 (pandas, openpyxl, rapidfuzz)
+    import sklearn  # noqa: F401
+    # Move everything loaded so far out of the GC's reach, so collections in the
+    # workers do not touch (and un-share) the inherited pages
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app_name, host, port, sock):
+    """Serve the app on the inherited listening socket until stopped."""
+    if app_name == 'flask':
+        from werkzeug.serving import make_server
+        from app import app
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        import uvicorn
+        config = uvicorn.Config(ASGI_APPS[app_name], log_level='info')
+        uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(app_name, host, port, sock):
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    status = 0
+    try:
+        run_worker(app_name, host, port, sock)
+    except Exception as e:
+        print(f"Worker {os.getpid()} failed: {e}")
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(app_name='fastapi', host='0.0.0.0', port=None, workers=1, preload_model=True):
+    """
+    Bind the socket, optionally preload, and keep `workers` forked workers running.
+    Falls back to a single in-process worker where fork is not available.
+    """
+    port = port or DEFAULT_PORTS[app_name]
+    if preload_model:
+        preload()
+    sock = bind_socket(host, port)
+    print(f"Serving {app_name} on {host}:{port} with {workers} worker(s), preload={'on' if preload_model else 'off'}")
+    if not hasattr(os, 'fork'):
+        run_worker(app_name, host, port, sock)
+        return
+    children = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        children.add(spawn_worker(app_name, host, port, sock))
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            children.add(spawn_worker(app_name, host, port, sock))
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-forking server for the Flask app, the FastAPI app or the unified service.")
+    parser.add_argument('--app', choices=sorted(DEFAULT_PORTS), default=os.environ.get('SERVE_APP', 'fastapi'))
+    parser.add_argument('--host', default=os.environ.get('SERVE_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVE_PORT', '0')) or None)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', str(os.cpu_count() or 1))))
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        default=os.environ.get('SERVE_PRELOAD', '1').lower() not in ('0', 'false', 'no'),
+                        help="Load the model in each worker instead of once in the parent")
+    args = parser.parse_args(argv)
+    serve(args.app, args.host, args.port, max(args.workers, 1), args.preload)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
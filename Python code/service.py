@@ -0,0 +1,30 @@
+# ----------------------
+# Unified Service
+# ----------------------
+# One ASGI application serving both APIs from a single process set:
+#   /predict, /predict_bulk, /web, /docs ...      FastAPI routes from main.py
+#   /getData, /getSheetData, /getMappedCategory   Flask routes from app.py, unchanged
+# Both apps already take their model from the process-wide model registry and
+# predict through the shared prediction cache, so serving them together holds
+# one model copy per process instead of one per app. The Flask app is mounted
+# behind the FastAPI routes; anything FastAPI does not route goes to Flask.
+#
+#   python serve.py --app service --workers 4
+#   uvicorn service:app --port 8000
+from a2wsgi import WSGIMiddleware
+import app as flask_app
+import main
+
+# The FastAPI routes and middleware (CORS, model version, Server-Timing) of main.py
+# apply to every request, including the ones passed on to Flask
+app = main.create_app(
+    title="Tax Mapping Service",
+    description="Sheet mapping (Flask-compatible routes) and category prediction in one service.",
+    version=main.app.version
+)
+app.mount("/", WSGIMiddleware(flask_app.app))
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("service:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,555 @@
+# ----------------------
+# Sheet Processing
+# ----------------------
+# Fuzzy column mapping and workbook processing used by app.py. Kept free of the Flask
+# app and the model so sheets can be processed in worker processes.
+import atexit
+import os
+import re
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import openpyxl
+import pandas as pd
+from rapidfuzz import process, fuzz
+from const.field_keywords import FIELD_KEYWORDS
+from date_engine import merge_date_summaries, parse_quarter_range, summarize_dates
+from header_templates import shared_template_store
+from instrumentation import count, stage
+from workbook_formats import XLSX, detect_workbook_format, open_workbook
+
+# Number of mapped rows per chunk when streaming a workbook
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', '5000'))
+
+# Worker processes used to process the sheets of a workbook in parallel (1 = sequential)
+SHEET_WORKERS = int(os.environ.get('SHEET_WORKERS', '1'))
+
+class KeywordIndex:
+    """
+    Field keywords compiled for fast column matching.
+    Keywords are preprocessed the same way as column names and deduplicated
+    (a keyword listed under two fields keeps the first one, as first-wins scoring
+    would). All columns are scored against all keywords in one cdist call and
+    results are memoized per column name.
+    """
+
+    def __init__(self, field_keywords, threshold=70, memo_size=10000):
+        self.threshold = threshold
+        self.memo_size = memo_size
+        self.keywords = []
+        self.fields = []
+        for field, keywords in field_keywords.items():
+            for keyword in keywords:
+                processed = preprocess_col_name(keyword)
+                if processed not in self.keywords:
+                    self.keywords.append(processed)
+                    self.fields.append(field)
+        self._memo = {}
+
+    def match(self, col_names):
+        """
+        Return the best matching field (or None) for each column name.
+        """
+        resolved = {}
+        unseen = {}
+        for col_name in col_names:
+            field = self._memo.get(col_name, _UNMATCHED)
+            if field is _UNMATCHED:
+                unseen.setdefault(preprocess_col_name(col_name), []).append(col_name)
+            else:
+                resolved[col_name] = field
+        if unseen:
+            if len(self._memo) + len(unseen) > self.memo_size:
+                self._memo.clear()
+            processed_names = list(unseen)
+            scores = process.cdist(processed_names, self.keywords, scorer=fuzz.token_set_ratio, dtype=np.float64)
+            # argmax picks the first keyword with the top score, like the original loop
+            best = scores.argmax(axis=1)
+            for processed_name, row, keyword_idx in zip(processed_names, scores, best):
+                # Set a threshold to avoid false matches
+                field = self.fields[keyword_idx] if row[keyword_idx] >= self.threshold else None
+                for col_name in unseen[processed_name]:
+                    resolved[col_name] = field
+                    self._memo[col_name] = field
+        return [resolved[col_name] for col_name in col_names]
+
+
+_UNMATCHED = object()
+
+
+def best_column_match(col_name, field_keywords):
+    """
+    Fuzzy match a column name to the best field using rapidfuzz.
+    Returns the field name if a good match is found, else None.
+    """
+    if field_keywords is FIELD_KEYWORDS:
+        keyword_index = KEYWORD_INDEX
+    else:
+        keyword_index = KeywordIndex(field_keywords)
+    return keyword_index.match([col_name])[0]
+
+
+MAPPED_FIELDS = ['Amount', 'Date', 'Description', 'DisallowableExpenses']
+
+
+def map_columns(df, lazy=False, client_id=None):
+    """
+    Map DataFrame columns to Amount, Date, Description using fuzzy matching.
+    Returns mapped data and the mapping used.
+    With lazy=True the mapped data is a generator of rows instead of a list.
+    With a client_id the client's header template is used for a known layout.
+    """
+    mapping = resolve_column_mapping(df.columns, client_id)
+    mapped_data = iter_mapped_rows(df, mapping)
+    if not lazy:
+        mapped_data = list(mapped_data)
+    return mapped_data, mapping
+
+
+def resolve_column_mapping(columns, client_id=None):
+    """
+    Column mapping for a header row. With a client_id, a layout the client has
+    sent before is answered from its header template (see header_templates.py);
+    new layouts, and calls without a client_id, are fuzzy matched.
+    """
+    if client_id:
+        return shared_template_store().lookup(client_id, columns, match_column_mapping)
+    return match_column_mapping(columns)
+
+
+def match_column_mapping(columns):
+    """
+    Assign each field to the first column that fuzzy matches it.
+    Columns that match nothing, or a field that is already taken, go to 'Other'.
+    """
+    mapping = {field: None for field in FIELD_KEYWORDS}
+    mapping['Other'] = []
+    for col, field in zip(columns, KEYWORD_INDEX.match(columns)):
+        # TODO : Use open api call for non matched fields
+        if field and not mapping[field]:
+            mapping[field] = col
+        else:
+            mapping['Other'].append(col)
+    return mapping
+
+
+def mapped_frame(df, mapping):
+    """
+    The mapped fields of df as a DataFrame, one column per field in MAPPED_FIELDS,
+    keeping each source column's own dtype. Unmapped fields are all-null columns.
+    """
+    columns = {}
+    for field in MAPPED_FIELDS:
+        col = mapping.get(field)
+        columns[field] = df[col].reset_index(drop=True) if col is not None else pd.Series([None] * len(df), dtype=object)
+    return pd.DataFrame(columns)
+
+
+def mapped_column_values(df, col):
+    """
+    Extract one mapped column as a list of Python values (None if unmapped).
+    Values are first cast to the dtype shared by the whole frame, which is what
+    iterrows() did to every row, so the serialized output stays the same.
+    """
+    if col is None:
+        return [None] * len(df)
+    row_dtype = df.iloc[:0].to_numpy().dtype
+    return df[col].astype(row_dtype).tolist()
+
+
+def iter_mapped_rows(df, mapping):
+    """
+    Yield one dict per row with the mapped fields, built column-wise.
+    """
+    columns = [mapped_column_values(df, mapping.get(field)) for field in MAPPED_FIELDS]
+    for values in zip(*columns):
+        yield dict(zip(MAPPED_FIELDS, values))
+
+
+def drop_blank_rows(df):
+    """
+    Drop rows that are all null, or whose cells are all blank strings.
+    Only text columns are checked for blank strings, without copying the frame as text.
+    """
+    df_clean = df.dropna(how='all')
+    blank = pd.Series(True, index=df_clean.index)
+    for col in range(df_clean.shape[1]):
+        values = df_clean.iloc[:, col]
+        if not (pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype)):
+            # Numbers, dates and nulls never strip down to an empty string
+            return df_clean
+        try:
+            blank &= values.str.strip().eq('').fillna(False).astype(bool)
+        except AttributeError:
+            # Object column without any strings
+            return df_clean
+        if not blank.any():
+            return df_clean
+    return df_clean.loc[~blank]
+
+
+def categorize_excel_sheets_fuzzy(file, quarter_date_range=None, workers=None, sheet_names=None, progress=None,
+                                  client_id=None, columnar=False, filename=None):
+    """
+    Process all sheets in the given Excel file, mapping columns for each sheet.
+    Returns a list of dicts with sheet_name, column_mapping, mapped_data, columns, and selected for each sheet.
+    Skips sheets that are empty, all null, or have only header and no data.
+    The 'selected' flag is True if any row in mapped_data has a Date in the specified quarter range,
+    and 'min_date'/'max_date' give the earliest and latest dates found on the sheet.
+    With more than one worker (SHEET_WORKERS by default) the sheets are processed in a
+    shared process pool; results keep the original sheet order.
+    sheet_names limits processing to those sheets (all sheets by default).
+    progress, if given, is called as progress(sheets_done, sheets_total, sheet_name)
+    before each sheet and once more with sheet_name None when all are done.
+    client_id, if given, lets columns be mapped from the client's header templates.
+    With columnar=True each sheet has a 'mapped_frame' DataFrame of the mapped
+    columns instead of the 'mapped_data' rows (see columnar_format.py).
+    .xls, .ods and .csv files are read too (see workbook_formats.py); filename
+    gives the extension when the content does not identify the format.
+    """
+    print("Categorizing Excel sheets using fuzzy matching...")
+    if not file:
+        return {'error': 'No file provided'}, 400
+    # Use provided quarter_date_range or fallback to default
+    QUARTER_DATE_RANGE = quarter_date_range or '6/4/2025-5/7/2025'
+    start_date, end_date = parse_quarter_range(QUARTER_DATE_RANGE)
+    workers = SHEET_WORKERS if workers is None else workers
+    if workers > 1:
+        with spooled_workbook_path(file) as path:
+            with stage('excel_parse'):
+                xl = open_workbook(path, filename)
+            names = xl.sheet_names if sheet_names is None else sheet_names
+            if len(names) > 1:
+                if progress is not None:
+                    progress(0, len(names), None)
+                with stage('sheet_pool'):
+                    results = process_sheets_in_pool(path, names, QUARTER_DATE_RANGE, workers, client_id, columnar)
+                if results is not None:
+                    if progress is not None:
+                        progress(len(names), len(names), None)
+                    return {'sheet_data': [sheet for sheet in results if sheet is not None]}
+            return {'sheet_data': process_workbook_sheets(xl, start_date, end_date, names, progress, client_id,
+                                                           columnar)}
+    with stage('excel_parse'):
+        xl = open_workbook(file, filename)
+    return {'sheet_data': process_workbook_sheets(xl, start_date, end_date, sheet_names, progress, client_id,
+                                                       columnar)}
+
+
+def process_workbook_sheets(xl, start_date, end_date, sheet_names=None, progress=None, client_id=None,
+                            columnar=False):
+    """
+    Process the sheets of an open ExcelFile one after another, skipping empty sheets.
+    """
+    sheet_data_list = []
+    names = xl.sheet_names if sheet_names is None else sheet_names
+    for done, sheet_name in enumerate(names):
+        if progress is not None:
+            progress(done, len(names), sheet_name)
+        with stage('excel_parse'):
+            df = xl.parse(sheet_name)
+        sheet_data = process_sheet(sheet_name, df, start_date, end_date, client_id, columnar)
+        if sheet_data is not None:
+            sheet_data_list.append(sheet_data)
+    if progress is not None:
+        progress(len(names), len(names), None)
+    return sheet_data_list
+
+
+def process_sheet(sheet_name, df, start_date, end_date, client_id=None, columnar=False):
+    """
+    Clean, map and date-check a single sheet.
+    Returns the sheet's entry for 'sheet_data', or None if the sheet should be skipped.
+    With columnar=True the entry has 'mapped_frame', the mapped columns as a
+    DataFrame, in place of the 'mapped_data' rows.
+    """
+    # Drop rows that are all null or empty strings
+    with stage('blank_rows'):
+        df_clean = drop_blank_rows(df)
+    # Skip if no data rows left after cleaning
+    if df_clean.empty:
+        return None
+    if sheet_name.lower().startswith('1 row null'):
+        return None
+    with stage('map_columns'):
+        if columnar:
+            mapping = resolve_column_mapping(df_clean.columns, client_id)
+            mapped_data = mapped_frame(df_clean, mapping)
+        else:
+            mapped_data, mapping = map_columns(df_clean, client_id=client_id)
+    # Determine if any row has a Date in the quarter range
+    date_summary = {'selected': False, 'min_date': None, 'max_date': None}
+    date_col = mapping.get('Date')
+    if date_col:
+        with stage('date_scan'):
+            date_summary = summarize_dates(df_clean[date_col], start_date, end_date)
+    count('sheets')
+    count('rows', len(mapped_data))
+    return {
+        'sheet_name': sheet_name,
+        'column_mapping': mapping,
+        'mapped_frame' if columnar else 'mapped_data': mapped_data,
+        'columns': list(df_clean.columns),
+        'selected': date_summary['selected'],
+        'min_date': date_summary['min_date'],
+        'max_date': date_summary['max_date']
+    }
+
+
+def process_sheet_from_path(path, sheet_name, quarter_date_range, client_id=None, columnar=False):
+    """
+    Worker entry point: read one sheet of the workbook at path and process it.
+    """
+    start_date, end_date = parse_quarter_range(quarter_date_range)
+    return process_sheet(sheet_name, open_workbook(path).parse(sheet_name), start_date, end_date, client_id, columnar)
+
+
+class spooled_workbook_path:
+    """
+    Context manager giving a file path for a workbook, so worker processes can open it.
+    Paths are used as they are; streams are copied to a temporary file that is
+    removed on exit.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.temp_path = None
+
+    def __enter__(self):
+        if isinstance(self.file, (str, os.PathLike)):
+            return os.fspath(self.file)
+        if hasattr(self.file, 'seek'):
+            self.file.seek(0)
+        fd, self.temp_path = tempfile.mkstemp(suffix='.xlsx')
+        with os.fdopen(fd, 'wb') as temp_file:
+            shutil.copyfileobj(self.file, temp_file)
+        return self.temp_path
+
+    def __exit__(self, *exc_info):
+        if self.temp_path:
+            os.remove(self.temp_path)
+
+
+_sheet_pool = None
+_sheet_pool_workers = 0
+_sheet_pool_lock = threading.Lock()
+
+
+def get_sheet_pool(workers):
+    """
+    Process pool shared by all requests so workers stay warm between workbooks.
+    It is recreated only when a different worker count is requested.
+    """
+    global _sheet_pool, _sheet_pool_workers
+    with _sheet_pool_lock:
+        if _sheet_pool is None or _sheet_pool_workers != workers:
+            if _sheet_pool is not None:
+                _sheet_pool.shutdown(wait=False)
+            start_methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in start_methods else 'spawn')
+            if 'forkserver' in start_methods:
+                # Fork workers from a server that already has pandas and this module imported
+                context.set_forkserver_preload(['sheet_processing'])
+            _sheet_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _sheet_pool_workers = workers
+        return _sheet_pool
+
+
+def shutdown_sheet_pool(wait=True):
+    global _sheet_pool
+    with _sheet_pool_lock:
+        if _sheet_pool is not None:
+            _sheet_pool.shutdown(wait=wait)
+            _sheet_pool = None
+
+
+atexit.register(shutdown_sheet_pool)
+
+
+def process_sheets_in_pool(path, sheet_names, quarter_date_range, workers, client_id=None, columnar=False):
+    """
+    Fan the sheets out across the process pool, one task per sheet.
+    Returns the results in sheet order, or None if the pool broke and the
+    caller should fall back to sequential processing.
+    """
+    try:
+        pool = get_sheet_pool(workers)
+        futures = [pool.submit(process_sheet_from_path, path, sheet_name, quarter_date_range, client_id, columnar)
+                   for sheet_name in sheet_names]
+        return [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        print(f"Sheet worker pool failed, processing sequentially: {e}")
+        shutdown_sheet_pool(wait=False)
+        return None
+
+
+def is_blank_row(values):
+    """True if every cell in a worksheet row is empty or whitespace."""
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in values)
+
+
+def header_names(header_row):
+    """
+    Column names for a worksheet header row, named the way pandas would:
+    empty headers become 'Unnamed: n' and repeated names get a '.1', '.2' suffix.
+    Trailing empty header cells are dropped.
+    """
+    cells = list(header_row)
+    while cells and cells[-1] is None:
+        cells.pop()
+    columns = []
+    seen = {}
+    for position, value in enumerate(cells):
+        name = f'Unnamed: {position}' if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def stream_excel_sheets(file, quarter_date_range=None, chunk_size=STREAM_CHUNK_SIZE, client_id=None, filename=None):
+    """
+    Stream an Excel file sheet by sheet using openpyxl in read-only mode, so memory
+    use is bounded by chunk_size rather than the size of the workbook.
+    Headers are mapped from the first non-blank row and blank rows are dropped as
+    they are read. Empty and header-only sheets are skipped.
+    Yields, for each sheet, one {'type': 'rows', ...} record per chunk of mapped rows
+    followed by a {'type': 'sheet', ...} record with the column mapping, the
+    'selected' flag, the min/max dates and the row count.
+    Cells with no header are ignored.
+    Other formats (.xls, .ods, .csv) are read whole and then yielded the same way.
+    """
+    start_date, end_date = parse_quarter_range(quarter_date_range or '6/4/2025-5/7/2025')
+    if detect_workbook_format(file, filename) != XLSX:
+        yield from stream_parsed_sheets(open_workbook(file, filename), start_date, end_date, chunk_size, client_id)
+        return
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            sheet_name = worksheet.title
+            if sheet_name.lower().startswith('1 row null'):
+                continue
+            rows = worksheet.iter_rows(values_only=True)
+            columns = None
+            for row in rows:
+                if not is_blank_row(row):
+                    columns = header_names(row)
+                    break
+            if not columns:
+                continue
+            mapping = resolve_column_mapping(columns, client_id)
+            positions = [columns.index(mapping[field]) if mapping.get(field) is not None else None
+                         for field in MAPPED_FIELDS]
+            date_position = positions[MAPPED_FIELDS.index('Date')]
+            date_summary = {'selected': False, 'min_date': None, 'max_date': None}
+            row_count = 0
+            chunk = []
+            for row in rows:
+                if is_blank_row(row):
+                    continue
+                chunk.append({
+                    field: row[position] if position is not None and position < len(row) else None
+                    for field, position in zip(MAPPED_FIELDS, positions)
+                })
+                if len(chunk) >= chunk_size:
+                    date_summary = _summarize_chunk(date_summary, chunk, date_position, start_date, end_date)
+                    row_count += len(chunk)
+                    yield {'type': 'rows', 'sheet_name': sheet_name, 'mapped_data': chunk}
+                    chunk = []
+            if chunk:
+                date_summary = _summarize_chunk(date_summary, chunk, date_position, start_date, end_date)
+                row_count += len(chunk)
+                yield {'type': 'rows', 'sheet_name': sheet_name, 'mapped_data': chunk}
+            if not row_count:
+                # Header-only sheet
+                continue
+            yield {
+                'type': 'sheet',
+                'sheet_name': sheet_name,
+                'column_mapping': mapping,
+                'columns': columns,
+                'selected': date_summary['selected'],
+                'min_date': date_summary['min_date'],
+                'max_date': date_summary['max_date'],
+                'row_count': row_count
+            }
+    finally:
+        workbook.close()
+
+
+def stream_parsed_sheets(xl, start_date, end_date, chunk_size=STREAM_CHUNK_SIZE, client_id=None):
+    """stream_excel_sheets records for a workbook opened with open_workbook."""
+    for sheet_name in xl.sheet_names:
+        with stage('excel_parse'):
+            df = xl.parse(sheet_name)
+        sheet = process_sheet(sheet_name, df, start_date, end_date, client_id)
+        if sheet is None:
+            continue
+        mapped_data = sheet.pop('mapped_data')
+        for start in range(0, len(mapped_data), chunk_size):
+            yield {'type': 'rows', 'sheet_name': sheet_name, 'mapped_data': mapped_data[start:start + chunk_size]}
+        yield dict({'type': 'sheet'}, **sheet, row_count=len(mapped_data))
+
+
+def stream_workbook_records(file, quarter_date_range=None, chunk_size=STREAM_CHUNK_SIZE, client_id=None,
+                            filename=None):
+    """
+    Records for an NDJSON response: everything stream_excel_sheets yields, followed by
+    a {'type': 'summary'} record. In the summary, processed_count counts the sheets
+    returned plus any failure, success_count the sheets returned, and errors lists
+    what went wrong.
+    """
+    success_count = 0
+    errors = []
+    try:
+        for record in stream_excel_sheets(file, quarter_date_range, chunk_size, client_id, filename):
+            if record['type'] == 'sheet':
+                success_count += 1
+            yield record
+    except Exception as e:
+        errors.append({'error': f'Exception occurred: {str(e)}'})
+    yield {
+        'type': 'summary',
+        'processed_count': success_count + len(errors),
+        'success_count': success_count,
+        'errors': errors
+    }
+
+
+def _summarize_chunk(date_summary, chunk, date_position, start_date, end_date):
+    if date_position is None:
+        return date_summary
+    dates = pd.Series([row['Date'] for row in chunk], dtype=object)
+    return merge_date_summaries(date_summary, summarize_dates(dates, start_date, end_date))
+
+
+def preprocess_col_name(col_name):
+    # Convert to lowercase
+    col_name = str(col_name).lower()
+    # Replace non-alphanumeric characters (except spaces) with spaces
+    col_name = re.sub(r'[^a-z0-9\s]', ' ', col_name)
+    # Remove extra spaces
+    col_name = re.sub(r'\s+', ' ', col_name).strip()
+    return col_name
+
+
+# Compiled once at import so requests never rebuild the keyword list
+KEYWORD_INDEX = KeywordIndex(FIELD_KEYWORDS)
+
+
+def refresh_field_keywords():
+    """
+    Call after FIELD_KEYWORDS is changed at runtime: rebuilds the keyword index and
+    drops the header templates resolved with the old keywords. Templates stored on
+    disk are also dropped at startup when the keywords differ.
+    """
+    global KEYWORD_INDEX
+    KEYWORD_INDEX = KeywordIndex(FIELD_KEYWORDS)
+    shared_template_store().invalidate(FIELD_KEYWORDS)
@@ -0,0 +1,299 @@
+# ----------------------
+# Model Slimming
+# ----------------------
+# Offline tool that turns the saved joblib pipeline into a slim artifact: a
+# directory of plain .npy arrays and a meta.json, loaded memory-mapped in
+# milliseconds instead of unpickled.
+#   - terms whose weights barely differ across classes are dropped from the
+#     scoring vocabulary. With a normalizing TfidfVectorizer they are kept in a
+#     separate list with only their idf, so they still count in each text's norm
+#     and the kept features keep their values. Dropped weights can still decide
+#     a near tie, so predictions may differ slightly; check the agreement below
+#   - weights and idf are stored as float32
+#   - the vocabulary is a sorted fixed-width byte array searched with
+#     np.searchsorted instead of a pickled dict
+# The tool reports size, load time and agreement with the original model.
+#
+#   python slim_model.py [--min-weight 1e-4] [--eval held-out.txt | ledger.xlsx | labelled.csv]
+import argparse
+import json
+import os
+import shutil
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from fast_model import CompiledTextClassifier, load_texts, is_compilable, synthetic_texts
+from prediction_cache import model_file_version
+
+SLIM_FORMAT_VERSION = 1
+
+# Vectorizer settings needed to rebuild its analyzer without the fitted vocabulary
+ANALYZER_PARAMS = ['encoding', 'decode_error', 'strip_accents', 'lowercase', 'analyzer',
+                   'stop_words', 'token_pattern', 'ngram_range']
+
+# Terms whose weight spread across classes (times idf) is at most this are dropped
+DEFAULT_MIN_WEIGHT = 1e-4
+
+
+class SlimTextClassifier(CompiledTextClassifier):
+    """
+    Predictor loaded from a slim artifact directory written by slim_pipeline().
+    Scores the same way as CompiledTextClassifier; only the vocabulary lookup
+    differs, a binary search over the memory-mapped term array.
+    """
+
+    def __init__(self, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as handle:
+            meta = json.load(handle)
+        if meta['format'] != SLIM_FORMAT_VERSION:
+            raise ValueError(f"Unsupported slim model format {meta['format']} in {path}")
+        self.path = path
+        self.meta = meta
+        self.pipeline = None
+        self.vectorizer = None
+        self.classes_ = np.array(meta['classes'])
+        params = dict(meta['analyzer_params'], ngram_range=tuple(meta['analyzer_params']['ngram_range']))
+        self.analyzer = CountVectorizer(**params).build_analyzer()
+        self.vocabulary = np.load(os.path.join(path, 'vocabulary.npy'), mmap_mode=mmap_mode)
+        self.weights = np.load(os.path.join(path, 'weights.npy'), mmap_mode=mmap_mode)
+        self.bias = np.load(os.path.join(path, 'bias.npy'))
+        idf_path = os.path.join(path, 'idf.npy')
+        self.idf = np.load(idf_path, mmap_mode=mmap_mode) if os.path.exists(idf_path) else None
+        # Dropped terms, only needed for the norm of a text
+        norm_path = os.path.join(path, 'norm_vocabulary.npy')
+        self.norm_vocabulary = np.load(norm_path, mmap_mode=mmap_mode) if os.path.exists(norm_path) else None
+        norm_idf_path = os.path.join(path, 'norm_idf.npy')
+        self.norm_idf = np.load(norm_idf_path, mmap_mode=mmap_mode) if os.path.exists(norm_idf_path) else None
+        self.binary = meta['binary']
+        self.sublinear_tf = meta['sublinear_tf']
+        self.norm = meta['norm']
+        self.binary_decision = meta['binary_decision']
+
+    def _lookup(self, tokens, vocabulary):
+        """Positions of the tokens in a sorted term array, and which tokens were found."""
+        width = vocabulary.dtype.itemsize
+        encoded = np.array([token.encode('utf-8') for token in tokens], dtype=object)
+        # Longer tokens would be truncated to a (wrong) prefix by the fixed width
+        fits = np.fromiter((len(token) <= width for token in encoded), dtype=bool, count=len(encoded))
+        found = np.zeros(len(encoded), dtype=bool)
+        positions = np.zeros(len(encoded), dtype=np.intp)
+        if not fits.any() or not len(vocabulary):
+            return positions, found
+        keys = encoded[fits].astype(vocabulary.dtype)
+        candidates = np.minimum(np.searchsorted(vocabulary, keys), len(vocabulary) - 1)
+        positions[fits] = candidates
+        found[fits] = vocabulary[candidates] == keys
+        return positions, found
+
+    def _weighted_counts(self, rows, tokens, count, vocabulary, idf):
+        """Unnormalized tf(-idf) matrix of count texts, given each token's row."""
+        positions, found = self._lookup(tokens, vocabulary)
+        rows = np.asarray(rows, dtype=np.intp)[found]
+        matrix = sp.csr_matrix((np.ones(len(rows)), (rows, positions[found])), shape=(count, len(vocabulary)))
+        matrix.sum_duplicates()
+        if self.binary:
+            matrix.data[:] = 1.0
+        elif self.sublinear_tf:
+            matrix.data = np.log(matrix.data) + 1.0
+        if idf is not None:
+            matrix.data *= idf[matrix.indices]
+        return matrix
+
+    def _row_norms(self, matrices):
+        if self.norm == 'l2':
+            return np.sqrt(sum(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel() for matrix in matrices))
+        return sum(np.asarray(abs(matrix).sum(axis=1)).ravel() for matrix in matrices)
+
+    def _matrix(self, rows, tokens, count):
+        matrix = self._weighted_counts(rows, tokens, count, self.vocabulary, self.idf)
+        if not self.norm:
+            return matrix
+        matrices = [matrix]
+        if self.norm_vocabulary is not None:
+            matrices.append(self._weighted_counts(rows, tokens, count, self.norm_vocabulary, self.norm_idf))
+        norms = self._row_norms(matrices)
+        scale = np.divide(1.0, norms, out=np.ones_like(norms), where=norms > 0)
+        return sp.csr_matrix(sp.diags(scale) @ matrix)
+
+    def _features(self, text):
+        tokens = self.analyzer(text)
+        matrix = self._matrix(np.zeros(len(tokens), dtype=np.intp), tokens, 1)
+        return matrix.indices, matrix.data
+
+    def _batch_matrix(self, texts):
+        tokens = []
+        rows = []
+        for row, text in enumerate(texts):
+            text_tokens = self.analyzer(text)
+            tokens.extend(text_tokens)
+            rows.extend([row] * len(text_tokens))
+        return self._matrix(rows, tokens, len(texts))
+
+
+def is_slim_artifact(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def term_importance(compiled):
+    """
+    How much each term can move a prediction: the spread of its weights across
+    classes (a shift shared by all classes never changes the argmax), or the
+    absolute weight for two-class linear models, scaled by idf.
+    """
+    weights = np.asarray(compiled.weights, dtype=np.float64)
+    importance = np.abs(weights[0]) if compiled.binary_decision else weights.max(axis=0) - weights.min(axis=0)
+    if compiled.idf is not None:
+        importance = importance * compiled.idf
+    return importance
+
+
+def _term_array(terms):
+    """Encoded terms as a fixed-width byte array, as wide as the longest."""
+    return terms.astype(f'S{max((len(term) for term in terms), default=1)}')
+
+
+def slim_pipeline(model_path, output_path, min_weight=DEFAULT_MIN_WEIGHT):
+    """
+    Write the slim artifact for the joblib pipeline at model_path to output_path.
+    The directory is built next to its destination and swapped into place.
+    Returns the artifact's meta.json content.
+    """
+    pipeline = joblib.load(model_path)
+    if not is_compilable(pipeline):
+        raise ValueError(f"{type(pipeline).__name__} cannot be slimmed; only vectorizer + linear/NB pipelines can")
+    vectorizer = pipeline.steps[0][1]
+    params = {name: vectorizer.get_params()[name] for name in ANALYZER_PARAMS}
+    if callable(params['analyzer']) or vectorizer.preprocessor is not None or vectorizer.tokenizer is not None:
+        raise ValueError("Pipelines with a custom analyzer, preprocessor or tokenizer cannot be slimmed")
+    if isinstance(params['stop_words'], (set, frozenset)):
+        params['stop_words'] = sorted(params['stop_words'])
+    params['ngram_range'] = list(params['ngram_range'])
+    compiled = CompiledTextClassifier(pipeline)
+    keep = np.flatnonzero(term_importance(compiled) > min_weight)
+    terms = np.empty(len(compiled.vocabulary), dtype=object)
+    for term, index in compiled.vocabulary.items():
+        terms[index] = term.encode('utf-8')
+    kept_terms = _term_array(terms[keep])
+    order = np.argsort(kept_terms, kind='stable')
+    columns = keep[order]
+    # With a norm, dropped terms still change the values of the kept ones
+    dropped = np.setdiff1d(np.arange(len(terms)), keep) if compiled.norm else np.array([], dtype=np.intp)
+    dropped_terms = _term_array(terms[dropped])
+    dropped_order = np.argsort(dropped_terms, kind='stable')
+    meta = {
+        'format': SLIM_FORMAT_VERSION,
+        'source': os.path.basename(model_path),
+        'source_version': model_file_version(model_path),
+        'classes': compiled.classes_.tolist(),
+        'analyzer_params': params,
+        'binary': bool(compiled.binary),
+        'sublinear_tf': bool(compiled.sublinear_tf),
+        'norm': compiled.norm,
+        'binary_decision': bool(compiled.binary_decision),
+        'vocabulary_size': int(len(columns)),
+        'original_vocabulary_size': int(len(terms)),
+        'norm_vocabulary_size': int(len(dropped)),
+        'min_weight': min_weight
+    }
+    temp_path = f"{output_path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    np.save(os.path.join(temp_path, 'vocabulary.npy'), kept_terms[order])
+    np.save(os.path.join(temp_path, 'weights.npy'), np.ascontiguousarray(np.asarray(compiled.weights)[:, columns], dtype=np.float32))
+    np.save(os.path.join(temp_path, 'bias.npy'), np.asarray(compiled.bias, dtype=np.float64))
+    if compiled.idf is not None:
+        np.save(os.path.join(temp_path, 'idf.npy'), np.asarray(compiled.idf[columns], dtype=np.float32))
+    if len(dropped):
+        np.save(os.path.join(temp_path, 'norm_vocabulary.npy'), dropped_terms[dropped_order])
+        if compiled.idf is not None:
+            np.save(os.path.join(temp_path, 'norm_idf.npy'),
+                    np.asarray(compiled.idf[dropped[dropped_order]], dtype=np.float32))
+    # meta.json is written last: its presence marks a complete artifact
+    with open(os.path.join(temp_path, 'meta.json'), 'w', encoding='utf-8') as handle:
+        json.dump(meta, handle, indent=2)
+    old_path = f"{output_path}.old"
+    if os.path.exists(output_path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(output_path, old_path)
+    os.replace(temp_path, output_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return meta
+
+
+def _artifact_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _load_time(load, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        load()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def compare_models(model_path, slim_path, texts, labels=None):
+    """
+    Size, load time and prediction deltas of the slim artifact against the original.
+    Agreement is the share of texts predicted identically; accuracy is reported
+    for both models when labels are given.
+    """
+    original = joblib.load(model_path)
+    slim = SlimTextClassifier(slim_path)
+    expected = np.asarray(original.predict(texts))
+    actual = np.asarray(slim.predict(texts))
+    report = {
+        'original_bytes': _artifact_size(model_path),
+        'slim_bytes': _artifact_size(slim_path),
+        'original_load_seconds': round(_load_time(lambda: joblib.load(model_path)), 4),
+        'slim_load_seconds': round(_load_time(lambda: SlimTextClassifier(slim_path)), 4),
+        'vocabulary_size': slim.meta['vocabulary_size'],
+        'original_vocabulary_size': slim.meta['original_vocabulary_size'],
+        'texts': len(texts),
+        'agreement': round(float((expected == actual).mean()), 6) if len(texts) else None
+    }
+    if labels is not None:
+        labels = np.asarray(labels)
+        report['original_accuracy'] = round(float((expected == labels).mean()), 6)
+        report['slim_accuracy'] = round(float((actual == labels).mean()), 6)
+    return report
+
+
+def main(argv=None):
+    from model_store import MODEL_PATH, SLIM_MODEL_PATH
+    parser = argparse.ArgumentParser(description="Write a slim, memory-mappable copy of the classifier.")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output', default=SLIM_MODEL_PATH)
+    parser.add_argument('--min-weight', type=float, default=DEFAULT_MIN_WEIGHT)
+    parser.add_argument('--eval', nargs='*', default=[],
+                        help="Held-out texts (.txt lines or .xlsx ledgers), or a labelled .csv")
+    parser.add_argument('--text-column', default='description')
+    parser.add_argument('--label-column', default='category')
+    args = parser.parse_args(argv)
+    meta = slim_pipeline(args.model, args.output, args.min_weight)
+    print(f"Wrote {args.output}: kept {meta['vocabulary_size']} of {meta['original_vocabulary_size']} terms")
+    texts, labels = [], None
+    for path in args.eval:
+        if path.endswith('.csv'):
+            frame = pd.read_csv(path)
+            texts.extend(frame[args.text_column].astype(str))
+            labels = (labels or []) + frame[args.label_column].astype(str).tolist()
+        else:
+            texts.extend(load_texts([path]))
+    if labels is not None and len(labels) != len(texts):
+        labels = None
+    if not texts:
+        texts = synthetic_texts(joblib.load(args.model))
+    for key, value in compare_models(args.model, args.output, texts, labels).items():
+        print(f"{key:>26}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# ----------------------
+# Synthetic Ledgers
+# ----------------------
+# Realistic, reproducible client ledgers for benchmarks and load tests, so they
+# run without client data or a trained model:
+#   - messy header spellings for every mapped field, plus filler columns
+#   - mixed UK date formats (strings, Excel dates and the odd blank)
+#   - repeated merchant descriptions, as in real bank exports
+#   - blank and whitespace-only rows scattered through each sheet
+# StubClassifier stands in for the saved model with deterministic predictions;
+# CountingModel is a smaller stand-in for tests that records its predict() calls.
+import datetime
+import os
+import zlib
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# Header spellings seen in client ledgers, per mapped field
+HEADER_VARIANTS = {
+    'Date': ['Date', 'Txn Date', 'Transaction  Date', 'POSTING_DATE', 'Trans Dt', ' date ', 'TransDt'],
+    'Description': ['Description', 'Transaction Descriptions', 'Narration', 'Details ', 'Particulars', 'Txn_desc'],
+    'Amount': ['Amount', 'AMT', 'Transaction Amount (GBP)', 'Value', 'Debit'],
+    'DisallowableExpenses': ['Disallowable Expenses', 'Tax add-backs', 'Dis allowed exp', 'Non-deductible expenses'],
+}
+
+# Columns that map to nothing, used to make sheets wide
+FILLER_COLUMNS = ['Reference', 'Cost Centre', 'VAT Code', 'Account Code', 'Nominal', 'Project',
+                  'Department', 'Supplier ID', 'Invoice No', 'Payment Method', 'Bank Ref', 'Notes']
+
+MERCHANTS = {
+    'Tax': ['DIRECT DEBIT HMRC VAT', 'HMRC PAYE', 'HMRC CORP TAX', 'HMRC NI CONTRIBUTIONS'],
+    'Purchases': ['CARD PAYMENT TO AMAZON MKTPLACE', 'TESCO STORES', 'SCREWFIX DIRECT', 'BOOKER WHOLESALE'],
+    'Travel': ['TRAINLINE.COM LONDON', 'UBER TRIP', 'SHELL PETROL', 'TFL TRAVEL CHARGE', 'NCP PARKING'],
+    'Bank charges': ['BANK CHARGES', 'OVERDRAFT INTEREST', 'INTERNATIONAL PAYMENT FEE'],
+    'Salaries': ['SALARY PAYMENT', 'BACS PAYROLL'],
+    'Utilities': ['BT GROUP PLC', 'BRITISH GAS', 'THAMES WATER', 'EDF ENERGY'],
+}
+CATEGORIES = sorted(MERCHANTS)
+
+# UK date renderings, from test_date_formats.py
+DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%d.%m.%Y',
+                '%d/%m/%y', '%d/%b/%Y', '%d-%b-%Y', '%A, %d %B %Y', '%d/%m/%Y %H:%M']
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def parse_scale(scale):
+    """Row count for a scale name ('100k') or a plain number."""
+    scale = str(scale).lower()
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale.replace('_', ''))
+
+
+class StubClassifier:
+    """
+    Deterministic stand-in for the saved model: keyword rules for the known
+    merchants, otherwise a category picked by a stable hash of the text.
+    """
+
+    def __init__(self):
+        self.classes_ = np.array(CATEGORIES)
+        self._rules = [(merchant.split()[-1], category) for category, merchants in MERCHANTS.items()
+                       for merchant in merchants]
+
+    def predict(self, texts):
+        predictions = []
+        for text in texts:
+            text = str(text).upper()
+            for keyword, category in self._rules:
+                if keyword in text:
+                    predictions.append(category)
+                    break
+            else:
+                predictions.append(CATEGORIES[zlib.crc32(text.encode('utf-8')) % len(CATEGORIES)])
+        return np.array(predictions)
+
+
+def keyword_category(text):
+    """The category CountingModel gives a description by default."""
+    text = text.upper()
+    if 'TRAIN' in text:
+        return 'Travel'
+    if 'HMRC' in text:
+        return 'Tax'
+    return 'Office costs'
+
+
+class CountingModel:
+    """
+    Minimal stand-in for the classifier that records every predict() call.
+    Texts are classified by rule (keyword_category by default); a batch with a
+    text containing fail_on raises instead.
+    """
+
+    def __init__(self, rule=keyword_category, fail_on=None):
+        self.rule = rule
+        self.fail_on = fail_on
+        self.calls = []
+
+    def predict(self, texts):
+        self.calls.append(list(texts))
+        if self.fail_on is not None and any(self.fail_on in text for text in texts):
+            raise ValueError(f"cannot classify '{self.fail_on}'")
+        return [self.rule(text) for text in texts]
+
+
+def ledger_headers(rng, wide_columns=0):
+    """One messy header per mapped field plus wide_columns filler columns, shuffled."""
+    headers = [HEADER_VARIANTS[field][rng.integers(len(HEADER_VARIANTS[field]))] for field in HEADER_VARIANTS]
+    filler = [FILLER_COLUMNS[i % len(FILLER_COLUMNS)] + (f' {i // len(FILLER_COLUMNS) + 1}' if i >= len(FILLER_COLUMNS) else '')
+              for i in range(wide_columns)]
+    columns = headers + filler
+    order = rng.permutation(len(columns))
+    return [columns[i] for i in order], dict(zip(HEADER_VARIANTS, headers))
+
+
+def ledger_descriptions(rng, rows):
+    """Merchant descriptions with a skewed (Zipf-like) repeat rate and some unique references."""
+    merchants = [merchant for category in CATEGORIES for merchant in MERCHANTS[category]]
+    weights = 1.0 / np.arange(1, len(merchants) + 1)
+    picks = rng.choice(len(merchants), size=rows, p=weights / weights.sum())
+    references = rng.integers(1000, 99999, size=rows)
+    with_reference = rng.random(rows) < 0.3
+    return [f'{merchants[pick]} {reference}' if referenced else merchants[pick]
+            for pick, reference, referenced in zip(picks, references, with_reference)]
+
+
+def ledger_dates(rng, rows, start=datetime.date(2025, 1, 1), days=365):
+    """A mix of formatted UK date strings, real dates and blanks."""
+    offsets = rng.integers(0, days, size=rows)
+    formats = rng.integers(-1, len(DATE_FORMATS), size=rows)
+    blanks = rng.random(rows) < 0.01
+    dates = []
+    for offset, fmt, blank in zip(offsets, formats, blanks):
+        day = start + datetime.timedelta(days=int(offset))
+        if blank:
+            dates.append(None)
+        elif fmt < 0:
+            dates.append(datetime.datetime.combine(day, datetime.time()))
+        else:
+            dates.append(day.strftime(DATE_FORMATS[fmt]))
+    return dates
+
+
+def ledger_frame(rows, seed=0, wide_columns=4, blank_ratio=0.02):
+    """
+    A DataFrame shaped like one sheet of a client ledger. Returns (frame, headers)
+    where headers maps each field to the messy column name it was given.
+    """
+    rng = np.random.default_rng(seed)
+    columns, headers = ledger_headers(rng, wide_columns)
+    data = {
+        headers['Date']: ledger_dates(rng, rows),
+        headers['Description']: ledger_descriptions(rng, rows),
+        headers['Amount']: np.round(rng.lognormal(3, 1.2, size=rows) * rng.choice([-1, 1], size=rows), 2),
+        headers['DisallowableExpenses']: np.where(rng.random(rows) < 0.05, np.round(rng.random(rows) * 100, 2), 0.0),
+    }
+    for column in columns:
+        if column not in data:
+            data[column] = [f'{column[:3].upper()}{value}' for value in rng.integers(0, 500, size=rows)]
+    frame = pd.DataFrame(data, columns=columns)
+    blank_rows = np.flatnonzero(rng.random(rows) < blank_ratio)
+    if len(blank_rows):
+        frame = frame.astype(object)
+        # Alternate between truly empty rows and rows of spaces
+        frame.iloc[blank_rows[::2]] = None
+        frame.iloc[blank_rows[1::2]] = ' '
+    return frame, headers
+
+
+def write_ledger_workbook(path, rows, sheets=3, wide_columns=4, blank_ratio=0.02, seed=0):
+    """
+    Write an .xlsx ledger with rows spread over the given number of sheets, each
+    with its own header spellings. Uses openpyxl's write-only mode so million-row
+    workbooks are written in bounded memory. Returns the path.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    per_sheet = [rows // sheets + (1 if index < rows % sheets else 0) for index in range(sheets)]
+    for index, sheet_rows in enumerate(per_sheet):
+        frame, _ = ledger_frame(sheet_rows, seed=seed + index, wide_columns=wide_columns, blank_ratio=blank_ratio)
+        worksheet = workbook.create_sheet(f'Ledger {index + 1}')
+        worksheet.append(list(frame.columns))
+        for values in frame.itertuples(index=False, name=None):
+            worksheet.append([None if isinstance(value, float) and np.isnan(value) else value for value in values])
+    workbook.save(path)
+    return path
+
+
+def write_ledger_csv(path, rows, wide_columns=4, blank_ratio=0.02, seed=0):
+    """Write a single-sheet ledger as CSV, the way bank exports arrive. Returns the path."""
+    frame, _ = ledger_frame(rows, seed=seed, wide_columns=wide_columns, blank_ratio=blank_ratio)
+    frame.to_csv(path, index=False)
+    return path
+
+
+def write_ledger_ods(path, rows, sheets=3, wide_columns=4, blank_ratio=0.02, seed=0):
+    """Write an OpenDocument ledger (needs odfpy). Returns the path."""
+    per_sheet = [rows // sheets + (1 if index < rows % sheets else 0) for index in range(sheets)]
+    with pd.ExcelWriter(path, engine='odf') as writer:
+        for index, sheet_rows in enumerate(per_sheet):
+            frame, _ = ledger_frame(sheet_rows, seed=seed + index, wide_columns=wide_columns, blank_ratio=blank_ratio)
+            frame.to_excel(writer, index=False, sheet_name=f'Ledger {index + 1}')
+    return path
+
+
+def cached_ledger_workbook(directory, rows, sheets=3, wide_columns=4, blank_ratio=0.02, seed=0, file_format='xlsx'):
+    """
+    Path of a generated workbook in directory, written only if it is not there yet.
+    file_format is 'xlsx', 'ods' or 'csv' (a CSV ledger has a single sheet).
+    """
+    os.makedirs(directory, exist_ok=True)
+    if file_format == 'csv':
+        sheets = 1
+    name = f'ledger-{rows}r-{sheets}s-{wide_columns}w-{blank_ratio:g}b-{seed}.{file_format}'
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        # Written under a temporary name that keeps the extension, as pandas picks writers by it
+        temp_path = os.path.join(directory, f'tmp-{name}')
+        if file_format == 'csv':
+            write_ledger_csv(temp_path, rows, wide_columns, blank_ratio, seed)
+        elif file_format == 'ods':
+            write_ledger_ods(temp_path, rows, sheets, wide_columns, blank_ratio, seed)
+        else:
+            write_ledger_workbook(temp_path, rows, sheets, wide_columns, blank_ratio, seed)
+        os.replace(temp_path, path)
+    return path
+
+
+def ledger_records(rows, seed=0, description_column='Description'):
+    """/predict_bulk style records: one dict per transaction with the description under description_column."""
+    rng = np.random.default_rng(seed)
+    descriptions = ledger_descriptions(rng, rows)
+    amounts = np.round(rng.lognormal(3, 1.2, size=rows), 2).tolist()
+    return [{'id': index, description_column: description, 'Amount': amount}
+            for index, (description, amount) in enumerate(zip(descriptions, amounts))]
+
+
+def messy_headers(count, seed=0):
+    """count header names drawn from every field's variants and the filler columns, with noise."""
+    rng = np.random.default_rng(seed)
+    pool = [variant for variants in HEADER_VARIANTS.values() for variant in variants] + FILLER_COLUMNS
+    picks = rng.integers(0, len(pool), size=count)
+    suffixes = rng.integers(0, 50, size=count)
+    return [pool[pick] if suffix >= 10 else f'{pool[pick]} {suffix}' for pick, suffix in zip(picks, suffixes)]
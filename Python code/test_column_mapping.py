@@ -0,0 +1,55 @@
+import pandas as pd
+from app import KeywordIndex, best_column_match, map_columns
+from const.field_keywords import FIELD_KEYWORDS
+
+
+def test_mixed_case_keywords_are_preprocessed():
+    assert best_column_match('TransDt', FIELD_KEYWORDS) == 'Date'
+    assert best_column_match('Dt', FIELD_KEYWORDS) == 'Date'
+    assert best_column_match('Tran. Desc', FIELD_KEYWORDS) == 'Description'
+
+
+def test_keyword_index_deduplicates_keywords():
+    index = KeywordIndex(FIELD_KEYWORDS)
+    assert len(index.keywords) == len(set(index.keywords))
+    assert index.match(['Transaction Amount', 'Notes', 'Transaction Amount']) == ['Amount', None, 'Amount']
+
+
+def test_map_columns_keeps_first_match_per_field():
+    df = pd.DataFrame(columns=['Posting Date', 'Amount', 'Transaction Date', 'Details', 'Reference'])
+    _, mapping = map_columns(df)
+    assert mapping['Date'] == 'Posting Date'
+    assert mapping['Amount'] == 'Amount'
+    assert mapping['Description'] == 'Details'
+    assert mapping['DisallowableExpenses'] is None
+    assert mapping['Other'] == ['Transaction Date', 'Reference']
+
+
+def test_map_columns_matches_row_by_row_extraction():
+    df = pd.DataFrame({
+        'Amount': [10, 20, 30],
+        'Txn Date': pd.to_datetime(['2025-07-01', None, '2025-07-03']),
+        'Narration': ['Train', None, 'Paper'],
+        'Ref': [1.5, 2.5, 3.5]
+    })
+    expected = [
+        {
+            'Amount': row.get('Amount'),
+            'Date': row.get('Txn Date'),
+            'Description': row.get('Narration'),
+            'DisallowableExpenses': None
+        }
+        for _, row in df.iterrows()
+    ]
+    mapped_data, _ = map_columns(df)
+    assert repr(mapped_data) == repr(expected)
+    lazy_data, _ = map_columns(df, lazy=True)
+    assert not isinstance(lazy_data, list)
+    assert repr(list(lazy_data)) == repr(expected)
+
+
+if __name__ == "__main__":
+    test_mixed_case_keywords_are_preprocessed()
+    test_keyword_index_deduplicates_keywords()
+    test_map_columns_keeps_first_match_per_field()
+    test_map_columns_matches_row_by_row_extraction()
@@ -0,0 +1,74 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import app as flask_app
+from columnar_format import ARROW_STREAM_MIMETYPE, PARQUET_MIMETYPE, workbook_table
+from sheet_processing import categorize_excel_sheets_fuzzy
+from test_dms_client import StubDMS, create_workbook_bytes
+
+
+def two_sheet_workbook():
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        pd.DataFrame({'Amount': [10.5, 20.0], 'Date': pd.to_datetime(['2025-04-10', '2025-05-12']),
+                      'Description': ['HMRC', 'AMAZON']}).to_excel(writer, index=False, sheet_name='Bank')
+        pd.DataFrame({'Value': ['12.00', 'n/a'], 'Txn Date': ['01/06/2025', 'soon'],
+                      'Narration': ['TRAIN', None]}).to_excel(writer, index=False, sheet_name='Cash')
+    return output.getvalue()
+
+
+def test_arrow_stream_matches_json_result():
+    workbook = two_sheet_workbook()
+    with StubDMS() as dms, flask_app.app.test_client() as client:
+        as_json = client.post('/getData', data={'clientId': 'c1', 'file': (io.BytesIO(workbook), 'ledger.xlsx')},
+                              content_type='multipart/form-data')
+        as_arrow = client.post('/getData?format=arrow',
+                               data={'clientId': 'c1', 'file': (io.BytesIO(workbook), 'ledger.xlsx')},
+                               content_type='multipart/form-data')
+    assert as_arrow.status_code == 200 and as_arrow.mimetype == ARROW_STREAM_MIMETYPE
+    assert len(dms.uploads) == 2
+    table = pa.ipc.open_stream(as_arrow.data).read_all()
+    assert table.column_names == ['sheet_name', 'Amount', 'Date', 'Description', 'DisallowableExpenses']
+    assert table.schema.field('Date').type == pa.string(), "Sheets that disagree on a type fall back to strings."
+    assert table['sheet_name'].to_pylist() == ['Bank', 'Bank', 'Cash', 'Cash']
+    assert table['Description'].to_pylist() == ['HMRC', 'AMAZON', 'TRAIN', None]
+    sheets = json.loads(table.schema.metadata[b'sheets'])
+    expected = as_json.get_json()['sheet_data']
+    for sheet, expected_sheet in zip(sheets, expected):
+        for key in ('sheet_name', 'column_mapping', 'columns', 'selected'):
+            assert sheet[key] == expected_sheet[key]
+        assert sheet['row_count'] == len(expected_sheet['mapped_data'])
+
+
+def test_single_sheet_keeps_native_types():
+    result = categorize_excel_sheets_fuzzy(io.BytesIO(two_sheet_workbook()), '1/4/2025-30/6/2025',
+                                           sheet_names=['Bank'], columnar=True)
+    table = workbook_table(result)
+    assert table.schema.field('Amount').type == pa.float64()
+    assert pa.types.is_timestamp(table.schema.field('Date').type)
+    assert table.schema.field('DisallowableExpenses').type == pa.null()
+
+
+def test_sheet_data_negotiates_parquet_with_its_own_etag():
+    workbook = create_workbook_bytes()
+    query = '/getSheetData?clientId=c1&filename=ledger.xlsx&currentPeriod=1/4/2025-30/6/2025'
+    with StubDMS(document=workbook, etag='"v1"'), flask_app.app.test_client() as client:
+        default = client.get(query, headers={'Accept': '*/*'})
+        parquet = client.get(query, headers={'Accept': PARQUET_MIMETYPE})
+        revalidated = client.get(query, headers={'Accept': PARQUET_MIMETYPE, 'If-None-Match': parquet.headers['ETag']})
+    assert default.mimetype == 'application/json' and 'sheet_data' in default.get_json()
+    assert parquet.status_code == 200 and parquet.mimetype == PARQUET_MIMETYPE
+    assert parquet.headers['ETag'] != default.headers['ETag'] and 'Accept' in parquet.headers['Vary']
+    assert revalidated.status_code == 304
+    frame = pq.read_table(io.BytesIO(parquet.data)).to_pandas()
+    assert frame['Amount'].tolist() == [10.5, 20.0]
+    assert frame['Date'].tolist() == ['10/04/2025', '12/05/2025']
+
+
+if __name__ == "__main__":
+    test_arrow_stream_matches_json_result()
+    test_single_sheet_keeps_native_types()
+    test_sheet_data_negotiates_parquet_with_its_own_etag()
+    print("All tests passed.")
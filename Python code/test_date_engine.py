@@ -0,0 +1,40 @@
+import pandas as pd
+from datetime import datetime
+from date_engine import parse_quarter_range, summarize_dates
+
+
+def test_native_datetimes_pass_through():
+    start_date, end_date = parse_quarter_range('1/3/2025-31/3/2025')
+    dates = pd.Series(pd.to_datetime(['2025-03-04', '2025-06-30']))
+    summary = summarize_dates(dates, start_date, end_date)
+    assert summary['selected'], "4 March 2025 must not be read back as 3 April."
+    assert summary['min_date'] == datetime(2025, 3, 4)
+    assert summary['max_date'] == datetime(2025, 6, 30)
+
+
+def test_uk_strings_are_day_first():
+    start_date, end_date = parse_quarter_range('1/4/2025-30/4/2025')
+    summary = summarize_dates(pd.Series(['05/04/2025', '06/04/2025', None, '']), start_date, end_date)
+    assert summary['selected']
+    assert summary['min_date'] == datetime(2025, 4, 5)
+    assert summary['max_date'] == datetime(2025, 4, 6)
+
+
+def test_unparsed_leftovers_fall_back_to_fuzzy_parsing():
+    start_date, end_date = parse_quarter_range('1/7/2025-31/7/2025')
+    values = pd.Series(['Thursday, 24 July 2025', '24th July 2025', 'no date here'], dtype=object)
+    assert summarize_dates(values, start_date, end_date)['selected']
+
+
+def test_timezone_aware_dates_are_not_selected():
+    start_date, end_date = parse_quarter_range('1/4/2024-30/4/2024')
+    values = pd.Series(['Mon, 15 Apr 2024 00:00:00 GMT'])
+    summary = summarize_dates(values, start_date, end_date)
+    assert not summary['selected'] and summary['min_date'] is None
+
+
+if __name__ == "__main__":
+    test_native_datetimes_pass_through()
+    test_uk_strings_are_day_first()
+    test_unparsed_leftovers_fall_back_to_fuzzy_parsing()
+    test_timezone_aware_dates_are_not_selected()
@@ -1,6 +1,6 @@
 import io
 import pandas as pd
-from app import categorize_excel_sheets_fuzzy
+from app import categorize_excel_sheets_fuzzy, stream_excel_sheets, stream_workbook_records
 
 # Helper to create an in-memory Excel file with various UK date formats
 def create_test_excel():
@@ -167,7 +167,39 @@ def test_rfc_date_sheet_not_selected_for_future_quarter():
     # None of the rows should be selected for this future quarter
     assert all(not sheet['selected'] for sheet in result['sheet_data']), "No sheet should be selected for a quarter that does not include the data dates."
 
+def test_stream_excel_sheets_matches_full_parse():
+    quarter_range = '1/4/2025-30/6/2025'
+    expected = categorize_excel_sheets_fuzzy(create_test_excel_multi_quarter(), quarter_range)['sheet_data']
+    records = list(stream_excel_sheets(create_test_excel_multi_quarter(), quarter_range, chunk_size=2))
+    sheets = [record for record in records if record['type'] == 'sheet']
+    assert [sheet['sheet_name'] for sheet in sheets] == [sheet['sheet_name'] for sheet in expected], "EmptySheet should be skipped."
+    assert [sheet['selected'] for sheet in sheets] == [sheet['selected'] for sheet in expected]
+    assert [sheet['column_mapping'] for sheet in sheets] == [sheet['column_mapping'] for sheet in expected]
+    # Three data rows per sheet arrive as a chunk of two and a chunk of one
+    q1_chunks = [record['mapped_data'] for record in records if record['type'] == 'rows' and record['sheet_name'] == 'Q1']
+    assert [len(chunk) for chunk in q1_chunks] == [2, 1]
+    assert q1_chunks[0][0] == {'Amount': 100, 'Date': '15/01/2025', 'Description': 'Q1 row 1', 'DisallowableExpenses': 0}
+
+def test_categorize_excel_sheets_fuzzy_in_process_pool():
+    quarter_range = '1/7/2025-30/9/2025'
+    expected = categorize_excel_sheets_fuzzy(create_test_excel_multi_quarter(), quarter_range, workers=1)
+    result = categorize_excel_sheets_fuzzy(create_test_excel_multi_quarter(), quarter_range, workers=2)
+    assert [sheet['sheet_name'] for sheet in result['sheet_data']] == ['Q1', 'Q2', 'Q3', 'Q4'], "Sheets should keep their original order."
+    assert [sheet['selected'] for sheet in result['sheet_data']] == [sheet['selected'] for sheet in expected['sheet_data']]
+    assert [sheet['mapped_data'] for sheet in result['sheet_data']] == [sheet['mapped_data'] for sheet in expected['sheet_data']]
+
+
+def test_stream_workbook_records_ends_with_summary():
+    records = list(stream_workbook_records(create_test_excel_multi_quarter(), '1/1/2025-31/3/2025'))
+    assert records[-1] == {'type': 'summary', 'processed_count': 4, 'success_count': 4, 'errors': []}
+    broken = list(stream_workbook_records(io.BytesIO(b'\x00\x01 not a workbook')))
+    assert broken[-1]['type'] == 'summary' and broken[-1]['success_count'] == 0
+    assert len(broken[-1]['errors']) == 1
+
 if __name__ == "__main__":
     test_categorize_excel_sheets_fuzzy()
     test_categorize_excel_sheets_fuzzy_multi_quarter()
     test_rfc_date_sheet_not_selected_for_future_quarter()
+    test_stream_excel_sheets_matches_full_parse()
+    test_categorize_excel_sheets_fuzzy_in_process_pool()
+    test_stream_workbook_records_ends_with_summary()
@@ -0,0 +1,184 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+import app as flask_app
+import dms_client
+from dms_client import SpooledUpload
+
+
+def create_workbook_bytes():
+    df = pd.DataFrame({
+        'Amount': [10.5, 20.0],
+        'Date': ['10/04/2025', '12/05/2025'],
+        'Description': ['HMRC', 'AMAZON']
+    })
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Sheet1')
+    return output.getvalue()
+
+
+class StubDMS:
+    """Local stand-in for the DMS /api/Document/upload and /api/Document/stream endpoints."""
+
+    def __init__(self, document=b'', upload_status=200, stream_failures=0, etag=None):
+        self.document = document
+        self.etag = etag
+        self.upload_status = upload_status
+        self.stream_failures = stream_failures
+        self.uploads = []
+        self.stream_calls = []
+        self.conditional_headers = []
+        self.client_ports = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body):
+                self.send_response(status)
+                if stub.etag:
+                    self.send_header('ETag', stub.etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                stub.client_ports.add(self.client_address[1])
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.uploads.append(body)
+                self.reply(stub.upload_status, b'stored' if stub.upload_status == 200 else b'disk full')
+
+            def do_GET(self):
+                stub.client_ports.add(self.client_address[1])
+                stub.stream_calls.append(parse_qs(urlparse(self.path).query))
+                stub.conditional_headers.append({'If-None-Match': self.headers.get('If-None-Match')})
+                if len(stub.stream_calls) <= stub.stream_failures:
+                    self.reply(503, b'busy')
+                elif stub.etag and self.headers.get('If-None-Match') == stub.etag:
+                    self.reply(304, b'')
+                else:
+                    self.reply(200, stub.document)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        dms_client.configure_dms_client(base_url=f'http://127.0.0.1:{self.server.server_port}', max_retries=2)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        dms_client.configure_dms_client()
+        flask_app.workbook_cache.clear()
+
+
+def test_spooled_upload_opens_independent_handles():
+    spooled = SpooledUpload(io.BytesIO(b'abcdef'), max_memory=4)
+    try:
+        assert spooled.path is not None and spooled.size == 6, "Expected a temp file above max_memory."
+        with spooled.open() as first, spooled.open() as second:
+            assert first.read(3) == b'abc'
+            assert second.read() == b'abcdef'
+    finally:
+        spooled.close()
+    assert SpooledUpload(io.BytesIO(b'abc'), max_memory=4).path is None
+
+
+def test_streamed_upload_finishes_after_client_disconnects():
+    spooled = SpooledUpload(io.BytesIO(b'abcdef'), max_memory=4)
+    release = threading.Event()
+    uploaded = []
+
+    def upload():
+        release.wait(5)
+        with spooled.open() as handle:
+            uploaded.append(handle.read())
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(release.wait, 5)  # keeps the upload queued
+        upload_future = executor.submit(upload)
+        workbook = spooled.open()
+        records = flask_app.stream_with_upload((record for record in [{'type': 'rows'}, {'type': 'rows'}]),
+                                               upload_future, spooled, workbook)
+        next(records)
+        records.close()
+        assert workbook.closed, "The handle the records were read from is closed with the stream."
+        release.set()
+        upload_future.result(5)
+    assert uploaded == [b'abcdef'], "The upload must not be cancelled when the client goes away."
+    assert not os.path.exists(spooled.path), "The spooled copy is removed once the upload is done."
+
+
+def test_get_data_uploads_and_parses_the_same_file():
+    workbook = create_workbook_bytes()
+    with StubDMS() as stub, flask_app.app.test_client() as client:
+        response = client.post('/getData', data={
+            'clientId': 'client-1',
+            'file': (io.BytesIO(workbook), 'ledger.xlsx')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert [sheet['sheet_name'] for sheet in response.get_json()['sheet_data']] == ['Sheet1']
+        assert len(stub.uploads) == 1 and workbook in stub.uploads[0], "Expected the full workbook to be uploaded."
+        assert b'client-1' in stub.uploads[0]
+
+
+def test_get_data_reports_upload_failure():
+    with StubDMS(upload_status=500) as stub, flask_app.app.test_client() as client:
+        response = client.post('/getData', data={
+            'clientId': 'client-1',
+            'file': (io.BytesIO(create_workbook_bytes()), 'ledger.xlsx')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 502
+        assert 'disk full' in response.get_json()['error']
+        assert len(stub.uploads) == 1, "Uploads must not be retried on an error response."
+
+
+def test_get_sheet_data_retries_and_reuses_connection():
+    with StubDMS(document=create_workbook_bytes(), stream_failures=1) as stub, flask_app.app.test_client() as client:
+        query = {'clientId': 'client-1', 'filename': 'ledger.xlsx', 'currentPeriod': '6/4/2025-5/7/2025'}
+        first = client.get('/getSheetData', query_string=query)
+        second = client.get('/getSheetData', query_string=query)
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.get_json()['sheet_data'][0]['selected'] is True
+        assert len(stub.stream_calls) == 3, "Expected one retry after the 503."
+        assert stub.stream_calls[-1] == {'clientId': ['client-1'], 'filePath': ['ledger.xlsx']}
+        assert len(stub.client_ports) == 1, "Expected keep-alive to reuse a single connection."
+
+
+def test_get_sheet_data_revalidates_instead_of_downloading():
+    processed_before = flask_app.workbook_cache.stats()['sheets_processed']
+    with StubDMS(document=create_workbook_bytes(), etag='"v1"') as stub, flask_app.app.test_client() as client:
+        query = {'clientId': 'client-1', 'filename': 'ledger.xlsx', 'currentPeriod': '6/4/2025-5/7/2025'}
+        first = client.get('/getSheetData', query_string=query)
+        assert first.status_code == 200 and first.headers['ETag']
+        second = client.get('/getSheetData', query_string=query)
+        assert second.status_code == 200
+        assert second.get_json() == first.get_json()
+        assert [call.get('If-None-Match') for call in stub.conditional_headers] == [None, '"v1"']
+        unchanged = client.get('/getSheetData', query_string=query, headers={'If-None-Match': first.headers['ETag']})
+        assert unchanged.status_code == 304 and unchanged.data == b''
+        other_period = client.get('/getSheetData', query_string=dict(query, currentPeriod='1/1/2024-31/3/2024'),
+                                  headers={'If-None-Match': first.headers['ETag']})
+        assert other_period.status_code == 200
+        assert other_period.get_json()['sheet_data'][0]['selected'] is False
+        assert flask_app.workbook_cache.stats()['sheets_processed'] - processed_before == 2, "Expected one parse per period."
+
+
+if __name__ == "__main__":
+    test_spooled_upload_opens_independent_handles()
+    test_streamed_upload_finishes_after_client_disconnects()
+    test_get_data_uploads_and_parses_the_same_file()
+    test_get_data_reports_upload_failure()
+    test_get_sheet_data_retries_and_reuses_connection()
+    test_get_sheet_data_revalidates_instead_of_downloading()
+    print("All tests passed.")
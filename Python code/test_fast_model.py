@@ -0,0 +1,60 @@
+import random
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
+from fast_model import CompiledTextClassifier, compile_model, find_mismatches
+
+VOCABULARY = {
+    'Tax': ['hmrc', 'vat', 'paye', 'corp', 'tax', 'ni'],
+    'Purchases': ['amazon', 'tesco', 'screwfix', 'stock', 'supplies', 'wholesale'],
+    'Travel': ['trainline', 'uber', 'shell', 'bp', 'parking', 'tfl'],
+    'Bank': ['interest', 'charge', 'fee', 'overdraft', 'transfer', 'loan'],
+}
+
+
+def make_texts(count, seed):
+    rng = random.Random(seed)
+    texts, labels = [], []
+    for _ in range(count):
+        label = rng.choice(sorted(VOCABULARY))
+        words = rng.sample(VOCABULARY[label], 2) + rng.sample([w for ws in VOCABULARY.values() for w in ws], 1)
+        texts.append(f"{' '.join(words).upper()} {rng.randint(1, 999)}")
+        labels.append(label)
+    return texts, labels
+
+
+def test_compiled_pipelines_match_original_on_held_out_set():
+    train_texts, train_labels = make_texts(400, seed=1)
+    held_out, _ = make_texts(300, seed=2)
+    binary_labels = ['Tax' if label == 'Tax' else 'Other' for label in train_labels]
+    pipelines = [
+        (make_pipeline(TfidfVectorizer(), LogisticRegression(max_iter=500)), train_labels),
+        (make_pipeline(TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True), LinearSVC()), train_labels),
+        (make_pipeline(TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), norm='l1'), LogisticRegression(max_iter=500)), binary_labels),
+        (make_pipeline(CountVectorizer(), MultinomialNB()), train_labels),
+        (make_pipeline(CountVectorizer(binary=True), SGDClassifier(random_state=0)), binary_labels),
+    ]
+    for pipeline, labels in pipelines:
+        pipeline.fit(train_texts, labels)
+        compiled = compile_model(pipeline)
+        assert isinstance(compiled, CompiledTextClassifier), f"Expected {pipeline} to compile."
+        assert find_mismatches(compiled, pipeline, held_out) == []
+        assert find_mismatches(compiled, pipeline, ['', 'unknown words only', held_out[0]]) == []
+        assert list(compiled.predict([held_out[0]])) == list(pipeline.predict([held_out[0]]))
+
+
+def test_unsupported_pipelines_fall_back():
+    texts, labels = make_texts(100, seed=3)
+    forest = make_pipeline(TfidfVectorizer(), RandomForestClassifier(n_estimators=5, random_state=0)).fit(texts, labels)
+    assert compile_model(forest) is forest
+    plain = LogisticRegression()
+    assert compile_model(plain) is plain
+
+
+if __name__ == "__main__":
+    test_compiled_pipelines_match_original_on_held_out_set()
+    test_unsupported_pipelines_fall_back()
+    print("All tests passed.")
@@ -0,0 +1,71 @@
+import pandas as pd
+import header_templates
+from header_templates import HeaderTemplateStore, header_signature
+from sheet_processing import map_columns, match_column_mapping
+
+COLUMNS = ['Posting Date', 'Amount', 'Transaction Date', 'Details', 2024]
+
+
+class CountingResolver:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, columns):
+        self.calls += 1
+        return match_column_mapping(columns)
+
+
+def test_known_layout_skips_fuzzy_matching(tmp_path):
+    db_path = str(tmp_path / 'templates.sqlite3')
+    resolve = CountingResolver()
+    store = HeaderTemplateStore(db_path=db_path)
+    first = store.lookup('c1', COLUMNS, resolve)
+    assert store.lookup('c1', COLUMNS, resolve) == first
+    store.lookup('c2', COLUMNS, resolve)
+    store.lookup('c1', COLUMNS[::-1], resolve)
+    assert resolve.calls == 3, "Only new (client, layout) pairs should be fuzzy matched."
+    assert header_signature([2024]) != header_signature(['2024'])
+    # A restarted process finds the templates on disk
+    restarted = HeaderTemplateStore(db_path=db_path)
+    assert restarted.lookup('c1', COLUMNS, resolve) == first
+    assert resolve.calls == 3
+    stats = restarted.stats()
+    assert (stats['hits'], stats['misses'], stats['disk_hits']) == (1, 0, 1)
+    assert first['Other'] == ['Transaction Date', 2024]
+
+
+def test_changed_keywords_invalidate_templates(tmp_path):
+    db_path = str(tmp_path / 'templates.sqlite3')
+    resolve = CountingResolver()
+    HeaderTemplateStore(field_keywords={'Amount': ['amount']}, db_path=db_path).lookup('c1', COLUMNS, resolve)
+    store = HeaderTemplateStore(field_keywords={'Amount': ['amount', 'value']}, db_path=db_path)
+    store.lookup('c1', COLUMNS, resolve)
+    assert resolve.calls == 2, "Templates resolved with other keywords must not be used."
+    store.invalidate(field_keywords={'Amount': ['value']})
+    store.lookup('c1', COLUMNS, resolve)
+    assert resolve.calls == 3
+    assert store.stats()['invalidations'] == 1
+
+
+def test_map_columns_uses_client_template(tmp_path):
+    original = header_templates._shared_store
+    header_templates._shared_store = HeaderTemplateStore(db_path=str(tmp_path / 'templates.sqlite3'))
+    try:
+        df = pd.DataFrame({'Txn Date': ['2025-07-01'], 'Narration': ['Train'], 'Amount': [10]})
+        expected = map_columns(df)
+        assert map_columns(df, client_id='c1') == expected
+        assert map_columns(df, client_id='c1') == expected
+        stats = header_templates._shared_store.stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+    finally:
+        header_templates._shared_store = original
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    for test in (test_known_layout_skips_fuzzy_matching, test_changed_keywords_invalidate_templates,
+                 test_map_columns_uses_client_template):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
+    print("All tests passed.")
@@ -0,0 +1,97 @@
+import os
+import time
+from fastapi.testclient import TestClient
+import app as flask_app
+import instrumentation
+import main
+from instrumentation import begin_request, checkpoint, finish_request, metrics, stage
+from synthetic_ledger import CountingModel
+
+
+def server_timing_stages(header):
+    return {entry.split(';')[0]: float(entry.split('dur=')[1]) for entry in header.split(', ')}
+
+
+def test_stages_are_timed_and_rendered_for_prometheus():
+    timing = begin_request('/example')
+    with stage('parse'):
+        time.sleep(0.01)
+    with stage('parse'):
+        pass
+    checkpoint('validate')
+    instrumentation.count('rows', 7)
+    stages = server_timing_stages(timing.server_timing())
+    finish_request(timing, status=200)
+    assert stages['parse'] >= 10 and stages['validate'] >= stages['parse']
+    assert stages['total'] >= stages['validate']
+    rendered = metrics.render_prometheus()
+    assert 'taxmapping_stage_duration_ms_bucket{endpoint="/example",stage="parse",le="+Inf"}' in rendered
+    assert 'taxmapping_rows_total{endpoint="/example"}' in rendered
+    assert 'taxmapping_request_duration_ms_count{endpoint="/example",status="200"}' in rendered
+    assert instrumentation.current_timing() is None
+
+
+def test_flask_reports_server_timing_and_metrics():
+    original_model = flask_app.model
+    flask_app.model = CountingModel()
+    flask_app.prediction_cache.clear()
+    try:
+        with flask_app.app.test_client() as client:
+            response = client.post('/getMappedCategory', json=[{'transactionDescription': 'HMRC VAT', 'id': 1}])
+            scraped = client.get('/metrics')
+    finally:
+        flask_app.model = original_model
+    assert {'model_predict', 'jsonify', 'total'} <= set(server_timing_stages(response.headers['Server-Timing']))
+    assert scraped.mimetype == 'text/plain'
+    body = scraped.get_data(as_text=True)
+    assert 'stage="model_predict"' in body and 'endpoint="/getMappedCategory"' in body
+    assert 'taxmapping_model_batch_size_count' in body
+    assert 'taxmapping_prediction_cache_hits' in body
+
+
+def test_fastapi_predict_bulk_reports_stages():
+    original_model = main.model
+    main.model = CountingModel()
+    try:
+        with TestClient(main.app) as client:
+            response = client.post('/predict_bulk', json={'data': [{'Description': 'TRAIN FARE'}]})
+            scraped = client.get('/metrics')
+    finally:
+        main.model = original_model
+    assert response.status_code == 200
+    stages = server_timing_stages(response.headers['server-timing'])
+    assert {'validate', 'predict', 'serialize', 'total'} <= set(stages)
+    assert 'endpoint="/predict_bulk",stage="serialize"' in scraped.text
+    assert 'taxmapping_predict_batch_size_bucket' in scraped.text
+
+
+def test_slow_requests_are_profiled(tmp_path):
+    original_profiler = instrumentation.profiler
+    profiler = instrumentation.configure_profiler(threshold_ms=20, interval_ms=1, output_dir=str(tmp_path))
+    try:
+        fast = begin_request('/fast')
+        finish_request(fast, status=200)
+        slow = begin_request('/slow')
+        with stage('wait'):
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                pass
+        finish_request(slow, status=200)
+    finally:
+        instrumentation.profiler = original_profiler
+    dumps = os.listdir(str(tmp_path))
+    assert profiler.dumps == 1 and len(dumps) == 1 and '-slow-' in dumps[0]
+    with open(os.path.join(str(tmp_path), dumps[0]), encoding='utf-8') as handle:
+        folded = handle.read()
+    assert 'test_slow_requests_are_profiled (test_instrumentation.py' in folded
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    test_stages_are_timed_and_rendered_for_prometheus()
+    test_flask_reports_server_timing_and_metrics()
+    test_fastapi_predict_bulk_reports_stages()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_slow_requests_are_profiled(Path(temp_dir))
+    print("All tests passed.")
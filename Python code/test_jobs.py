@@ -0,0 +1,109 @@
+import io
+import time
+import app as flask_app
+from jobs import DONE, FAILED, JobManager, JobStore
+from test_dms_client import StubDMS, create_workbook_bytes
+
+
+def use_job_manager(tmp_path, workers=1):
+    manager = JobManager(JobStore(str(tmp_path)), flask_app.job_manager.serialize, workers=workers,
+                         poll_interval=0.1)
+    original = flask_app.job_manager
+    flask_app.job_manager = manager
+    return manager, original
+
+
+def wait_for_job(client, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] in (DONE, FAILED):
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish: {status}")
+
+
+def test_upload_job_matches_synchronous_result(tmp_path):
+    workbook = create_workbook_bytes()
+    manager, original = use_job_manager(tmp_path)
+    try:
+        with StubDMS() as dms, flask_app.app.test_client() as client:
+            submitted = client.post('/jobs/getData', data={'clientId': 'c1', 'file': (io.BytesIO(workbook), 'ledger.xlsx')},
+                                    content_type='multipart/form-data')
+            assert submitted.status_code == 202
+            job_id = submitted.get_json()['jobId']
+            status = wait_for_job(client, job_id)
+            result = client.get(f'/jobs/{job_id}/result')
+            expected = client.post('/getData', data={'clientId': 'c1', 'file': (io.BytesIO(workbook), 'ledger.xlsx')},
+                                   content_type='multipart/form-data')
+        assert status['status'] == DONE and status['sheetsDone'] == status['sheetsTotal'] == 1
+        assert result.status_code == 200 and result.get_json() == expected.get_json()
+        assert len(dms.uploads) == 2
+        assert manager.stats()['completed'] == 1
+    finally:
+        manager.shutdown()
+        flask_app.job_manager = original
+
+
+def test_failed_document_job_reports_error(tmp_path):
+    manager, original = use_job_manager(tmp_path)
+    try:
+        with StubDMS(stream_failures=10) as dms, flask_app.app.test_client() as client:
+            submitted = client.post('/jobs/getSheetData?clientId=c1&filename=missing.xlsx&currentPeriod=1/4/2025-30/6/2025')
+            job_id = submitted.get_json()['jobId']
+            status = wait_for_job(client, job_id)
+            result = client.get(f'/jobs/{job_id}/result')
+        assert status['status'] == FAILED and 'Failed to fetch file' in status['error']
+        assert result.status_code == 500
+        assert client.get('/jobs/unknown').status_code == 404
+    finally:
+        manager.shutdown()
+        flask_app.job_manager = original
+
+
+def test_expired_jobs_are_cleaned_up(tmp_path):
+    store = JobStore(str(tmp_path), ttl=60)
+    job_id = store.create('upload', 'c1', 'ledger.xlsx')
+    store.finish(job_id, b'{"sheet_data": []}')
+    open(store.input_path(job_id, 'ledger.xlsx'), 'wb').close()
+    assert store.cleanup() == 0 and store.get(job_id)['status'] == DONE
+    assert store.cleanup(now=time.time() + 120) == 1
+    assert store.get(job_id) is None and store.read_result(job_id) is None
+    assert not list((tmp_path / 'inputs').iterdir())
+
+
+def test_claims_are_bounded_across_managers(tmp_path):
+    store = JobStore(str(tmp_path))
+    first = store.create('document', 'c1', 'a.xlsx', params=[('dms', 'c1', 'a.xlsx'), None, None])
+    store.create('document', 'c1', 'b.xlsx', params=[('dms', 'c1', 'b.xlsx'), None, None])
+    assert store.claim('web-1', limit=1) == (first, [['dms', 'c1', 'a.xlsx'], None, None])
+    assert store.claim('web-2', limit=1) is None, "Only one job may run at once, whichever worker claims it."
+    assert store.counts() == {'queued': 1, 'running': 1}
+
+
+def test_jobs_of_a_dead_worker_are_requeued_then_failed(tmp_path):
+    store = JobStore(str(tmp_path))
+    document = store.create('document', 'c1', 'a.xlsx', params=[('dms', 'c1', 'a.xlsx'), None, None])
+    upload = store.create('upload', 'c1', 'b.xlsx', params=[('upload', store.input_path('gone', 'b.xlsx'), 'c1',
+                                                               'b.xlsx', None), None, None])
+    store.heartbeat('web-1')
+    store.claim('web-1', limit=2)
+    store.claim('web-1', limit=2)
+    assert store.recover_orphans(timeout=60) == (0, 0), "The owner is alive."
+    assert store.recover_orphans(timeout=60, now=time.time() + 120) == (1, 1)
+    assert store.get(document)['status'] == 'queued'
+    assert store.get(upload)['status'] == FAILED, "An upload whose file is gone cannot run again."
+    store.claim('web-2', limit=2)
+    assert store.recover_orphans(timeout=60, max_attempts=2) == (0, 1)
+    assert store.get(document)['status'] == FAILED and 'stopped' in store.get(document)['error']
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    for test in (test_upload_job_matches_synchronous_result, test_failed_document_job_reports_error,
+                 test_expired_jobs_are_cleaned_up, test_claims_are_bounded_across_managers,
+                 test_jobs_of_a_dead_worker_are_requeued_then_failed):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
+    print("All tests passed.")
@@ -0,0 +1,61 @@
+import datetime
+import json
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import main
+from json_serialization import FastJSONProvider, dumps
+from synthetic_ledger import CountingModel
+
+
+def test_flask_output_matches_default_provider():
+    app = Flask(__name__)
+    payload = {
+        'sheet_data': [{
+            'sheet_name': 'Ledger',
+            'column_mapping': {'Date': 'Txn Date', 'Amount': 'Amount', 'Other': [2024]},
+            'mapped_data': [
+                {'Date': pd.Timestamp('2025-07-01'), 'Amount': 10.5, 'Description': 'Café'},
+                {'Date': datetime.datetime(2025, 7, 2, 13, 5, tzinfo=datetime.timezone.utc), 'Amount': None},
+                {'Date': datetime.date(2025, 7, 3), 'Amount': 7}
+            ],
+            'selected': True,
+            'min_date': pd.Timestamp('2025-07-01'),
+        }]
+    }
+    with app.app_context():
+        expected = DefaultJSONProvider(app).response(payload)
+        fast = FastJSONProvider(app).response(payload)
+    assert fast.mimetype == expected.mimetype
+    assert json.loads(fast.get_data()) == json.loads(expected.get_data())
+    assert b'"Tue, 01 Jul 2025 00:00:00 GMT"' in fast.get_data()
+
+
+def test_missing_values_are_null():
+    encoded = dumps({'a': float('nan'), 'b': np.float64('nan'), 'c': pd.NaT, 'd': pd.NA, 'e': np.float32(1.5)})
+    assert json.loads(encoded) == {'a': None, 'b': None, 'c': None, 'd': None, 'e': 1.5}
+    assert dumps({'d': pd.Timestamp('2025-07-01 10:30')}) == b'{"d":"2025-07-01T10:30:00"}'
+
+
+def test_predict_bulk_response_is_valid_json_without_revalidation():
+    original = main.model
+    main.model = CountingModel()
+    try:
+        with TestClient(main.app) as client:
+            response = client.post('/predict_bulk', content=b'{"data": [{"Description": "TRAIN", "Amount": NaN}]}',
+                                   headers={'Content-Type': 'application/json'})
+    finally:
+        main.model = original
+    assert response.status_code == 200
+    body = json.loads(response.content)
+    assert list(body) == ['data', 'processed_count', 'success_count', 'error_count', 'errors']
+    assert body['data'] == [{'Description': 'TRAIN', 'Amount': None, 'category_mapped': 'Travel'}]
+
+
+if __name__ == "__main__":
+    test_flask_output_matches_default_provider()
+    test_missing_values_are_null()
+    test_predict_bulk_response_is_valid_json_without_revalidation()
+    print("All tests passed.")
@@ -0,0 +1,41 @@
+import requests
+from loadtest import StubDMSServer, parse_mix, percentile, run_loadtest, workbook_files
+
+
+def test_percentiles_and_mix_parsing():
+    values = sorted(range(1, 101))
+    assert (percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)) == (50, 95, 99)
+    assert percentile([], 0.5) is None
+    assert parse_mix('predict=3, bulk=1,upload=0') == {'predict': 3.0, 'bulk': 1.0}
+
+
+def test_stub_dms_serves_uploads_with_etags():
+    name = workbook_files()[0]
+    with StubDMSServer() as dms:
+        url = f'{dms.url}/api/Document/stream'
+        first = requests.get(url, params={'clientId': 'c1', 'filePath': name})
+        assert first.status_code == 200 and first.content[:2] == b'PK'
+        again = requests.get(url, params={'clientId': 'c1', 'filePath': name}, headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+        assert requests.get(url, params={'clientId': 'c1', 'filePath': 'missing.xlsx'}).status_code == 404
+        upload = requests.post(f'{dms.url}/api/Document/upload', data={'clientId': 'c1'}, files={'file': (name, first.content)})
+        assert upload.status_code == 200
+    assert (dms.streams, dms.not_modified, dms.uploads) == (2, 1, 1)
+
+
+def test_short_run_drives_both_apps():
+    report = run_loadtest('predict=1,bulk=1,mapped=1,upload=1,sheet=1', concurrency=2, duration=3,
+                          bulk_size=20, mapped_size=20, rss_interval=0.5)
+    for name in ('predict', 'bulk', 'mapped', 'upload', 'sheet', 'all'):
+        row = report['requests'][name]
+        assert row['count'] > 0 and row['error_rate'] == 0.0, (name, row)
+        assert row['p50_ms'] <= row['p95_ms'] <= row['p99_ms'] <= row['max_ms']
+    assert report['rss_peak_mb']['flask'] > 0 and report['rss_peak_mb']['fastapi'] > 0
+    assert report['dms']['uploads'] == report['requests']['upload']['count']
+
+
+if __name__ == "__main__":
+    test_percentiles_and_mix_parsing()
+    test_stub_dms_serves_uploads_with_etags()
+    test_short_run_drives_both_apps()
+    print("All tests passed.")
@@ -0,0 +1,58 @@
+import app as flask_app
+from synthetic_ledger import CountingModel
+
+
+def post_mapped_category(stub, payload):
+    original_model = flask_app.model
+    flask_app.model = stub
+    try:
+        with flask_app.app.test_client() as client:
+            return client.post('/getMappedCategory', json=payload)
+    finally:
+        flask_app.model = original_model
+
+
+def test_mapped_category_predicts_each_description_once():
+    stub = CountingModel()
+    payload = [
+        {'transactionDescription': 'DIRECT DEBIT HMRC', 'id': 1},
+        {'transactionDescription': 'AMAZON MKTPLACE', 'id': 2},
+        {'transactionDescription': 'DIRECT DEBIT HMRC', 'id': 3},
+        {'transactionDescription': 'AMAZON MKTPLACE', 'id': 4},
+    ]
+    response = post_mapped_category(stub, payload)
+    assert response.status_code == 200
+    assert stub.calls == [['DIRECT DEBIT HMRC', 'AMAZON MKTPLACE']], "Expected one vectorized call over unique descriptions."
+    assert [(item['id'], item['taxCategories']) for item in response.get_json()] == [
+        (1, 'Tax'), (2, 'Office costs'), (3, 'Tax'), (4, 'Office costs')
+    ]
+    assert response.headers['X-Unique-Descriptions'] == '2'
+
+
+def test_mapped_category_validates_before_predicting():
+    stub = CountingModel()
+    payload = [
+        {'transactionDescription': 'DIRECT DEBIT HMRC', 'id': 1},
+        {'id': 2},
+    ]
+    response = post_mapped_category(stub, payload)
+    assert response.status_code == 400
+    assert stub.calls == [], "No predictions should run for a malformed request."
+
+
+def test_mapped_category_flags_only_failing_descriptions():
+    stub = CountingModel(fail_on='BAD ROW')
+    payload = [
+        {'transactionDescription': 'BAD ROW', 'id': 1},
+        {'transactionDescription': 'DIRECT DEBIT HMRC', 'id': 2},
+    ]
+    response = post_mapped_category(stub, payload)
+    body = response.get_json()
+    assert body[0]['taxCategories'] is None and body[0]['error'] == "Prediction failed: cannot classify 'BAD ROW'"
+    assert body[1]['taxCategories'] == 'Tax' and 'error' not in body[1]
+
+
+if __name__ == "__main__":
+    test_mapped_category_predicts_each_description_once()
+    test_mapped_category_validates_before_predicting()
+    test_mapped_category_flags_only_failing_descriptions()
@@ -0,0 +1,83 @@
+import asyncio
+from micro_batcher import MicroBatcher
+from synthetic_ledger import CountingModel
+
+
+def test_concurrent_requests_share_one_predict_call():
+    model = CountingModel(rule=str.upper)
+    batcher = MicroBatcher(model.predict, max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit(f'item {i}') for i in range(5)))
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(run()) == [f'ITEM {i}' for i in range(5)]
+    assert model.calls == [[f'item {i}' for i in range(5)]]
+    stats = batcher.stats()
+    assert stats['batch_size']['count'] == 1 and stats['batch_size']['max'] == 5
+    assert stats['queue_wait_ms']['count'] == 5
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = CountingModel()
+    batcher = MicroBatcher(model.predict, max_batch_size=2, max_wait_ms=50)
+
+    async def run():
+        await asyncio.gather(*(batcher.submit(str(i)) for i in range(5)))
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert [len(call) for call in model.calls] == [2, 2, 1]
+
+
+def test_batch_errors_reach_every_caller():
+    def failing_predict(texts):
+        raise ValueError('model exploded')
+
+    batcher = MicroBatcher(failing_predict, max_batch_size=4, max_wait_ms=10)
+
+    async def run():
+        results = await asyncio.gather(batcher.submit('a'), batcher.submit('b'), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert batcher.stats()['failed_batches'] == 1
+
+
+def test_failing_text_only_fails_its_own_caller():
+    model = CountingModel(rule=str.upper, fail_on='bad')
+    batcher = MicroBatcher(model.predict, max_batch_size=4, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(batcher.submit('a'), batcher.submit('bad'), batcher.submit('c'),
+                                       return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    first, failed, last = asyncio.run(run())
+    assert (first, last) == ('A', 'C') and isinstance(failed, ValueError)
+    assert model.calls == [['a', 'bad', 'c'], ['a'], ['bad'], ['c']]
+    assert batcher.stats()['failed_batches'] == 1 and batcher.stats()['failed_items'] == 1
+
+
+def test_missing_predictions_fail_the_callers_left_over():
+    batcher = MicroBatcher(lambda texts: texts[:1], max_batch_size=4, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(batcher.submit('a'), batcher.submit('b'), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    first, second = asyncio.run(run())
+    assert first == 'a' and isinstance(second, RuntimeError)
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_one_predict_call()
+    test_batches_are_capped_at_max_batch_size()
+    test_batch_errors_reach_every_caller()
+    test_failing_text_only_fails_its_own_caller()
+    test_missing_predictions_fail_the_callers_left_over()
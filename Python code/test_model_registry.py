@@ -0,0 +1,112 @@
+import os
+import time
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+import app as flask_app
+from model_registry import ModelRegistry, find_latest_artifact
+from test_fast_model import make_texts
+
+
+def write_artifact(model_dir, version, age=60, labels_suffix=''):
+    texts, labels = make_texts(200, seed=1)
+    pipeline = make_pipeline(TfidfVectorizer(), LogisticRegression(max_iter=500))
+    pipeline.fit(texts, [label + labels_suffix for label in labels])
+    path = os.path.join(model_dir, f'ultra_high_accuracy_classifier-{version}.joblib')
+    joblib.dump(pipeline, path)
+    written = time.time() - age
+    os.utime(path, (written, written))
+    return path
+
+
+class CountingLoader:
+    def __init__(self):
+        self.paths = []
+
+    def __call__(self, path):
+        self.paths.append(os.path.basename(path))
+        return joblib.load(path)
+
+
+def test_registry_swaps_in_newer_warmed_artifact(tmp_path):
+    model_dir = str(tmp_path)
+    loader = CountingLoader()
+    registry = ModelRegistry(model_dir, poll_interval=0, settle_seconds=1, loader=loader)
+    swaps = []
+
+    def record_swap(entry):
+        swaps.append(entry.version)
+
+    registry.add_listener(record_swap)
+    registry.add_listener(record_swap)  # e.g. a second app startup in the same process
+    assert registry.check() is False and registry.model is None
+    write_artifact(model_dir, 'v1', age=120)
+    assert registry.check() is True
+    old_model = registry.model
+    assert registry.version == 'v1' and registry.current.warmup_ms > 0
+    assert registry.check() is False, "An unchanged artifact must not be reloaded."
+    write_artifact(model_dir, 'v2', age=60, labels_suffix=' (v2)')
+    # An artifact still being written is left alone until it settles
+    write_artifact(model_dir, 'v3', age=0)
+    assert registry.check() is True
+    assert swaps == ['v1', 'v2']
+    assert loader.paths == ['ultra_high_accuracy_classifier-v1.joblib', 'ultra_high_accuracy_classifier-v2.joblib']
+    # A request that picked up the old model before the swap still completes with it
+    assert list(old_model.predict(['HMRC VAT'])) == ['Tax']
+    assert registry.version_of(old_model) == 'v1'
+    assert list(registry.model.predict(['HMRC VAT'])) == ['Tax (v2)']
+
+
+def test_broken_artifact_keeps_current_model(tmp_path):
+    model_dir = str(tmp_path)
+    registry = ModelRegistry(model_dir, poll_interval=0, settle_seconds=0)
+    write_artifact(model_dir, 'v1', age=120)
+    registry.check()
+    broken = os.path.join(model_dir, 'ultra_high_accuracy_classifier-v2.joblib')
+    with open(broken, 'wb') as handle:
+        handle.write(b'not a model')
+    assert registry.check() is False
+    assert registry.version == 'v1' and registry.failures == 1
+    assert registry.check() is False and registry.failures == 1, "A failed artifact is not retried until it changes."
+
+
+def test_latest_artifact_prefers_slim_form_of_newest_version(tmp_path):
+    model_dir = str(tmp_path)
+    write_artifact(model_dir, 'v1', age=120)
+    write_artifact(model_dir, 'v2', age=60)
+    slim_dir = os.path.join(model_dir, 'ultra_high_accuracy_classifier-v2.slim')
+    os.makedirs(slim_dir)
+    with open(os.path.join(slim_dir, 'meta.json'), 'w') as handle:
+        handle.write('{}')
+    written = time.time() - 60
+    os.utime(os.path.join(slim_dir, 'meta.json'), (written, written))
+    assert find_latest_artifact(model_dir, settle_seconds=1) == ('v2', slim_dir)
+
+
+def test_flask_responses_report_model_version(tmp_path):
+    registry = ModelRegistry(str(tmp_path), poll_interval=0, settle_seconds=0)
+    write_artifact(str(tmp_path), 'v7')
+    original_registry, original_model = flask_app.model_registry, flask_app.model
+    flask_app.model_registry = registry
+    registry.add_listener(flask_app.use_model)
+    try:
+        registry.check()
+        with flask_app.app.test_client() as client:
+            response = client.post('/getMappedCategory', json=[{'transactionDescription': 'HMRC VAT', 'id': 1}])
+            info = client.get('/modelInfo').get_json()
+        assert response.headers['X-Model-Version'] == 'v7'
+        assert response.get_json()[0]['taxCategories'] == 'Tax'
+        assert info['serving']['version'] == 'v7'
+    finally:
+        flask_app.model_registry, flask_app.model = original_registry, original_model
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    for test in (test_registry_swaps_in_newer_warmed_artifact, test_broken_artifact_keeps_current_model,
+                 test_latest_artifact_prefers_slim_form_of_newest_version, test_flask_responses_report_model_version):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
+    print("All tests passed.")
@@ -0,0 +1,82 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import joblib
+import numpy as np
+import requests
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+import model_store
+
+TEXTS = ['DIRECT DEBIT HMRC VAT', 'HMRC PAYE', 'AMAZON MKTPLACE', 'TESCO STORES', 'HMRC CORP TAX', 'AMAZON PRIME']
+LABELS = ['Tax', 'Tax', 'Purchases', 'Purchases', 'Tax', 'Purchases']
+
+
+def train_model():
+    return make_pipeline(TfidfVectorizer(), LogisticRegression()).fit(TEXTS, LABELS)
+
+
+def test_mmap_artifact_is_memory_mapped(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    mmap_path = tmp_path / 'model.mmap.joblib'
+    joblib.dump(train_model(), model_path, compress=3)
+    assert not isinstance(model_store.load_model(model_path, mmap_path).steps[-1][1].coef_, np.memmap)
+    model_store.export_mmap_artifact(model_path, mmap_path)
+    model = model_store.load_model(model_path, mmap_path)
+    assert isinstance(model.steps[-1][1].coef_, np.memmap), "Expected coefficients mapped from the artifact."
+    assert list(model.predict(TEXTS)) == LABELS
+    assert not isinstance(model_store.load_model(model_path, mmap_path, mmap=False).steps[-1][1].coef_, np.memmap)
+
+
+def test_stale_mmap_artifact_is_ignored(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    mmap_path = tmp_path / 'model.mmap.joblib'
+    joblib.dump(train_model(), model_path)
+    model_store.export_mmap_artifact(model_path, mmap_path)
+    later = os.path.getmtime(mmap_path) + 10
+    os.utime(model_path, (later, later))
+    assert not isinstance(model_store.load_model(model_path, mmap_path).steps[-1][1].coef_, np.memmap)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_serve_forks_workers_on_one_socket():
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--app', 'flask', '--workers', '2', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                response = requests.get(f'http://127.0.0.1:{port}/cacheStats', timeout=2)
+                break
+            except requests.ConnectionError:
+                assert server.poll() is None and time.time() < deadline, "Server did not start."
+                time.sleep(0.2)
+        assert response.status_code == 200
+        workers = subprocess.run(['pgrep', '-P', str(server.pid)], capture_output=True, text=True).stdout.split()
+        assert len(workers) == 2
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_mmap_artifact_is_memory_mapped(Path(temp_dir))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        test_stale_mmap_artifact_is_ignored(Path(temp_dir))
+    test_serve_forks_workers_on_one_socket()
+    print("All tests passed.")
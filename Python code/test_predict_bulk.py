@@ -0,0 +1,72 @@
+import json
+import main
+from main import BulkPredictionRequest, BulkPredictionResponse, predict_bulk_categories, stream_bulk_predictions
+from synthetic_ledger import CountingModel
+
+
+def run_bulk(stub, data, **kwargs):
+    original_model = main.model
+    main.model = stub
+    try:
+        response = predict_bulk_categories(BulkPredictionRequest(data=data, **kwargs))
+        return BulkPredictionResponse(**json.loads(response.body))
+    finally:
+        main.model = original_model
+
+
+def test_predict_bulk_uses_chunked_model_calls():
+    stub = CountingModel()
+    data = [{'Description': f'Train ticket {i}'} for i in range(5)] + [{'Description': 'Printer paper'}]
+    response = run_bulk(stub, data, chunk_size=4)
+    assert [len(call) for call in stub.calls] == [4, 2], "Predictions should be made in chunks, not per record."
+    assert [record['category_mapped'] for record in response.data] == ['Travel'] * 5 + ['Office costs']
+    assert response.success_count == 6 and response.error_count == 0
+
+
+def test_predict_bulk_reports_errors_per_record():
+    stub = CountingModel()
+    data = [
+        {'description': 'Train to Leeds'},
+        {'Amount': 10},
+        {'Description': '   '},
+        {'DESC': 'Stationery'},
+    ]
+    response = run_bulk(stub, data)
+    assert stub.calls == [['Train to Leeds', 'Stationery']]
+    assert [record['category_mapped'] for record in response.data] == ['Travel', None, None, 'Office costs']
+    assert [error['index'] for error in response.errors] == [1, 2]
+    assert response.errors[0]['error'].startswith("Description column 'Description' not found in record.")
+    assert response.errors[1]['error'] == 'Description is empty or whitespace'
+    assert response.processed_count == 4 and response.success_count == 2 and response.error_count == 2
+
+
+def test_predict_bulk_isolates_failing_record_in_chunk():
+    stub = CountingModel(fail_on='BROKEN')
+    data = [{'Description': 'Train fare'}, {'Description': 'BROKEN row'}, {'Description': 'Pens'}]
+    response = run_bulk(stub, data)
+    assert [record['category_mapped'] for record in response.data] == ['Travel', None, 'Office costs']
+    assert response.errors == [{'index': 1, 'error': "Prediction failed: cannot classify 'BROKEN'"}]
+
+
+def test_predict_bulk_streams_batches_and_summary():
+    stub = CountingModel()
+    data = [{'Description': 'Train fare'}, {'Amount': 5}, {'Description': 'Pens'}]
+    original_model = main.model
+    main.model = stub
+    try:
+        lines = list(stream_bulk_predictions(BulkPredictionRequest(data=data, chunk_size=2)))
+    finally:
+        main.model = original_model
+    records = [json.loads(line) for line in lines]
+    assert [record['type'] for record in records] == ['batch', 'batch', 'summary']
+    assert [row['category_mapped'] for row in records[0]['data']] == ['Travel', None]
+    assert records[1]['data'] == [{'Description': 'Pens', 'category_mapped': 'Office costs'}]
+    assert records[2]['processed_count'] == 3 and records[2]['success_count'] == 2
+    assert [error['index'] for error in records[2]['errors']] == [1]
+
+
+if __name__ == "__main__":
+    test_predict_bulk_uses_chunked_model_calls()
+    test_predict_bulk_reports_errors_per_record()
+    test_predict_bulk_isolates_failing_record_in_chunk()
+    test_predict_bulk_streams_batches_and_summary()
@@ -0,0 +1,86 @@
+import os
+import time
+from prediction_cache import LRUCache, PredictionCache
+from synthetic_ledger import CountingModel
+
+
+def write_model_file(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None, "'b' was least recently used and should be evicted."
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 1)
+
+
+def test_lru_cache_expires_entries_after_ttl():
+    cache = LRUCache(max_size=10, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_prediction_cache_predicts_each_normalized_description_once(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    write_model_file(model_path, b'v1')
+    cache = PredictionCache(str(model_path))
+    model = CountingModel()
+    assert cache.predict(model, ['AMAZON  MKTPLACE', 'amazon mktplace']) == ['Office costs', 'Office costs']
+    assert cache.predict(model, [' AMAZON MKTPLACE ']) == ['Office costs']
+    assert model.calls == [['AMAZON  MKTPLACE', 'amazon mktplace']], "The model sees the text as sent."
+
+
+def test_prediction_cache_invalidates_when_model_file_changes(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    write_model_file(model_path, b'v1')
+    cache = PredictionCache(str(model_path))
+    model = CountingModel()
+    cache.predict(model, ['DIRECT DEBIT HMRC'])
+    write_model_file(model_path, b'version 2')
+    os.utime(model_path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    cache.predict(model, ['DIRECT DEBIT HMRC'])
+    assert len(model.calls) == 2, "A replaced model file should invalidate cached predictions."
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_prediction_cache_disk_store_survives_restart(tmp_path):
+    model_path = tmp_path / 'model.joblib'
+    write_model_file(model_path, b'v1')
+    db_path = str(tmp_path / 'predictions.sqlite')
+    model = CountingModel()
+    PredictionCache(str(model_path), db_path=db_path).predict(model, ['DIRECT DEBIT HMRC'])
+    restarted = PredictionCache(str(model_path), db_path=db_path)
+    assert restarted.predict(model, ['DIRECT DEBIT HMRC']) == ['Tax']
+    assert len(model.calls) == 1 and restarted.stats()['disk_hits'] == 1
+    many = [f'PAYEE {n}' for n in range(1200)]
+    restarted.predict(model, many)
+    assert PredictionCache(str(model_path), db_path=db_path).predict(model, many + ['TRAIN']) == ['Office costs'] * 1200 + ['Travel']
+    assert model.calls[-1] == ['TRAIN'], "Lookups larger than one sqlite query must all be found."
+
+
+def test_prediction_cache_keeps_versions_apart_during_a_swap(tmp_path):
+    old, new = CountingModel(rule=lambda text: 'OLD'), CountingModel(rule=lambda text: 'NEW')
+    versions = {id(old): 'v1', id(new): 'v2'}
+    db_path = str(tmp_path / 'predictions.sqlite')
+    cache = PredictionCache(str(tmp_path / 'missing.joblib'), db_path=db_path,
+                            version_fn=lambda model: versions[id(model)])
+    assert cache.predict(old, ['TRAIN']) == ['OLD']
+    assert cache.predict(new, ['TRAIN']) == ['NEW']
+    # A request that started on the old model finishes after the swap
+    assert cache.predict(old, ['TRAIN', 'TAXI']) == ['OLD', 'OLD']
+    assert cache.predict(new, ['TRAIN', 'TAXI']) == ['NEW', 'NEW']
+    assert new.calls == [['TRAIN'], ['TAXI']]
+    stats = cache.stats()
+    assert stats['invalidations'] == 1 and stats['model_version'] == 'v2'
+    restarted = PredictionCache(str(tmp_path / 'missing.joblib'), db_path=db_path,
+                                version_fn=lambda model: versions[id(model)])
+    assert restarted.predict(new, ['TRAIN', 'TAXI']) == ['NEW', 'NEW']
+    assert restarted.stats()['disk_hits'] == 2, "The old model must not delete the new version's rows."
@@ -0,0 +1,59 @@
+import io
+from fastapi.testclient import TestClient
+import app as flask_app
+import main
+import service
+from synthetic_ledger import CountingModel
+from test_dms_client import StubDMS, create_workbook_bytes
+
+
+def use_model(stub):
+    originals = (flask_app.model, main.model)
+    flask_app.model = main.model = stub
+    return originals
+
+
+def test_one_app_serves_both_apis_from_one_cache():
+    stub = CountingModel()
+    originals = use_model(stub)
+    main.prediction_cache.clear()
+    try:
+        with TestClient(service.app) as client:
+            mapped = client.post('/getMappedCategory', json=[{'transactionDescription': 'TRAIN FARE', 'id': 1}])
+            single = client.post('/predict', json={'description': 'TRAIN FARE'})
+            bulk = client.post('/predict_bulk', json={'data': [{'Description': 'TRAIN FARE'}, {'Description': 'PAPER'}]})
+            scraped = client.get('/metrics').text
+            missing = client.get('/noSuchRoute')
+    finally:
+        flask_app.model, main.model = originals
+    assert flask_app.prediction_cache is main.prediction_cache
+    assert mapped.status_code == 200 and mapped.json()[0]['taxCategories'] == 'Travel'
+    assert mapped.headers['X-Unique-Descriptions'] == '1'
+    assert single.json() == {'category': 'Travel'}
+    assert [record['category_mapped'] for record in bulk.json()['data']] == ['Travel', 'Office costs']
+    assert stub.calls == [['TRAIN FARE'], ['PAPER']], "Later calls should be served from the shared cache."
+    assert 'endpoint="/getMappedCategory"' in scraped and 'endpoint="/predict_bulk"' in scraped
+    assert missing.status_code == 404
+
+
+def test_flask_routes_stay_compatible():
+    workbook = create_workbook_bytes()
+    with StubDMS(document=workbook) as dms, TestClient(service.app) as client:
+        uploaded = client.post('/getData', data={'clientId': 'c1'}, files={'file': ('ledger.xlsx', io.BytesIO(workbook))})
+        fetched = client.get('/getSheetData', params={'clientId': 'c1', 'filename': 'ledger.xlsx',
+                                                        'currentPeriod': '1/4/2025-30/6/2025'})
+        preflight = client.options('/getMappedCategory', headers={'Origin': 'http://localhost:8501',
+                                                                  'Access-Control-Request-Method': 'POST'})
+    assert uploaded.status_code == 200 and len(dms.uploads) == 1
+    assert fetched.status_code == 200 and fetched.headers['ETag']
+    assert uploaded.json() == fetched.json()
+    assert uploaded.json()['sheet_data'][0]['sheet_name'] == 'Sheet1'
+    assert 'excel_parse' in uploaded.headers['Server-Timing']
+    assert preflight.status_code == 200
+    assert len(uploaded.headers.get_list('access-control-allow-origin')) <= 1
+
+
+if __name__ == "__main__":
+    test_one_app_serves_both_apis_from_one_cache()
+    test_flask_routes_stay_compatible()
+    print("All tests passed.")
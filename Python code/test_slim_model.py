@@ -0,0 +1,82 @@
+import os
+import time
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import make_pipeline
+import model_store
+from slim_model import SlimTextClassifier, compare_models, slim_pipeline
+from test_fast_model import make_texts
+
+
+def save_pipeline(tmp_path, pipeline):
+    texts, labels = make_texts(400, seed=1)
+    model_path = str(tmp_path / 'model.joblib')
+    joblib.dump(pipeline.fit(texts, labels), model_path, compress=3)
+    return model_path
+
+
+def test_slim_artifact_agrees_with_original(tmp_path):
+    held_out, labels = make_texts(300, seed=2)
+    for pipeline in (make_pipeline(TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True), LogisticRegression(max_iter=500)),
+                     make_pipeline(CountVectorizer(), MultinomialNB())):
+        model_path = save_pipeline(tmp_path, pipeline)
+        slim_path = str(tmp_path / 'model.slim')
+        meta = slim_pipeline(model_path, slim_path, min_weight=0.0)
+        slim = SlimTextClassifier(slim_path)
+        assert isinstance(slim.weights, np.memmap) and slim.weights.dtype == np.float32
+        assert slim.vocabulary.dtype.kind == 'S'
+        assert meta['vocabulary_size'] == meta['original_vocabulary_size']
+        original = joblib.load(model_path)
+        assert list(slim.predict(held_out)) == list(original.predict(held_out))
+        assert [slim.predict([text])[0] for text in held_out[:50]] == list(original.predict(held_out[:50]))
+        assert list(slim.predict(['', 'x' * 500])) == list(original.predict(['', 'x' * 500]))
+        report = compare_models(model_path, slim_path, held_out, labels)
+        assert report['agreement'] == 1.0
+        assert report['slim_accuracy'] == report['original_accuracy']
+
+
+def test_near_zero_terms_are_pruned(tmp_path):
+    model_path = save_pipeline(tmp_path, make_pipeline(TfidfVectorizer(), LogisticRegression(max_iter=500)))
+    slim_path = str(tmp_path / 'model.slim')
+    meta = slim_pipeline(model_path, slim_path, min_weight=0.5)
+    assert 0 < meta['vocabulary_size'] < meta['original_vocabulary_size']
+    report = compare_models(model_path, slim_path, make_texts(300, seed=2)[0])
+    assert report['vocabulary_size'] == meta['vocabulary_size']
+    assert report['agreement'] > 0.9
+    # Dropped terms still count in the norm, so kept features keep their tf-idf values
+    assert meta['norm_vocabulary_size'] == meta['original_vocabulary_size'] - meta['vocabulary_size']
+    slim = SlimTextClassifier(slim_path)
+    vectorizer = joblib.load(model_path).steps[0][1]
+    columns = [vectorizer.vocabulary_[term.decode('utf-8')] for term in slim.vocabulary]
+    texts = make_texts(50, seed=3)[0]
+    expected = vectorizer.transform(texts)[:, columns].toarray()
+    assert np.allclose(slim._batch_matrix(texts).toarray(), expected, atol=1e-6)
+    for text, row in zip(texts[:10], expected):
+        indexes, values = slim._features(text)
+        assert np.allclose(values, row[indexes], atol=1e-6) and np.count_nonzero(row) == len(indexes)
+
+
+def test_model_store_prefers_current_slim_artifact(tmp_path):
+    model_path = save_pipeline(tmp_path, make_pipeline(TfidfVectorizer(), LogisticRegression(max_iter=500)))
+    slim_path = str(tmp_path / 'model.slim')
+    mmap_path = str(tmp_path / 'model.mmap.joblib')
+    assert model_store.active_model_path(model_path, mmap_path, True, slim_path, True) == model_path
+    slim_pipeline(model_path, slim_path, min_weight=0.0)
+    assert isinstance(model_store.load_model(model_path, mmap_path, True, slim_path, True), SlimTextClassifier)
+    assert not isinstance(model_store.load_model(model_path, mmap_path, True, slim_path, False), SlimTextClassifier)
+    later = time.time() + 10
+    os.utime(model_path, (later, later))
+    assert model_store.active_model_path(model_path, mmap_path, True, slim_path, True) == model_path
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+    for test in (test_slim_artifact_agrees_with_original, test_near_zero_terms_are_pruned,
+                 test_model_store_prefers_current_slim_artifact):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test(Path(temp_dir))
+    print("All tests passed.")
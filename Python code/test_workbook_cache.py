@@ -0,0 +1,91 @@
+import io
+import pandas as pd
+from workbook_cache import WorkbookResultCache, period_key, result_size, sheet_fingerprints
+
+
+def create_workbook(sheets):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    output.seek(0)
+    return output
+
+
+def ledger(descriptions):
+    return pd.DataFrame({
+        'Amount': [10.0] * len(descriptions),
+        'Date': ['10/04/2025'] * len(descriptions),
+        'Description': descriptions
+    })
+
+
+def test_repeated_workbook_is_served_from_cache():
+    cache = WorkbookResultCache()
+    # One set of bytes: the workbook's properties record when it was written
+    workbook = create_workbook({'Bank': ledger(['HMRC', 'AMAZON'])}).getvalue()
+    first, first_hash = cache.categorize(io.BytesIO(workbook))
+    second, second_hash = cache.categorize(io.BytesIO(workbook))
+    assert first_hash == second_hash
+    assert second is first, "Expected the cached result for identical content."
+    assert cache.sheets_processed == 1
+    assert cache.workbooks.hits == 1
+
+
+def test_only_changed_sheet_is_reprocessed():
+    cache = WorkbookResultCache()
+    cache.categorize(create_workbook({'Bank': ledger(['HMRC']), 'Card': ledger(['TESCO']), 'Blank': pd.DataFrame()}))
+    result, _ = cache.categorize(create_workbook({'Bank': ledger(['HMRC', 'NEW PAYEE']), 'Card': ledger(['TESCO']), 'Blank': pd.DataFrame()}))
+    assert cache.sheets_processed == 4, "Expected only the edited sheet to be processed again."
+    assert cache.sheets_reused == 2
+    assert [sheet['sheet_name'] for sheet in result['sheet_data']] == ['Bank', 'Card']
+    assert [row['Description'] for row in result['sheet_data'][0]['mapped_data']] == ['HMRC', 'NEW PAYEE']
+
+
+def test_fingerprints_ignore_shared_string_positions():
+    # New strings on the first sheet shift the shared-string indexes used by the second
+    before = sheet_fingerprints(create_workbook({'Bank': ledger(['HMRC']), 'Card': ledger(['TESCO'])}))
+    after = sheet_fingerprints(create_workbook({'Bank': ledger(['A', 'B', 'HMRC']), 'Card': ledger(['TESCO'])}))
+    assert before['Card'] == after['Card']
+    assert before['Bank'] != after['Bank']
+    changed = sheet_fingerprints(create_workbook({'Bank': ledger(['HMRC']), 'Card': ledger(['TESCO EXPRESS'])}))
+    assert changed['Card'] != before['Card']
+    assert sheet_fingerprints(io.BytesIO(b'Amount,Date\n1,2\n')) is None
+
+
+def test_results_are_keyed_by_period_and_bounded():
+    cache = WorkbookResultCache(max_workbooks=1)
+    workbook = create_workbook({'Bank': ledger(['HMRC'])})
+    in_quarter, _ = cache.categorize(workbook, '6/4/2025-5/7/2025')
+    out_of_quarter, _ = cache.categorize(workbook, '1/1/2024-31/3/2024')
+    assert in_quarter['sheet_data'][0]['selected'] is True
+    assert out_of_quarter['sheet_data'][0]['selected'] is False
+    assert len(cache.workbooks) == 1 and cache.workbooks.evictions == 1
+    assert period_key('06/04/2025 - 05/07/2025') == period_key('6/4/2025-5/7/2025')
+
+
+def test_results_are_bounded_by_estimated_size():
+    small = create_workbook({'Bank': ledger(['HMRC'])})
+    large = create_workbook({'Bank': ledger([f'PAYEE {n}' for n in range(200)])})
+    probe = WorkbookResultCache()
+    small_size = result_size(probe.categorize(small)[0])
+    large_size = result_size(probe.categorize(large)[0])
+    assert 0 < small_size < large_size
+    cache = WorkbookResultCache(max_workbook_bytes=large_size, max_sheet_bytes=large_size)
+    cache.categorize(small)
+    cache.categorize(large)
+    assert len(cache.workbooks) == 1 and cache.workbooks.bytes == large_size, "The small result is evicted for room."
+    cache.categorize(small)
+    assert len(cache.workbooks) == 1 and cache.workbooks.stats()['bytes'] == small_size
+    too_small = WorkbookResultCache(max_workbook_bytes=small_size - 1, max_sheet_bytes=small_size - 1)
+    too_small.categorize(small)
+    assert len(too_small.workbooks) == 0 and too_small.workbooks.bytes == 0, "Oversized results are not cached."
+
+
+if __name__ == "__main__":
+    test_repeated_workbook_is_served_from_cache()
+    test_only_changed_sheet_is_reprocessed()
+    test_fingerprints_ignore_shared_string_positions()
+    test_results_are_keyed_by_period_and_bounded()
+    test_results_are_bounded_by_estimated_size()
+    print("All tests passed.")
@@ -0,0 +1,101 @@
+import io
+import pandas as pd
+import pytest
+import app as flask_app
+import workbook_formats
+from sheet_processing import categorize_excel_sheets_fuzzy, stream_workbook_records
+from test_dms_client import StubDMS, create_workbook_bytes
+from workbook_formats import (
+    CSV,
+    ODS,
+    XLS,
+    XLSX,
+    UnsupportedWorkbookFormat,
+    detect_workbook_format,
+    excel_engine,
+    open_workbook,
+    read_csv_frame
+)
+
+CSV_LEDGER = (b'\xef\xbb\xbfTxn Date;Narration;Amount;Amount;\n'
+              b'10/04/2025;HMRC;10.5;1;x\n'
+              b';;;;\n'
+              b'12/07/2025;AMAZON;20;2;y\n')
+
+
+def test_formats_are_detected_by_content_then_extension():
+    assert detect_workbook_format(io.BytesIO(create_workbook_bytes())) == XLSX
+    assert detect_workbook_format(io.BytesIO(b'PK\x03\x04\x14\x00\x00\x00\x00\x00mimetypeapplication/vnd.oasis.'
+                                             b'opendocument.spreadsheet')) == ODS
+    assert detect_workbook_format(io.BytesIO(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\0' * 100)) == XLS
+    assert detect_workbook_format(io.BytesIO(b'Date,Amount\n')) == CSV
+    # Text saved with an Excel extension is still read as delimited text
+    assert detect_workbook_format(io.BytesIO(b'Date\tAmount\n'), 'export.xls') == CSV
+    assert detect_workbook_format(io.BytesIO(b'\0\1garbage'), 'ledger.ods') == ODS
+    try:
+        detect_workbook_format(io.BytesIO(b'\0\1garbage'), 'ledger.pdf')
+        assert False, "Unknown binary files should be rejected."
+    except UnsupportedWorkbookFormat:
+        pass
+
+
+def test_csv_ledger_goes_through_the_same_pipeline():
+    frame = read_csv_frame(io.BytesIO(CSV_LEDGER))
+    assert list(frame.columns) == ['Txn Date', 'Narration', 'Amount', 'Amount.1', 'Unnamed: 4']
+    result = categorize_excel_sheets_fuzzy(io.BytesIO(CSV_LEDGER), '1/4/2025-30/6/2025', filename='ledger.csv')
+    [sheet] = result['sheet_data']
+    assert sheet['sheet_name'] == 'Sheet1'
+    assert sheet['column_mapping']['Date'] == 'Txn Date' and sheet['column_mapping']['Amount'] == 'Amount'
+    assert [row['Description'] for row in sheet['mapped_data']] == ['HMRC', 'AMAZON']
+    assert sheet['selected'] and str(sheet['max_date'].date()) == '2025-07-12'
+    records = list(stream_workbook_records(io.BytesIO(CSV_LEDGER), '1/4/2025-30/6/2025'))
+    assert [record['type'] for record in records] == ['rows', 'sheet', 'summary']
+    assert records[1]['row_count'] == 2 and records[1]['column_mapping'] == sheet['column_mapping']
+
+
+def test_missing_reader_is_reported_as_unsupported():
+    try:
+        excel_engine(XLS)
+        return  # An .xls reader is installed here
+    except UnsupportedWorkbookFormat as e:
+        assert 'xlrd' in str(e)
+    fake_xls = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\0' * 512
+    with StubDMS(), flask_app.app.test_client() as client:
+        response = client.post('/getData', data={'clientId': 'c1', 'file': (io.BytesIO(fake_xls), 'ledger.xls')},
+                               content_type='multipart/form-data')
+    assert response.status_code == 415 and 'xlrd' in response.get_json()['error']
+
+
+def test_csv_upload_matches_xlsx_upload():
+    csv_bytes = pd.read_excel(io.BytesIO(create_workbook_bytes())).to_csv(index=False).encode('utf-8')
+    with StubDMS() as dms, flask_app.app.test_client() as client:
+        from_csv = client.post('/getData', data={'clientId': 'c1', 'file': (io.BytesIO(csv_bytes), 'ledger.csv')},
+                               content_type='multipart/form-data')
+        from_xlsx = client.post('/getData', data={'clientId': 'c1', 'file': (io.BytesIO(create_workbook_bytes()),
+                                                                             'ledger.xlsx')},
+                                content_type='multipart/form-data')
+    assert from_csv.status_code == 200 and len(dms.uploads) == 2
+    assert from_csv.get_json() == from_xlsx.get_json()
+
+
+def test_calamine_reads_xlsx_like_openpyxl():
+    pytest.importorskip('python_calamine')
+    workbook = create_workbook_bytes()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(workbook_formats, 'XLSX_ENGINE', None)
+        assert excel_engine(XLSX) == 'calamine'
+        assert open_workbook(io.BytesIO(workbook)).engine == 'calamine'
+        from_calamine = categorize_excel_sheets_fuzzy(io.BytesIO(workbook), '1/4/2025-30/6/2025', workers=1)
+        patch.setattr(workbook_formats, 'XLSX_ENGINE', 'openpyxl')
+        from_openpyxl = categorize_excel_sheets_fuzzy(io.BytesIO(workbook), '1/4/2025-30/6/2025', workers=1)
+    assert from_calamine == from_openpyxl
+    assert [row['Description'] for row in from_calamine['sheet_data'][0]['mapped_data']] == ['HMRC', 'AMAZON']
+
+
+if __name__ == "__main__":
+    test_formats_are_detected_by_content_then_extension()
+    test_csv_ledger_goes_through_the_same_pipeline()
+    test_missing_reader_is_reported_as_unsupported()
+    test_csv_upload_matches_xlsx_upload()
+    test_calamine_reads_xlsx_like_openpyxl()
+    print("All tests passed.")
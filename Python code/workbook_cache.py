@@ -0,0 +1,246 @@
+# ----------------------
+# Workbook Result Cache
+# ----------------------
+# Caches categorize_excel_sheets_fuzzy results by a hash of the file content and
+# the quarter range, so reopening the same client file skips the parse entirely.
+# For .xlsx workbooks each sheet is also cached under its own fingerprint, so a
+# re-uploaded workbook with one changed sheet only re-processes that sheet.
+import hashlib
+import os
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from prediction_cache import LRUCache
+from date_engine import parse_quarter_range
+from instrumentation import stage
+from sheet_processing import categorize_excel_sheets_fuzzy
+
+DEFAULT_QUARTER_DATE_RANGE = '6/4/2025-5/7/2025'
+
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Shared-string cells, e.g. <c r="A1" s="1" t="s"><v>12</v></c>
+SHARED_STRING_CELL = re.compile(rb'(<c\b[^>]*\bt=["\']s["\'][^>]*>)<v>(\d+)</v>')
+SHARED_STRING_TYPE = re.compile(rb'\bt=["\']s["\']')
+SHARED_STRING_ITEM = re.compile(rb'<si\b[^>]*?(?:/>|>.*?</si>)', re.S)
+
+# Estimated memory per cached cell (the row dict entry, the value object and its key)
+CELL_BYTES = 100
+
+# Marks a sheet that was processed and skipped (empty, header only, ...)
+_SKIPPED = object()
+_MISSING = object()
+
+
+def content_hash(file, chunk_size=1024 * 1024):
+    """sha256 of a binary file object, read from the start."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def period_key(quarter_date_range):
+    """Normalized quarter range, so '6/4/2025-5/7/2025' and '06/04/2025 - 05/07/2025' share entries."""
+    start_date, end_date = parse_quarter_range(quarter_date_range or DEFAULT_QUARTER_DATE_RANGE)
+    return f"{start_date.date().isoformat()}/{end_date.date().isoformat()}"
+
+
+def _sheet_members(archive):
+    """(sheet name, zip member) pairs in workbook order."""
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{PACKAGE_RELATIONSHIP_NS}Relationship')}
+    members = []
+    for sheet in workbook.iter(f'{SPREADSHEET_NS}sheet'):
+        target = targets[sheet.get(f'{RELATIONSHIP_NS}id')]
+        member = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        members.append((sheet.get('name'), member))
+    return members
+
+
+def sheet_fingerprints(file):
+    """
+    Content fingerprint of every sheet of an .xlsx workbook, keyed by sheet name,
+    or None for anything that is not an .xlsx package.
+    A fingerprint covers the sheet XML with shared-string indexes replaced by the
+    strings themselves (other sheets' edits reshuffle the index), the styles that
+    decide which numbers are dates, and the workbook's date system.
+    """
+    try:
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+            strings = []
+            shared_strings = b''
+            if 'xl/sharedStrings.xml' in names:
+                shared_strings = archive.read('xl/sharedStrings.xml')
+                strings = SHARED_STRING_ITEM.findall(shared_strings)
+            styles = archive.read('xl/styles.xml') if 'xl/styles.xml' in names else b''
+            workbook = archive.read('xl/workbook.xml')
+            common = hashlib.sha256(styles)
+            common.update(b'date1904' if re.search(rb'date1904=["\'](1|true)["\']', workbook) else b'date1900')
+            fingerprints = {}
+            for sheet_name, member in _sheet_members(archive):
+                digest = common.copy()
+                digest.update(sheet_name.encode('utf-8') + b'\0')
+                xml = archive.read(member)
+                substituted = 0
+
+                def resolve(match):
+                    nonlocal substituted
+                    index = int(match.group(2))
+                    if index >= len(strings):
+                        return match.group(0)
+                    substituted += 1
+                    return match.group(1) + strings[index]
+
+                digest.update(SHARED_STRING_CELL.sub(resolve, xml))
+                if substituted != len(SHARED_STRING_TYPE.findall(xml)):
+                    # Some shared-string cells were not recognised; fall back to
+                    # hashing the whole string table so no change goes unnoticed
+                    digest.update(shared_strings)
+                fingerprints[sheet_name] = digest.hexdigest()
+            return fingerprints
+    except (zipfile.BadZipFile, KeyError, ET.ParseError):
+        return None
+    finally:
+        file.seek(0)
+
+
+def sheet_size(sheet):
+    """Estimated bytes held by a cached sheet entry: its rows times its columns."""
+    if not isinstance(sheet, dict):
+        return 0
+    if 'mapped_frame' in sheet:
+        frame = sheet['mapped_frame']
+        cells = frame.shape[0] * frame.shape[1]
+    else:
+        cells = sum(len(row) for row in sheet['mapped_data'])
+    return (cells + len(sheet['columns'])) * CELL_BYTES
+
+
+def result_size(result):
+    """Estimated bytes held by a cached workbook result."""
+    return sum(sheet_size(sheet) for sheet in result['sheet_data'])
+
+
+class WorkbookResultCache:
+    """
+    Two-level result cache: whole workbooks by (content hash, period), and for
+    .xlsx files individual sheets by (sheet fingerprint, period). Both levels are
+    LRU bounded by entries and by estimated size in bytes, and row (JSON) and
+    columnar results are cached separately. It also remembers the DMS ETag of
+    each fetched document so /getSheetData can revalidate instead of downloading
+    the file again.
+    """
+
+    def __init__(self, max_workbooks=64, max_sheets=512, ttl=None, max_workbook_bytes=256 * 1024 * 1024,
+                 max_sheet_bytes=256 * 1024 * 1024):
+        self.workbooks = LRUCache(max_size=max_workbooks, ttl=ttl, max_bytes=max_workbook_bytes, sizeof=result_size)
+        self.sheets = LRUCache(max_size=max_sheets, ttl=ttl, max_bytes=max_sheet_bytes, sizeof=sheet_size)
+        self.documents = LRUCache(max_size=max_workbooks * 4, ttl=ttl)
+        self.sheets_reused = 0
+        self.sheets_processed = 0
+
+    def cached_result(self, workbook_hash, quarter_date_range, columnar=False):
+        """The cached result for a workbook hash, or None."""
+        return self.workbooks.get((workbook_hash, period_key(quarter_date_range), columnar))
+
+    def categorize(self, file, quarter_date_range=None, client_id=None, columnar=False, filename=None):
+        """
+        categorize_excel_sheets_fuzzy with caching. file must be a seekable binary
+        file object. Returns (result, content hash). client_id (for header templates)
+        and filename (for format detection) are passed on; they do not change the
+        result, so they are not part of the key.
+        """
+        period = period_key(quarter_date_range)
+        with stage('content_hash'):
+            workbook_hash = content_hash(file)
+        result = self.workbooks.get((workbook_hash, period, columnar))
+        if result is not None:
+            return result, workbook_hash
+        with stage('sheet_fingerprints'):
+            fingerprints = sheet_fingerprints(file)
+        if fingerprints is None:
+            result = categorize_excel_sheets_fuzzy(file, quarter_date_range, client_id=client_id, columnar=columnar,
+                                                   filename=filename)
+        else:
+            result = self._categorize_sheets(file, quarter_date_range, period, fingerprints, client_id, columnar)
+        self.workbooks.set((workbook_hash, period, columnar), result)
+        return result, workbook_hash
+
+    def _categorize_sheets(self, file, quarter_date_range, period, fingerprints, client_id=None, columnar=False):
+        cached = {}
+        for sheet_name, fingerprint in fingerprints.items():
+            sheet = self.sheets.get((fingerprint, period, columnar), _MISSING)
+            if sheet is not _MISSING:
+                cached[sheet_name] = sheet
+        missing = [sheet_name for sheet_name in fingerprints if sheet_name not in cached]
+        self.sheets_reused += len(cached)
+        if missing:
+            processed = categorize_excel_sheets_fuzzy(file, quarter_date_range, sheet_names=missing,
+                                                     client_id=client_id, columnar=columnar)
+            by_name = {sheet['sheet_name']: sheet for sheet in processed['sheet_data']}
+            for sheet_name in missing:
+                sheet = by_name.get(sheet_name, _SKIPPED)
+                self.sheets.set((fingerprints[sheet_name], period, columnar), sheet)
+                cached[sheet_name] = sheet
+            self.sheets_processed += len(missing)
+        return {'sheet_data': [cached[sheet_name] for sheet_name in fingerprints
+                               if cached[sheet_name] is not _SKIPPED]}
+
+    def remember_document(self, document_key, etag, workbook_hash):
+        """Record the DMS ETag of a fetched document and the hash of its content."""
+        self.documents.set(document_key, (etag, workbook_hash))
+
+    def known_document(self, document_key):
+        """(etag, content hash) last seen for a document, or None."""
+        return self.documents.get(document_key)
+
+    def clear(self):
+        self.workbooks.clear()
+        self.sheets.clear()
+        self.documents.clear()
+
+    def stats(self):
+        return {
+            'workbooks': self.workbooks.stats(),
+            'sheets': self.sheets.stats(),
+            'documents': self.documents.stats(),
+            'sheets_reused': self.sheets_reused,
+            'sheets_processed': self.sheets_processed
+        }
+
+
+def result_etag(workbook_hash, quarter_date_range, response_format=None):
+    """
+    ETag for a /getSheetData response: the file content, the period it was checked
+    against and, for the Arrow and Parquet responses, the format.
+    """
+    tag = f"{workbook_hash}:{period_key(quarter_date_range)}"
+    if response_format:
+        tag = f"{tag}:{response_format}"
+    return hashlib.sha256(tag.encode()).hexdigest()[:32]
+
+
+def create_workbook_cache():
+    """
+    Build the workbook cache from environment settings: WORKBOOK_CACHE_SIZE (whole
+    workbooks, 0 disables), SHEET_CACHE_SIZE (individual sheets), their estimated
+    size limits WORKBOOK_CACHE_MB and SHEET_CACHE_MB, and WORKBOOK_CACHE_TTL in
+    seconds.
+    """
+    ttl = os.environ.get('WORKBOOK_CACHE_TTL')
+    return WorkbookResultCache(
+        max_workbooks=int(os.environ.get('WORKBOOK_CACHE_SIZE', '64')),
+        max_sheets=int(os.environ.get('SHEET_CACHE_SIZE', '512')),
+        ttl=float(ttl) if ttl else None,
+        max_workbook_bytes=int(float(os.environ.get('WORKBOOK_CACHE_MB', '256')) * 1024 * 1024),
+        max_sheet_bytes=int(float(os.environ.get('SHEET_CACHE_MB', '256')) * 1024 * 1024)
+    )
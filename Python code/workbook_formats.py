@@ -0,0 +1,189 @@
+# ----------------------
+# Workbook Formats
+# ----------------------
+# Detects what kind of file was uploaded and opens it with the fastest reader
+# installed, so .csv, .xls and .ods files go through the same mapping and
+# quarter selection as .xlsx workbooks:
+#   xlsx  calamine (python-calamine) if installed, else openpyxl
+#   xls   calamine, else xlrd
+#   ods   calamine, else odf (odfpy)
+#   csv   pyarrow's multithreaded CSV reader, else pandas
+# The format comes from the file's magic bytes; the extension is only used when
+# the content does not say (CSV files have no signature).
+import csv
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+XLSX, XLS, ODS, CSV = 'xlsx', 'xls', 'ods', 'csv'
+
+EXTENSION_FORMATS = {
+    '.xlsx': XLSX,
+    '.xlsm': XLSX,
+    '.xls': XLS,
+    '.ods': ODS,
+    '.csv': CSV,
+    '.txt': CSV,
+}
+
+ZIP_MAGIC = b'PK\x03\x04'
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ODS_MIMETYPE = b'application/vnd.oasis.opendocument.spreadsheet'
+
+# Pandas engines per format, fastest first, with the module each one needs
+ENGINES = {
+    XLSX: [('calamine', 'python_calamine'), ('openpyxl', 'openpyxl')],
+    XLS: [('calamine', 'python_calamine'), ('xlrd', 'xlrd')],
+    ODS: [('calamine', 'python_calamine'), ('odf', 'odf')],
+}
+
+# Force an engine for .xlsx files (e.g. openpyxl), instead of the fastest installed
+XLSX_ENGINE = os.environ.get('XLSX_ENGINE') or None
+
+# A CSV file becomes a workbook with a single sheet of this name
+CSV_SHEET_NAME = 'Sheet1'
+
+# Bytes read to detect the format and the CSV delimiter
+SNIFF_SIZE = 64 * 1024
+
+
+class UnsupportedWorkbookFormat(ValueError):
+    """The file is not a workbook format we can read, or its reader is not installed."""
+
+
+def _read_head(file, size=SNIFF_SIZE):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as handle:
+            return handle.read(size)
+    position = file.tell()
+    try:
+        return file.read(size)
+    finally:
+        file.seek(position)
+
+
+def _extension(file, filename=None):
+    name = filename or (os.fspath(file) if isinstance(file, (str, os.PathLike)) else getattr(file, 'name', None))
+    return os.path.splitext(name)[1].lower() if isinstance(name, str) else ''
+
+
+def detect_workbook_format(file, filename=None):
+    """
+    'xlsx', 'xls', 'ods' or 'csv' for a path or seekable binary file. filename
+    (or the path) supplies the extension used when the content is inconclusive.
+    """
+    head = _read_head(file)
+    if head.startswith(ZIP_MAGIC):
+        # ODF packages store their mimetype uncompressed as the first member
+        return ODS if ODS_MIMETYPE in head[:128] else XLSX
+    if head.startswith(OLE2_MAGIC):
+        return XLS
+    if b'\0' not in head:
+        # Text: bank exports saved as "xls" are often CSV or tab-separated too
+        return CSV
+    detected = EXTENSION_FORMATS.get(_extension(file, filename))
+    if detected is None or detected == CSV:
+        raise UnsupportedWorkbookFormat('Unrecognised file format; expected .xlsx, .xls, .ods or .csv')
+    return detected
+
+
+def _installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def excel_engine(workbook_format):
+    """The pandas engine to read a workbook format with, fastest installed first."""
+    if workbook_format == XLSX and XLSX_ENGINE:
+        return XLSX_ENGINE
+    for engine, module in ENGINES[workbook_format]:
+        if _installed(module):
+            return engine
+    needed = ' or '.join(module.replace('_', '-') for _, module in ENGINES[workbook_format])
+    raise UnsupportedWorkbookFormat(f'Reading .{workbook_format} files needs {needed} installed on the server')
+
+
+def sniff_delimiter(head):
+    """The delimiter of a CSV sample: comma, semicolon, tab or pipe (comma if unsure)."""
+    sample = head.decode('utf-8', errors='replace')
+    # Drop a possibly truncated last line
+    sample = sample[:sample.rfind('\n') + 1] or sample
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+
+def unique_column_names(names):
+    """Column names as pandas.read_csv gives them: 'Unnamed: n' for blanks, '.1' suffixes for repeats."""
+    columns = []
+    seen = {}
+    for position, name in enumerate(names):
+        name = name if name != '' else f'Unnamed: {position}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def read_csv_frame(file):
+    """
+    Read a CSV ledger into a DataFrame with pyarrow's multithreaded reader. Files
+    it rejects (other encodings, quoted line breaks...) are read by pandas.
+    """
+    delimiter = sniff_delimiter(_read_head(file))
+    if pa_csv is not None:
+        position = None if isinstance(file, (str, os.PathLike)) else file.tell()
+        try:
+            table = pa_csv.read_csv(
+                file,
+                read_options=pa_csv.ReadOptions(use_threads=True),
+                parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+                # Empty cells are missing values, as pandas reads them
+                convert_options=pa_csv.ConvertOptions(strings_can_be_null=True)
+            )
+            return table.rename_columns(unique_column_names(table.column_names)).to_pandas()
+        except (pa.ArrowInvalid, UnicodeDecodeError):
+            if position is not None:
+                file.seek(position)
+    return pd.read_csv(file, sep=delimiter, encoding_errors='replace')
+
+
+class CsvWorkbook:
+    """A CSV file with the sheet_names/parse interface of pandas.ExcelFile."""
+
+    sheet_names = [CSV_SHEET_NAME]
+
+    def __init__(self, file):
+        self.file = file
+        self._frame = None
+
+    def parse(self, sheet_name=CSV_SHEET_NAME):
+        if sheet_name != CSV_SHEET_NAME:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        if self._frame is None:
+            self._frame = read_csv_frame(self.file)
+        return self._frame
+
+
+def open_workbook(file, filename=None):
+    """
+    Open a path or seekable binary file as a workbook: a pandas.ExcelFile using
+    the fastest engine for its format, or a CsvWorkbook.
+    """
+    workbook_format = detect_workbook_format(file, filename)
+    if workbook_format == CSV:
+        return CsvWorkbook(file)
+    return pd.ExcelFile(file, engine=excel_engine(workbook_format))